@@ -1,45 +1,131 @@
 # --- Flask & CORS Setup ---
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, g
 from flask_cors import CORS # to allow requests to a different domain
 
 # --- Utility Libraries ---
 from datetime import datetime, timezone
+import json
 import os
+import time
 from dotenv import load_dotenv 
 load_dotenv() # loads environment variables from .env into Python environment
 
 # --- ML & Data Handling ---
-import joblib # a python library used mainly for saving and loading training ML models
 import numpy as np
 
-# --- Initialize Firebase (Admin SDK + Firestore Client) ---
-import firebase_admin
-from firebase_admin import credentials, firestore, auth
-
-# The Firebase Admin SDK is initialised using a service account key file which is a secure JSON file downloaded from the Firebase project.
-cred_path = os.getenv("FIREBASE_CREDENTIALS")
-cred = credentials.Certificate(cred_path)
-firebase_admin.initialize_app(cred) # create a Firebase app instance on this Flask server
-
-db = firestore.client() # access to Firestore
-
-# --- Stripe SDK ---
-import stripe
-
-stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+import drift
+import feature_store
+import features
+import ledger
+import metrics
+import phone_index
+import prediction_log
+import rollups
+import services
+import velocity
+from auth_cache import require_auth, token_cache
+from batch_io import BatchInputError, iter_chunks, parse_batch
+from card_cache import VERSION_FIELD, card_cache, card_version
+from model_registry import FixedModel, ModelRegistry, check_version, load_artifacts, load_version
+from profiler import profiler
+from scoring import BatchScorer, predict_proba, prediction_from_proba, predictions_from_proba
+from shadow import ShadowScorer
+
+# --- Firebase, Firestore and Stripe ---
+# Initialised on first use (see services.py), so importing the app stays cheap
+db = services.LazyProxy(services.firestore_client)
+stripe = services.LazyProxy(services.stripe_client)
 STRIPE_PUBLIC_KEY = os.getenv("STRIPE_PUBLIC_KEY")
 
 # --- Load Model Artifacts ---
+# With MODEL_REGISTRY_DIR set, the registry's active version is served and hot-swapped
+# (see model_registry.py); otherwise the single artifact at MODEL_PATH is used.
+# Either way it is loaded by the first request that scores (or by the warm-up).
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR")
 MODEL_PATH = os.getenv("MODEL_PATH", "model/fraud_model.pkl")
 MODEL_VERSION = os.getenv("MODEL_VERSION", "v1")
-THRESHOLD = float(os.getenv("THRESHOLD", "0.5"))
-
-model = joblib.load(MODEL_PATH)
+THRESHOLD_OVERRIDE = os.getenv("THRESHOLD")  # otherwise the threshold train.py stored with the model
+
+def load_models():
+    if MODEL_REGISTRY_DIR:
+        return ModelRegistry(MODEL_REGISTRY_DIR, poll_seconds=float(os.getenv("MODEL_POLL_SECONDS", "5")))
+    # COMPILED_MODEL_PATH points at the NumPy-only predictor written by train.py; it scores
+    # batches of up to COMPILED_MAX_ROWS rows and MODEL_PATH's XGBoost model the rest
+    return FixedModel(load_artifacts(
+        MODEL_VERSION,
+        MODEL_PATH,
+        os.getenv("COMPILED_MODEL_PATH"),
+        os.getenv("FEATURE_COLUMNS_PATH", "feature_columns.csv"),
+        os.getenv("MODEL_META_PATH", os.path.splitext(MODEL_PATH)[0] + ".meta.json"),
+    ))
+
+models = services.LazyProxy(services.Lazy("model", load_models))
+
+def flag_threshold(active):
+    """Scores at or above this are held for OTP verification (and reported as prediction 1)."""
+    return float(THRESHOLD_OVERRIDE) if THRESHOLD_OVERRIDE else active.threshold
+
+# /predict/batch switches to a chunked NDJSON response above BATCH_STREAM_ROWS rows
+BATCH_CHUNK_ROWS = int(os.getenv("BATCH_CHUNK_ROWS", "10000"))
+BATCH_STREAM_ROWS = int(os.getenv("BATCH_STREAM_ROWS", "10000"))
+
+# Requests arriving within SCORER_MAX_WAIT_MS of each other share one predict_proba call
+scorer = BatchScorer(
+    lambda: models.get(),
+    max_wait_ms=float(os.getenv("SCORER_MAX_WAIT_MS", "2")),
+    max_batch_size=int(os.getenv("SCORER_MAX_BATCH", "64")),
+)
+
+def score_values(values, monitor=False):
+    """Score one transaction's raw feature values using the feature columns of the model that scores it.
+
+    With monitor=True the row and its score are also counted for drift monitoring.
+    """
+    active = models.get()
+    with metrics.stage("feature_build"):
+        row = features.feature_row(values, active.feature_columns)
+    with metrics.stage("inference"):
+        _, proba, loaded = scorer.score(row)
+    if loaded.feature_columns != active.feature_columns:
+        # A hot swap changed the feature set between building the row and scoring it
+        row = features.feature_row(values, loaded.feature_columns)
+        proba = float(predict_proba(loaded, row[None, :])[0])
+    prediction = prediction_from_proba(proba, flag_threshold(loaded))
+    if monitor:
+        drift_monitor.observe(loaded, row, proba)
+    return prediction, proba, loaded
+
+# Live feature and score histograms against the model's training reference (see drift.py)
+drift_monitor = drift.DriftMonitor(db)
+
+# Per-user 1m/1h/24h transaction windows (see velocity.py)
+velocity_index = velocity.VelocityIndex(velocity.firestore_history(db))
+
+# Phone number -> uid for transfer recipients (see phone_index.py)
+recipients = phone_index.PhoneIndex(db)
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
 CORS(app) 
 
+# PROFILER_TOKEN enables /debug/profiler (sent back in the X-Profiler-Token header)
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN")
+
+@app.before_request
+def start_request_metrics():
+    # Stage timings and Firestore counts are attributed to the matched route
+    route = request.endpoint or "unmatched"
+    g.metrics_token = metrics.begin_request(route)
+    g.request_started = time.perf_counter()
+    profiler.request_started(route)
+
+@app.teardown_request
+def finish_request_metrics(exc=None):
+    profiler.request_finished()
+    if "metrics_token" in g:
+        metrics.STAGE_SECONDS.labels(request.endpoint or "unmatched", "total").observe(time.perf_counter() - g.request_started)
+        metrics.end_request(g.pop("metrics_token"))
+
 # --- Firebase Config ---
 def get_firebase_config():
     return {
@@ -91,6 +177,12 @@ def create_stripe_customer():
         metadata={"firebase_uid": uid}
     )
 
+    # Index the number the user document holds (written by the client just before this call), not the request's
+    user_doc = db.collection("users").document(uid).get()
+    metrics.firestore_reads()
+    if user_doc.exists and user_doc.get("phone"):
+        recipients.register(user_doc.get("phone"), uid)
+
     return jsonify({"customer_id": customer.id})
 
 # --- Success Registration Page ---
@@ -109,7 +201,8 @@ def add_card_page():
         uid = data.get("uid")
         token = data.get("token")
 
-        doc = db.collection("users").document(uid).get()
+        user_ref = db.collection("users").document(uid)
+        doc = user_ref.get()
         if not doc.exists:
             return jsonify({"success": False, "error": "User not found"}), 404
 
@@ -120,47 +213,34 @@ def add_card_page():
                 customer_id,
                 source=token
             )
+            card_cache.invalidate(customer_id)
+            # Other workers drop their cached summary when they read the new version
+            from google.cloud.firestore_v1.transforms import Increment
+            after_commit("Card version bump", user_ref.update, {VERSION_FIELD: Increment(1)})
             return jsonify({"success": True}), 200
         except Exception as e:
             return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route("/api/get-linked-card", methods=["POST"])
-def get_linked_card():
-    id_token = request.json.get("idToken")
-
-    if not id_token:
-        return jsonify({"error": "Missing ID token"}), 401
-
+@require_auth
+def get_linked_card(uid):
     try:
-        # 1. Verify Firebase ID token and extract UID
-        decoded_token = auth.verify_id_token(id_token)
-        uid = decoded_token["uid"]
-
-        # 2. Look up Firestore 'users' collection
+        # 1. Look up Firestore 'users' collection
         doc = db.collection("users").document(uid).get()
         if not doc.exists:
             return jsonify({"error": "User not found in Firestore"}), 404
 
-        customer_id = doc.to_dict().get("stripeCustomerId")
+        user_data = doc.to_dict()
+        customer_id = user_data.get("stripeCustomerId")
         if not customer_id:
             return jsonify({"error": "No Stripe customer ID stored in Firestore"}), 404
 
-        # 3. Fetch Stripe cards using stored customer ID
-        cards = stripe.PaymentMethod.list(
-            customer=customer_id,
-            type="card"
-        )
-
-        if not cards.data:
+        # 2. Card summary for the stored customer ID (cached, one Stripe call per burst)
+        card = card_cache.get(customer_id, card_version(user_data))
+        if card is None:
             return jsonify({"error": "No linked card found"}), 404
 
-        card = cards.data[0].card
-        return jsonify({
-            "brand": card["brand"],
-            "last4": card["last4"],
-            "exp_month": card["exp_month"],
-            "exp_year": card["exp_year"]
-        })
+        return jsonify(card)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -206,15 +286,12 @@ def success_withdraw():
     return render_template("success_withdraw.html")
 
 @app.route("/api/save-iban", methods=["POST"])
-def save_iban():
+@require_auth
+def save_iban(uid):
     data = request.get_json()
-    id_token = data.get("idToken")
     iban = data.get("iban")
 
     try:
-        decoded_token = auth.verify_id_token(id_token)
-        uid = decoded_token["uid"]
-
         db.collection("users").document(uid).set({"iban": iban}, merge=True)
 
         return jsonify({"success": True})
@@ -224,207 +301,322 @@ def save_iban():
 
 @app.route('/predict', methods=['POST'])
 def predict():
-    data = request.get_json()
-
-    features = np.array([[
-        data['wallet_ratio'], data['hour_of_day'], data['amount'],
-        data['receiver_freq'], data['sender_freq'], data['is_merchant'],
-        data['type_CASH_IN'], data['type_CASH_OUT'], data['type_DEBIT'],
-        data['type_PAYMENT'], data['type_TRANSFER']
-    ]])
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object of feature values"}), 400
 
-    prediction = model.predict(features)[0]
-    probability = model.predict_proba(features)[0][1]
+    # Accepts the one-hot type_* fields or a raw "type"; velocity fields are optional
+    try:
+        prediction, probability, _ = score_values(data)
+    except KeyError as e:
+        return jsonify({"error": str(e)}), 400
 
     return jsonify({
         'prediction': int(prediction),
         'probability': float(probability)
     })
 
-# Add this route to app.py
-@app.route("/api/transaction", methods=["POST"])
-def unified_transaction():
-    data = request.get_json()
-    tx_type = data.get("txType")  # 'CASH_IN', 'CASH_OUT', 'TRANSFER'
-    id_token = data.get("idToken")
-    amount = float(data.get("amount", 0))
-    contact = data.get("contact")  # only for TRANSFER
-
-    if not id_token or not tx_type or amount <= 0:
-        return jsonify({"success": False, "message": "Missing or invalid fields"}), 400
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    # Accepts JSON rows, JSON columns, NPY or Arrow IPC bodies (see batch_io.parse_batch)
+    active = models.get()  # one model version for the whole batch, even across a hot swap
+    try:
+        X = parse_batch(request.get_data(), request.content_type, active.feature_columns)
+    except BatchInputError as e:
+        return jsonify({"error": str(e), "feature_columns": active.feature_columns}), 400
+
+    threshold = flag_threshold(active)
+    stream = request.args.get("stream") == "1" or X.shape[0] > BATCH_STREAM_ROWS
+    if not stream:
+        probabilities = predict_proba(active, X)
+        return jsonify({
+            "model_version": active.version,
+            "threshold": threshold,
+            "prediction": predictions_from_proba(probabilities, threshold).tolist(),
+            "probability": probabilities.tolist()
+        })
 
+    def generate():
+        # One JSON line per chunk, so the whole result never has to be held in memory
+        for offset, chunk in iter_chunks(X, BATCH_CHUNK_ROWS):
+            probabilities = predict_proba(active, chunk)
+            yield json.dumps({
+                "model_version": active.version,
+                "offset": offset,
+                "threshold": threshold,
+                "prediction": predictions_from_proba(probabilities, threshold).tolist(),
+                "probability": probabilities.tolist()
+            }) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+@app.route('/readyz')
+def readyz():
+    # 503 until Firebase, Stripe and the model are initialised; the first probe starts the warm-up
+    if services.ready():
+        return jsonify({"ready": True, "services": services.status()})
+    services.start_warmup(warm_inference)
+    return jsonify({"ready": False, "services": services.status()}), 503
+
+@app.route('/api/drift')
+def drift_report():
+    # Live traffic of the active model vs its training reference; ?days=N sums the last N UTC days over all workers
     try:
-        decoded_token = auth.verify_id_token(id_token)
-        uid = decoded_token["uid"]
-        user_ref = db.collection("users").document(uid)
-        user_doc = user_ref.get()
-        if not user_doc.exists:
-            return jsonify({"error": "User not found"}), 404
+        days = min(max(int(request.args.get("days", 1)), 1), drift.MAX_DAYS)
+    except ValueError:
+        return jsonify({"error": "days must be an integer"}), 400
+    return jsonify(drift_monitor.report(models.get(), days))
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.exposition(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/debug/profiler', methods=["GET", "POST"])
+def profiler_control():
+    # GET: collapsed stacks of slow requests (flamegraph.pl / speedscope input)
+    # POST {"action": "start", "interval_ms": 10, "min_request_ms": 200} | {"action": "stop"} | {"action": "reset"}
+    if not PROFILER_TOKEN or request.headers.get("X-Profiler-Token") != PROFILER_TOKEN:
+        return jsonify({"error": "Not found"}), 404
+    if request.method == "GET":
+        return Response(profiler.collapsed(), mimetype="text/plain")
+
+    data = request.get_json(silent=True) or {}
+    action = data.get("action")
+    if action == "start":
+        profiler.start(float(data.get("interval_ms", 10)), float(data.get("min_request_ms", 200)))
+    elif action == "stop":
+        profiler.stop()
+    elif action == "reset":
+        profiler.reset()
+    else:
+        return jsonify({"error": "action must be start, stop or reset"}), 400
+    return jsonify(profiler.status())
+
+@app.route('/api/scorer-stats')
+def scorer_stats():
+    # Batch-size and queue-wait histograms for tuning SCORER_MAX_WAIT_MS / SCORER_MAX_BATCH
+    return jsonify(metrics.snapshot_all())
+
+@app.route('/api/auth-cache-stats')
+def auth_cache_stats():
+    return jsonify(token_cache.stats())
+
+@app.route('/api/card-cache-stats')
+def card_cache_stats():
+    return jsonify(card_cache.stats())
+
+@app.route('/api/phone-index-stats')
+def phone_index_stats():
+    return jsonify(recipients.stats())
+
+@app.route('/api/prediction-log-stats')
+def prediction_log_stats():
+    return jsonify(predictions.stats() if predictions is not None else {"enabled": False})
+
+# --- Transactions ---
+def normalize_contact(contact):
+    return phone_index.normalize(contact)
+
+def find_recipient_uid(contact):
+    return recipients.lookup(contact)
+
+def after_commit(step, fn, *args, **kwargs):
+    """Run bookkeeping for a committed change (a ledger write, a new card); a failure is logged and never changes the response."""
+    try:
+        fn(*args, **kwargs)
+    except Exception as e:
+        print(f"{step} failed after commit:", e)
+
+def process_transaction(uid, user_ref, user_data, tx_type, amount, contact=None, recipient_uid=None):
+    """Score and commit one transaction for an already-loaded user; returns (body, status).
+
+    Shared by the Flask route below and the async route in async_app.py, which
+    do their own token check, user read and recipient lookup first.
+    """
+    phone = user_data.get("phone", "unknown")
+    balance = float(user_data.get("balance", 0))
+    now = datetime.now(timezone.utc)
+    hour = now.hour
+
+    with metrics.stage("history_read"):
+        stats = feature_store.load_stats(db, user_ref, user_data)
+    sender_freq, receiver_freq = feature_store.history_features(stats, tx_type)
+    wallet_ratio = amount / balance if balance > 0 else 0.5
+    is_merchant = 0
+
+    # Activity in the last 1m/1h/24h before this transaction
+    with metrics.stage("velocity"):
+        velocity_features = velocity_index.features(uid, tx_type, now)
+
+    values = {
+        "wallet_ratio": wallet_ratio,
+        "hour_of_day": hour,
+        "amount": amount,
+        "receiver_freq": receiver_freq,
+        "sender_freq": sender_freq,
+        "is_merchant": is_merchant,
+        "type": tx_type,
+        **velocity_features
+    }
 
-        user_data = user_doc.to_dict()
-        phone = user_data.get("phone", "unknown")
-        balance = float(user_data.get("balance", 0))
-        now = datetime.now(timezone.utc)
-        hour = now.hour
-
-        txns = list(user_ref.collection("transactions").stream())
-        txns_data = [t.to_dict() for t in txns]
-        sender_freq = len(txns_data)
-        receiver_freq = sum(1 for t in txns_data if t.get("type") == tx_type)
-        wallet_ratio = amount / balance if balance > 0 else 0.5
-        is_merchant = 0
-
-        all_types = ["CASH_IN", "CASH_OUT", "DEBIT", "PAYMENT", "TRANSFER"]
-        type_flags = {f"type_{t}": int(t == tx_type) for t in all_types}
-
-        features = {
-            "wallet_ratio": wallet_ratio,
-            "hour_of_day": hour,
+    prediction, fraud_score, active = score_values(values, monitor=True)
+    # One rule for the OTP hold and the isFlagged field: the score reached flag_threshold(active)
+    is_fraud = bool(prediction)
+    is_flagged = is_fraud
+
+    txn_data = {
+        "type": tx_type,
+        "amount": amount,
+        "timestamp": now,
+        "fraud": is_fraud,
+        "fraud_score": float(fraud_score),
+        "verified": not is_fraud,
+        "prediction": int(prediction),
+        "model_version": active.version,
+        "label": "pending" if is_fraud else "legit",
+        "wallet_ratio": wallet_ratio,
+        "hour_of_day": hour,
+        "sender_freq": sender_freq,
+        "receiver_freq": receiver_freq,
+        "is_merchant": is_merchant,
+        "isFlagged": is_flagged,
+        **velocity_features  # exported with the row, so train.py --velocity can learn from them
+    }
+
+    def log_decision(txn_ref):
+        # Queued for the background log writer; challengers score the same feature vector off the request thread
+        if predictions is None:
+            return
+        columns = features.FEATURE_COLUMNS + features.VELOCITY_COLUMNS
+        raw = dict(zip(columns, features.feature_row(values, columns).tolist()))
+        record = prediction_log.prediction_record(txn_ref.id, uid, tx_type, amount, now, raw, fraud_score, prediction,
+                                                  active.version, txn_data["label"])
+        predictions.submit(record)
+        if shadow:
+            shadow.submit(record)
+
+    # TRANSFER LOGIC
+    if tx_type == "TRANSFER":
+        if balance < amount:
+            return {"success": False, "message": "Insufficient balance"}, 400
+
+        sent_txn = {
+            **txn_data,
+            "direction": "out",
+            "type": f"TRANSFER Sent to {contact}",
+            "counterparty": contact,
+            "verified": True
+        }
+        if is_fraud:
+            # Log but do NOT credit recipient yet
+            sent_txn.update({"recipient_uid": recipient_uid, "verified": False, "flag_history": True})
+        received_txn = {
+            **txn_data,
             "amount": amount,
-            "receiver_freq": receiver_freq,
-            "sender_freq": sender_freq,
-            "is_merchant": is_merchant,
-            **type_flags
+            "direction": "in",
+            "type": f"TRANSFER Received from {phone}",
+            "counterparty": phone,
+            "verified": True
         }
 
-        prediction = model.predict([list(features.values())])[0]
-        fraud_score = model.predict_proba([list(features.values())])[0][1]
-        is_fraud = bool(prediction)
-        is_flagged = bool(fraud_score >= THRESHOLD)
+        # Balance re-check, debit, credit and both ledger entries commit together
+        try:
+            with metrics.stage("ledger_commit"):
+                txn_ref = ledger.transfer(db, user_ref, db.collection("users").document(recipient_uid),
+                                          amount, sent_txn, received_txn, flagged=is_fraud)
+        except ledger.InsufficientBalance:
+            return {"success": False, "message": "Insufficient balance"}, 400
+        after_commit("Velocity update", velocity_index.record, uid, sent_txn["type"], amount, now)
+        after_commit("Velocity update", velocity_index.record, recipient_uid, received_txn["type"], amount, now,
+                     seed=False)
+        after_commit("Prediction logging", log_decision, txn_ref)
+
+        if is_fraud:
+            return {
+                "success": True,
+                "flagged": True,
+                "fraud": True,
+                "fraud_score": float(fraud_score),
+                "contact": contact,
+                "recipient_uid": recipient_uid
+            }, 200
 
-        txn_data = {
-            "type": tx_type,
-            "amount": amount,
-            "timestamp": now,
-            "fraud": is_fraud,
+        return {
+            "success": True,
+            "fraud": False,
             "fraud_score": float(fraud_score),
-            "verified": not is_fraud,
-            "prediction": int(prediction),
-            "model_version": MODEL_VERSION,
-            "label": "pending" if is_fraud else "legit",
-            "wallet_ratio": wallet_ratio,
-            "hour_of_day": hour,
-            "sender_freq": sender_freq,
-            "receiver_freq": receiver_freq,
-            "is_merchant": is_merchant,
-            "isFlagged": is_flagged
-        }
+            "contact": contact
+        }, 200
 
-        # TRANSFER LOGIC
-        if tx_type == "TRANSFER":
-            if not contact:
-                return jsonify({"success": False, "message": "Missing contact for PiggyPay"}), 400
-            contact = contact if contact.startswith("+65") else f"+65{contact}"
-            if contact == phone:
-                return jsonify({"success": False, "message": "Cannot send to self"}), 400
+    # CASH_IN / CASH_OUT
+    elif tx_type in ("CASH_IN", "CASH_OUT"):
 
-            recipient_docs = list(db.collection("users").where("phone", "==", contact).limit(1).stream())
-            if not recipient_docs:
-                return jsonify({"success": False, "message": "Recipient not found"}), 404
+        if tx_type == "CASH_OUT" and balance < amount:
+            return {"success": False, "message": "Insufficient balance"}, 400
 
-            recipient_doc = recipient_docs[0]
-            recipient_uid = recipient_doc.id
-
-            if balance < amount:
-                return jsonify({"success": False, "message": "Insufficient balance"}), 400
-
-            if is_fraud:
-                # Log but do NOT credit recipient yet
-                user_ref.update({"has_fraud_alert": True})
-                user_ref.collection("transactions").add({
-                    **txn_data,
-                    "direction": "out",
-                    "type": f"TRANSFER Sent to {contact}",
-                    "counterparty": contact,
-                    "recipient_uid": recipient_uid,
-                    "verified": False,
-                    "flag_history": True
-                })
-                return jsonify({
-                    "success": True,
-                    "flagged": True,
-                    "fraud": True,
-                    "fraud_score": float(fraud_score),
-                    "contact": contact,
-                    "recipient_uid": recipient_uid
-                }), 200
-
-            # If NOT fraud: proceed with balance changes
-            user_ref.update({"balance": firestore.Increment(-amount)})
-            user_ref.collection("transactions").add({
-                **txn_data,
-                "direction": "out",
-                "type": f"TRANSFER Sent to {contact}",
-                "counterparty": contact,
-                "verified": True
-            })
-
-            db.collection("users").document(recipient_uid).update({"balance": firestore.Increment(amount)})
-            db.collection("users").document(recipient_uid).collection("transactions").add({
-                **txn_data,
-                "amount": amount,
-                "direction": "in",
-                "type": f"TRANSFER Received from {phone}",
-                "counterparty": phone,
-                "verified": True
-            })
-
-            return jsonify({
-                "success": True,
-                "fraud": False,
-                "fraud_score": float(fraud_score),
-                "contact": contact
-            }), 200
-
-        # CASH_IN
-        elif tx_type == "CASH_IN":
-            user_ref.collection("transactions").add(txn_data)
-
-            if is_fraud:
-                user_ref.update({"has_fraud_alert": True})
-                return jsonify({
-                    "success": True,
-                    "flagged": True,
-                    "fraud": True,
-                    "fraud_score": float(fraud_score),
-                    "contact": None
-                }), 200
-
-            user_ref.update({"balance": firestore.Increment(amount)})
-
-            return jsonify({
+        try:
+            commit = ledger.cash_in if tx_type == "CASH_IN" else ledger.cash_out
+            with metrics.stage("ledger_commit"):
+                txn_ref = commit(db, user_ref, amount, txn_data, flagged=is_fraud)
+        except ledger.InsufficientBalance:
+            return {"success": False, "message": "Insufficient balance"}, 400
+        after_commit("Velocity update", velocity_index.record, uid, tx_type, amount, now)
+        after_commit("Prediction logging", log_decision, txn_ref)
+
+        if is_fraud:
+            return {
                 "success": True,
-                "fraud": False,
+                "flagged": True,
+                "fraud": True,
                 "fraud_score": float(fraud_score),
                 "contact": None
-            }), 200
+            }, 200
 
-        # CASH_OUT
-        elif tx_type == "CASH_OUT":
+        return {
+            "success": True,
+            "fraud": False,
+            "fraud_score": float(fraud_score),
+            "contact": None
+        }, 200
 
-            if balance < amount:
-                return jsonify({"success": False, "message": "Insufficient balance"}), 400
+    return {"success": False, "message": "Unsupported transaction type"}, 400
 
-            user_ref.collection("transactions").add(txn_data)
+@app.route("/api/transaction", methods=["POST"])
+@require_auth
+def unified_transaction(uid):
+    data = request.get_json()
+    tx_type = data.get("txType")  # 'CASH_IN', 'CASH_OUT', 'TRANSFER'
+    amount = float(data.get("amount", 0))
+    contact = data.get("contact")  # only for TRANSFER
 
-            if is_fraud:
-                user_ref.update({"has_fraud_alert": True})
-                return jsonify({
-                    "success": True,
-                    "flagged": True,
-                    "fraud": True,
-                    "fraud_score": float(fraud_score),
-                    "contact": None
-                }), 200
+    if not tx_type or amount <= 0:
+        return jsonify({"success": False, "message": "Missing or invalid fields"}), 400
 
-            user_ref.update({"balance": firestore.Increment(-amount)})
+    try:
+        user_ref = db.collection("users").document(uid)
+        with metrics.stage("user_read"):
+            user_doc = user_ref.get()
+        metrics.firestore_reads()
+        if not user_doc.exists:
+            return jsonify({"error": "User not found"}), 404
+        user_data = user_doc.to_dict()
 
-            return jsonify({
-                "success": True,
-                "fraud": False,
-                "fraud_score": float(fraud_score),
-                "contact": None
-            }), 200
+        recipient_uid = None
+        if tx_type == "TRANSFER":
+            if not contact:
+                return jsonify({"success": False, "message": "Missing contact for PiggyPay"}), 400
+            contact = normalize_contact(contact)
+
+            with metrics.stage("recipient_lookup"):
+                recipient_uid = find_recipient_uid(contact)
+            if not recipient_uid:
+                return jsonify({"success": False, "message": "Recipient not found"}), 404
+            # Compared by account: the stored phone may not be in normalized form
+            if recipient_uid == uid:
+                return jsonify({"success": False, "message": "Cannot send to self"}), 400
+
+        body, status = process_transaction(uid, user_ref, user_data, tx_type, amount, contact, recipient_uid)
+        return jsonify(body), status
 
     except Exception as e:
         print("/api/transaction error:", e)
@@ -432,40 +624,14 @@ def unified_transaction():
 
 # OTP Verification Finalization Endpoint
 @app.route("/api/verify-transaction", methods=["POST"])
-def verify_transaction():
-    data = request.get_json()
-    id_token = data.get("idToken")
-
+@require_auth
+def verify_transaction(uid):
     try:
-        decoded_token = auth.verify_id_token(id_token)
-        uid = decoded_token["uid"]
-
         user_ref = db.collection("users").document(uid)
-        txns_ref = user_ref.collection("transactions")
-        txns = txns_ref.where("verified", "==", False).stream()
-
-        for txn in txns:
-            txn_data = txn.to_dict()
-            tx_type = txn_data.get("type")
-            amount = txn_data.get("amount")
-            direction = txn_data.get("direction", "out")
-
-            txns_ref.document(txn.id).update({"verified": True})
-            txns_ref.document(txn.id).update({"fraud": False})
-            txns_ref.document(txn.id).update({
-                "label": "legit",
-                "resolved_at": datetime.now(timezone.utc).isoformat()
-            })
-
-            if tx_type.startswith("TRANSFER") and direction == "in":
-                user_ref.update({"balance": firestore.Increment(amount)})
-            elif tx_type == "CASH_IN":
-                user_ref.update({"balance": firestore.Increment(amount)})
-            elif tx_type == "CASH_OUT":
-                user_ref.update({"balance": firestore.Increment(-amount)})
-
-        user_ref.update({"has_fraud_alert": False})
-        user_ref.update({"fraud": False})
+        settled = ledger.verify_pending(db, user_ref)
+        if predictions is not None:
+            after_commit("Label logging", predictions.submit_many,
+                         [prediction_log.label_record(txn_id, uid, "legit") for txn_id in settled])
 
         return jsonify({"success": True})
 
@@ -474,14 +640,9 @@ def verify_transaction():
         return jsonify({"success": False, "message": str(e)}), 500
     
 @app.route("/api/user", methods=["POST"])
-def get_user_info():
-    data = request.get_json()
-    id_token = data.get("idToken")
-
+@require_auth
+def get_user_info(uid):
     try:
-        decoded_token = auth.verify_id_token(id_token)
-        uid = decoded_token["uid"]
-
         user_doc = db.collection("users").document(uid).get()
         if not user_doc.exists:
             return jsonify({"error": "User not found"}), 404
@@ -500,49 +661,54 @@ def fraudsight():
     return render_template("fraudsight.html")
 
 @app.route("/api/fraudsight-data", methods=["POST"])
-def fraudsight_data():
-    data = request.get_json()
-    id_token = data.get("idToken")
+@require_auth
+def fraudsight_data(uid):
+    # Pre-aggregated daily series: optional start/end (YYYY-MM-DD), limit (days) and cursor
+    try:
+        start, end, limit, cursor = rollups.parse_range(request.get_json())
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
-        decoded_token = auth.verify_id_token(id_token)
-        uid = decoded_token["uid"]
-
-        txns_ref = db.collection("users").document(uid).collection("transactions")
-        txns = txns_ref.order_by("timestamp", direction=firestore.Query.DESCENDING).limit(100).stream()
-
-        cleaned = []
-        for doc in txns:
-            d = doc.to_dict()
-            if "timestamp" not in d:
-                continue
-            cleaned.append({
-                "date": d["timestamp"].strftime("%Y-%m-%d") if hasattr(d["timestamp"], 'strftime') else d["timestamp"].to_datetime().strftime("%Y-%m-%d"),
-                "amount": float(d.get("amount", 0)),
-                "wallet_ratio": float(d.get("wallet_ratio", 0)),
-                "sender_freq": int(d.get("sender_freq", 0)),
-                "receiver_freq": int(d.get("receiver_freq", 0)),
-                "type": d.get("type", "UNKNOWN")
-            })
-
-        return jsonify(cleaned)
+        query = rollups.daily_query(db.collection("users").document(uid), start, end, limit, cursor)
+        return jsonify(rollups.series((doc.to_dict() for doc in query.stream()), limit))
 
     except Exception as e:
         print("/api/fraudsight-data error:", e)
         return jsonify({"error": str(e)}), 500
     
-def log_prediction(txn_id, uid, raw, proba, prediction, status):
-    """Log transaction decisions for future retraining."""
-    db.collection("fraud_predictions").document(txn_id).set({
-        "txn_id": txn_id,
-        "uid": uid,
-        "ts": datetime.now(timezone.utc).isoformat(),
-        "raw": raw,
-        "proba": float(proba),
-        "prediction": int(prediction),
-        "model_version": MODEL_VERSION,
-        "label": status   # "pending", "legit", or "fraud"
-    }, merge=True)
+# --- Prediction Log ---
+# Scored transactions and later label changes for retraining, written off the request thread
+# (PREDICTION_LOG selects Firestore, local JSONL segments or nothing; see prediction_log.py)
+predictions = prediction_log.from_env(db)
+
+# --- Shadow Scoring ---
+# Comma-separated registry versions scored alongside the champion (needs MODEL_REGISTRY_DIR)
+# Configuration errors fail the import; the models themselves load in the warm-up (see /readyz)
+CHALLENGER_VERSIONS = [v.strip() for v in os.getenv("CHALLENGER_VERSIONS", "").split(",") if v.strip()]
+shadow = None
+if CHALLENGER_VERSIONS:
+    if predictions is None:
+        raise RuntimeError("CHALLENGER_VERSIONS needs a prediction log (PREDICTION_LOG is off)")
+    if not MODEL_REGISTRY_DIR:
+        raise RuntimeError("CHALLENGER_VERSIONS needs MODEL_REGISTRY_DIR")
+    for version in CHALLENGER_VERSIONS:
+        try:
+            check_version(MODEL_REGISTRY_DIR, version)
+        except ValueError as e:
+            raise RuntimeError(f"Bad CHALLENGER_VERSIONS entry: {e}") from e
+    shadow = services.LazyProxy(services.Lazy("challengers", lambda: ShadowScorer(
+        [load_version(MODEL_REGISTRY_DIR, v) for v in CHALLENGER_VERSIONS], predictions.submit_many)))
+
+# --- Warm-up ---
+def warm_inference():
+    # One dummy prediction, so XGBoost allocates its prediction buffers before real traffic
+    active = models.get()
+    predict_proba(active, np.zeros((1, len(active.feature_columns)), dtype=np.float32))
+
+# WARMUP=1 initialises every service in the background at import; otherwise the first /readyz does
+if os.getenv("WARMUP") == "1":
+    services.start_warmup(warm_inference)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,215 @@
+# --- Async Serving Mode (ASGI) ---
+# The I/O-bound API routes served from an event loop, so one process can hold
+# thousands of in-flight requests that are waiting on Firebase, Firestore or
+# Stripe. Firestore reads use the async client and independent calls are issued
+# concurrently; SDKs without an async API (Firebase Auth, Stripe) and the
+# transactional ledger writes run on a bounded thread pool. Every other route
+# (pages, /predict, /api/verify-transaction, ...) is delegated to the Flask app.
+#
+#   uvicorn async_app:application --workers 4
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart, g, jsonify, request
+
+import app as flask_app  # shares its lazily initialised Firebase, Stripe and model (see services.py)
+import metrics
+import phone_index
+import rollups
+import services
+from auth_cache import InvalidToken, start_cert_refresher, token_cache
+from card_cache import MISS, card_cache, card_version
+
+def _async_client():
+    from firebase_admin import firestore_async
+    services.firebase.get()
+    return firestore_async.client()
+
+adb = services.LazyProxy(services.Lazy("firestore_async", _async_client))
+api = Quart(__name__)
+
+ASYNC_ROUTES = {
+    "/api/transaction",
+    "/api/get-linked-card",
+    "/api/fraudsight-data",
+    "/api/user",
+    "/api/save-iban",
+}
+BLOCKING_THREADS = int(os.getenv("ASYNC_BLOCKING_THREADS", "64"))
+
+@api.before_serving
+async def configure_executor():
+    # asyncio.to_thread uses the loop's default executor; size it for blocking SDK calls
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(BLOCKING_THREADS, thread_name_prefix="blocking"))
+    start_cert_refresher()
+
+@api.before_request
+async def start_request_metrics():
+    # Context variables follow asyncio.to_thread, so blocking calls count towards this request too
+    g.metrics_token = metrics.begin_request(request.endpoint or "unmatched")
+
+@api.teardown_request
+async def finish_request_metrics(exc=None):
+    if "metrics_token" in g:
+        metrics.end_request(g.pop("metrics_token"))
+
+async def verify_uid(id_token):
+    # Cache hits skip the thread hop; only a miss runs the SDK's verification
+    with metrics.stage("verify_token"):
+        claims = token_cache.cached(id_token) or await asyncio.to_thread(token_cache.verify, id_token)
+    return claims["uid"]
+
+def require_auth(view):
+    """Async counterpart of auth_cache.require_auth."""
+    @wraps(view)
+    async def wrapper(*args, **kwargs):
+        id_token = ((await request.get_json(silent=True)) or {}).get("idToken")
+        if not id_token:
+            return jsonify({"success": False, "error": "Missing ID token"}), 401
+        try:
+            uid = await verify_uid(id_token)
+        except InvalidToken as e:
+            return jsonify({"success": False, "error": str(e)}), 401
+        except Exception as e:
+            print("Token verification error:", e)
+            return jsonify({"success": False, "error": str(e)}), 500
+        return await view(uid, *args, **kwargs)
+    return wrapper
+
+async def find_recipient_uid(contact):
+    # Cached numbers skip the thread hop; a miss is one phone_index point read
+    uid = flask_app.recipients.cached(contact)
+    if uid is phone_index.MISS:
+        uid = await asyncio.to_thread(flask_app.recipients.lookup, contact)
+    return uid
+
+@api.route("/api/transaction", methods=["POST"])
+async def unified_transaction():
+    data = await request.get_json()
+    tx_type = data.get("txType")  # 'CASH_IN', 'CASH_OUT', 'TRANSFER'
+    id_token = data.get("idToken")
+    amount = float(data.get("amount", 0))
+    contact = data.get("contact")  # only for TRANSFER
+
+    if not id_token:
+        return jsonify({"success": False, "error": "Missing ID token"}), 401
+    if not tx_type or amount <= 0:
+        return jsonify({"success": False, "message": "Missing or invalid fields"}), 400
+    if tx_type == "TRANSFER":
+        if not contact:
+            return jsonify({"success": False, "message": "Missing contact for PiggyPay"}), 400
+        contact = flask_app.normalize_contact(contact)
+
+    try:
+        try:
+            uid = await verify_uid(id_token)
+        except InvalidToken as e:
+            return jsonify({"success": False, "error": str(e)}), 401
+
+        # Only a verified caller gets a recipient lookup; it overlaps the user-document read
+        reads = [adb.collection("users").document(uid).get()]
+        if tx_type == "TRANSFER":
+            reads.append(find_recipient_uid(contact))
+        user_doc, *recipient = await asyncio.gather(*reads)
+        recipient_uid = recipient[0] if recipient else None
+
+        if not user_doc.exists:
+            return jsonify({"error": "User not found"}), 404
+        user_data = user_doc.to_dict()
+
+        if tx_type == "TRANSFER":
+            if not recipient_uid:
+                return jsonify({"success": False, "message": "Recipient not found"}), 404
+            if recipient_uid == uid:
+                return jsonify({"success": False, "message": "Cannot send to self"}), 400
+
+        # Scoring waits on the batch scorer and the ledger commit is a sync Firestore transaction
+        user_ref = flask_app.db.collection("users").document(uid)
+        body, status = await asyncio.to_thread(
+            flask_app.process_transaction, uid, user_ref, user_data, tx_type, amount, contact, recipient_uid
+        )
+        return jsonify(body), status
+
+    except Exception as e:
+        print("/api/transaction error:", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@api.route("/api/get-linked-card", methods=["POST"])
+@require_auth
+async def get_linked_card(uid):
+    try:
+        doc = await adb.collection("users").document(uid).get()
+        if not doc.exists:
+            return jsonify({"error": "User not found in Firestore"}), 404
+
+        user_data = doc.to_dict()
+        customer_id = user_data.get("stripeCustomerId")
+        if not customer_id:
+            return jsonify({"error": "No Stripe customer ID stored in Firestore"}), 404
+
+        version = card_version(user_data)
+        card = card_cache.cached(customer_id, version)
+        if card is MISS:
+            card = await asyncio.to_thread(card_cache.get, customer_id, version)
+        if card is None:
+            return jsonify({"error": "No linked card found"}), 404
+
+        return jsonify(card)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@api.route("/api/save-iban", methods=["POST"])
+@require_auth
+async def save_iban(uid):
+    iban = (await request.get_json()).get("iban")
+
+    try:
+        await adb.collection("users").document(uid).set({"iban": iban}, merge=True)
+        return jsonify({"success": True})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+@api.route("/api/user", methods=["POST"])
+@require_auth
+async def get_user_info(uid):
+    try:
+        user_doc = await adb.collection("users").document(uid).get()
+        if not user_doc.exists:
+            return jsonify({"error": "User not found"}), 404
+
+        user_data = user_doc.to_dict()
+        return jsonify({
+            "iban": user_data.get("iban", ""),
+            "connectedAccountId": user_data.get("connectedAccountId", ""),
+            "balance": user_data.get("balance", 0)
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@api.route("/api/fraudsight-data", methods=["POST"])
+@require_auth
+async def fraudsight_data(uid):
+    try:
+        start, end, limit, cursor = rollups.parse_range(await request.get_json())
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        query = rollups.daily_query(adb.collection("users").document(uid), start, end, limit, cursor)
+        return jsonify(rollups.series([doc.to_dict() async for doc in query.stream()], limit))
+
+    except Exception as e:
+        print("/api/fraudsight-data error:", e)
+        return jsonify({"error": str(e)}), 500
+
+flask_asgi = WsgiToAsgi(flask_app.app)
+
+async def application(scope, receive, send):
+    if scope["type"] == "http" and scope["path"] not in ASYNC_ROUTES:
+        await flask_asgi(scope, receive, send)
+    else:
+        await api(scope, receive, send)  # API routes, plus lifespan events
@@ -0,0 +1,143 @@
+# --- Firebase ID Token Cache ---
+# Clients send the same ID token many times per session, so decoded claims are
+# kept in a bounded LRU keyed by the token's SHA-256 until the token's own
+# `exp`. Only a miss pays for auth.verify_id_token. A background thread keeps
+# Google's public signing certificates warm in the Admin SDK's HTTP cache, so
+# a miss rarely waits on a certificate download either.
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import jsonify, request
+
+import metrics
+import services
+from metrics import Counter
+
+CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+CERT_REFRESH_SECONDS = float(os.getenv("AUTH_CERT_REFRESH_SECONDS", "300"))
+CERT_RETRY_SECONDS = float(os.getenv("AUTH_CERT_RETRY_SECONDS", "5"))
+
+HITS = Counter("auth_token_cache_hits_total", help="ID tokens answered from the verification cache")
+MISSES = Counter("auth_token_cache_misses_total", help="ID tokens verified with the Firebase Admin SDK")
+
+class InvalidToken(ValueError):
+    """The token is not acceptable, as opposed to a server-side verification failure."""
+
+class TokenCache:
+    def __init__(self, max_entries=CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # sha256(token) -> (exp, claims)
+        self._lock = threading.Lock()
+
+    def cached(self, id_token):
+        """Claims for a previously verified, unexpired token, or None."""
+        key = hashlib.sha256(id_token.encode()).digest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        HITS.inc()
+        return entry[1]
+
+    def verify(self, id_token):
+        """Decoded claims for `id_token`; raises InvalidToken for a token that is not acceptable."""
+        claims = self.cached(id_token)
+        if claims is not None:
+            return claims
+
+        from firebase_admin import auth
+        services.firebase.get()  # the Admin SDK app, on a worker's first verification
+        try:
+            claims = auth.verify_id_token(id_token)
+        except (ValueError, auth.InvalidIdTokenError, auth.UserDisabledError) as e:
+            # Expired and revoked tokens raise subclasses of InvalidIdTokenError
+            raise InvalidToken(str(e)) from e
+        MISSES.inc()
+        key = hashlib.sha256(id_token.encode()).digest()
+        with self._lock:
+            self._entries[key] = (claims["exp"], claims)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return claims
+
+    def stats(self):
+        hits, misses = HITS.value, MISSES.value
+        return {
+            "size": len(self._entries),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        }
+
+token_cache = TokenCache()
+
+def require_auth(view):
+    """Verify the JSON body's idToken and call the view with the caller's uid first."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        start_cert_refresher()
+        id_token = (request.get_json(silent=True) or {}).get("idToken")
+        if not id_token:
+            return jsonify({"success": False, "error": "Missing ID token"}), 401
+        try:
+            with metrics.stage("verify_token"):
+                claims = token_cache.verify(id_token)
+        except InvalidToken as e:
+            return jsonify({"success": False, "error": str(e)}), 401
+        except Exception as e:  # e.g. the certificate download or Firebase initialisation failed
+            print("Token verification error:", e)
+            return jsonify({"success": False, "error": str(e)}), 500
+        return view(claims["uid"], *args, **kwargs)
+    return wrapper
+
+# --- Signing certificate prefetch ---
+def _prefetch_certs():
+    # The Admin SDK fetches certificates through a cachecontrol-backed session on its
+    # token verifier; requesting the cert URL through that same session refreshes
+    # its cache. There is no public API for this: _token_gen and the verifier's
+    # session are SDK internals (as of firebase_admin 7.x). If they move, this
+    # raises and only the prefetch is lost; verify_id_token downloads on demand.
+    from firebase_admin import _token_gen, auth
+    services.firebase.get()
+    verifier = auth._get_client(None)._token_verifier
+    verifier.request(_token_gen.ID_TOKEN_CERT_URI, method="GET")
+
+def _refresh_certs():
+    # A failure (network, Firebase not initialised yet, moved SDK internals) is retried
+    # with exponential backoff, capped at the normal refresh interval
+    delay = CERT_RETRY_SECONDS
+    while True:
+        try:
+            _prefetch_certs()
+        except Exception as e:
+            print(f"Auth certificate prefetch failed, retrying in {delay:.0f}s:", e)
+            time.sleep(delay)
+            delay = min(delay * 2, CERT_REFRESH_SECONDS)
+            continue
+        delay = CERT_RETRY_SECONDS
+        time.sleep(CERT_REFRESH_SECONDS)
+
+_refresher = None
+_refresher_pid = None
+_refresher_lock = threading.Lock()
+
+def start_cert_refresher():
+    """Start the background certificate refresher once per process (safe after fork)."""
+    global _refresher, _refresher_pid
+    if _refresher is not None and _refresher_pid == os.getpid():
+        return
+    with _refresher_lock:
+        if _refresher is not None and _refresher_pid == os.getpid():
+            return
+        _refresher_pid = os.getpid()
+        _refresher = threading.Thread(target=_refresh_certs, name="auth-cert-refresh", daemon=True)
+        _refresher.start()
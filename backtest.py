@@ -0,0 +1,346 @@
+# --- Offline Backtest ---
+# Replays the exported transaction history (export_data.py's Parquet parts)
+# through one or more model versions and reports, per threshold, what each would
+# have flagged: precision, recall, flag rate and the extra Firestore writes the
+# resulting OTP holds cost.
+#
+# Parts are split into tasks of a few row groups, and a process pool scores the
+# tasks in parallel. Each worker loads the models once and uses a single thread,
+# so the pool, not the model, spreads the work over the cores. A task builds the
+# features with build_features, scores a whole chunk per predict_proba call, and
+# returns a histogram of scores per (day, label, hold kind) in SCORE_BINS bins
+# instead of the scores. Any number of thresholds is then read off the merged
+# histograms with cumulative sums. A worker returns a few KB per task whatever the history
+# size, and the main process never holds a row.
+#
+# A transaction exported more than once (its label resolved after an earlier
+# export) is counted once, from the latest part, as in train.py.
+#
+#   python backtest.py --model fraud_model.pkl
+#   python backtest.py --model models/20260101T000000 --model models/20260201T000000 --since 2026-01-01 --daily
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import numpy as np
+
+from features import NUMERIC_COLUMNS, VELOCITY_COLUMNS
+from model_registry import load_artifacts, load_version
+from scoring import predict_proba
+
+EXPORT_DIR = "data/app_transactions"  # Parquet parts written by export_data.py
+SCORE_BINS = 1000  # thresholds are resolved to 1/SCORE_BINS
+TASK_ROWS = 500_000
+DEFAULT_THRESHOLDS = [round(float(t), 2) for t in np.arange(0.05, 1.0, 0.05)]
+# app.py holds a transaction for OTP verification when its score is at or above
+# the model's threshold (app.flag_threshold), the same >= rule as the sweep. What
+# a hold changes in Firestore writes depends on the row:
+# - a held legit transaction is verified by its user: ledger.verify_pending
+#   updates the entry and the user document, and the prediction log
+#   (PREDICTION_LOG=firestore) records the label
+# - held fraud is never verified, so it costs nothing beyond the hold itself
+# - a held transfer writes only the sender's side: ledger.transfer skips the
+#   recipient's entry, user update and rollup, whatever the label
+# - a transfer's received entry is never scored or held on its own: it copies
+#   the sender's features, score and label, so the sender's entry stands for the
+#   transfer and received entries are left out of every count
+VERIFY_WRITES = 3
+SKIPPED_CREDIT_WRITES = 3
+WRITE_PRICE = 0.18  # USD per 100,000 Firestore document writes; check your location's price
+
+INPUT_COLUMNS = ["type", *NUMERIC_COLUMNS, *VELOCITY_COLUMNS, "timestamp", "label"]
+KEY_COLUMNS = ["uid", "txn_id"]
+RECEIVED, CASH, SENT = range(3)  # hold kinds, see hold_kind
+KINDS = 3
+SCORED_KINDS = [CASH, SENT]  # the rows app.py scores and may hold
+
+def load_model(spec):
+    """LoadedModel for a registry version directory or a model .pkl (its .meta.json and feature_columns.csv next to it)."""
+    if os.path.isdir(spec):
+        registry_dir, version = os.path.split(os.path.normpath(spec))
+        return load_version(registry_dir or ".", version)
+    base = os.path.splitext(spec)[0]
+    features_path = os.path.join(os.path.dirname(spec), "feature_columns.csv")
+    return load_artifacts(os.path.basename(base), spec, None, features_path, base + ".meta.json")
+
+def hold_kind(types):
+    """Per row: SENT for a transfer's sender entry, RECEIVED for its credit entry, CASH otherwise."""
+    types = np.asarray(types, dtype=object).astype(str)
+    received = np.char.startswith(types, "TRANSFER Received")
+    return np.where(received, RECEIVED, np.where(np.char.startswith(types, "TRANSFER"), SENT, CASH))
+
+def part_paths(data):
+    if os.path.isdir(data):
+        return sorted(os.path.join(data, f) for f in os.listdir(data) if f.startswith("part-") and f.endswith(".parquet"))
+    return [data]
+
+def plan(paths, task_rows=TASK_ROWS):
+    """[(path, [row group indices], rows)], each about task_rows rows, in history order."""
+    import pyarrow.parquet as pq
+
+    tasks = []
+    for path in paths:
+        meta = pq.ParquetFile(path).metadata
+        groups, rows = [], 0
+        for rg in range(meta.num_row_groups):
+            groups.append(rg)
+            rows += meta.row_group(rg).num_rows
+            if rows >= task_rows:
+                tasks.append((path, groups, rows))
+                groups, rows = [], 0
+        if groups:
+            tasks.append((path, groups, rows))
+    return tasks
+
+def _read(path, groups, columns):
+    import pyarrow.parquet as pq
+
+    f = pq.ParquetFile(path)
+    present = set(f.schema_arrow.names)
+    return f.read_row_groups(groups, columns=[c for c in columns if c in present])
+
+# --- Workers ---
+_worker = {}
+
+def _init_worker(specs):
+    _worker["models"] = []
+    for spec in specs:
+        loaded = load_model(spec)
+        model = getattr(loaded.model, "model", loaded.model)  # the XGBoost model behind a SmallBatchModel
+        if hasattr(model, "set_params"):
+            model.set_params(n_jobs=1)  # one core per worker; the pool provides the parallelism
+        _worker["models"].append(loaded)
+
+def _key_hashes(task):
+    """64-bit hashes of uid/txn_id for every row of a task, in file order."""
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    path, groups, _ = task
+    table = _read(path, groups, KEY_COLUMNS)
+    if table.num_columns < len(KEY_COLUMNS):
+        return None  # a part without ids cannot be de-duplicated
+    # The join kernel needs one string type; parts may hold string or large_string ids
+    uid, txn_id = (table.column(c).cast(pa.large_string()) for c in KEY_COLUMNS)
+    keys = pc.binary_join_element_wise(uid, txn_id, pa.scalar("/", pa.large_string()))
+    return pd.util.hash_array(keys.to_numpy(zero_copy_only=False).astype(object))
+
+def _score_task(args):
+    """(rows kept, [(days, counts)] per model) for one task; counts has shape (days, 2 labels, KINDS, SCORE_BINS)."""
+    (path, groups, _), drop, first_day, last_day = args
+    table = _read(path, groups, INPUT_COLUMNS)
+    label = table.column("label").to_numpy(zero_copy_only=False)
+    y = np.where(label == "fraud", 1, np.where(label == "legit", 0, -1))
+    ts = table.column("timestamp").to_numpy(zero_copy_only=False).astype("datetime64[us]")
+    day = ts.astype("datetime64[D]").astype(np.int64)
+
+    keep = (y >= 0) & ~np.isnat(ts)
+    if first_day is not None:
+        keep &= day >= first_day
+    if last_day is not None:
+        keep &= day <= last_day
+    if drop is not None and len(drop):
+        keep[drop] = False
+    if not keep.any():
+        return 0, []
+
+    raw = {name: table.column(name).to_numpy(zero_copy_only=False)[keep]
+           for name in table.column_names if name not in ("timestamp", "label")}
+    y, day = y[keep], day[keep]
+    kind = hold_kind(raw["type"])
+    days, day_index = np.unique(day, return_inverse=True)
+
+    from features import build_features
+
+    out = []
+    for loaded in _worker["models"]:
+        X = build_features(raw, loaded.feature_columns)
+        score_bin = np.clip((predict_proba(loaded, X) * SCORE_BINS).astype(np.int64), 0, SCORE_BINS - 1)
+        cell = (day_index * 2 + y) * KINDS + kind
+        counts = np.bincount(cell * SCORE_BINS + score_bin, minlength=len(days) * 2 * KINDS * SCORE_BINS)
+        out.append((days, counts.reshape(len(days), 2, KINDS, SCORE_BINS)))
+    return int(keep.sum()), out
+
+# --- Backtest ---
+def _day_number(text):
+    return None if not text else (date.fromisoformat(text) - date(1970, 1, 1)).days
+
+def duplicates(pool, tasks):
+    """Per task, the row offsets superseded by a later export of the same transaction (or None)."""
+    hashes = list(pool.map(_key_hashes, tasks))
+    if any(h is None for h in hashes):
+        print("Some parts have no uid/txn_id columns; rows are not de-duplicated")
+        return [None] * len(tasks)
+    ids = np.concatenate(hashes) if hashes else np.empty(0, np.uint64)
+    # np.unique keeps the first occurrence, so search the reversed order for the latest
+    _, first_from_end = np.unique(ids[::-1], return_index=True)
+    keep = np.zeros(len(ids), dtype=bool)
+    keep[len(ids) - 1 - first_from_end] = True
+    drops, offset = [], 0
+    for h in hashes:
+        drops.append(np.flatnonzero(~keep[offset:offset + len(h)]))
+        offset += len(h)
+    return drops
+
+def run(specs, data=EXPORT_DIR, since=None, until=None, workers=None, dedupe=True, task_rows=TASK_ROWS):
+    """(rows, {model version: (days array, counts (days, 2, KINDS, SCORE_BINS))}, [LoadedModel]) over the history."""
+    models = [load_model(spec) for spec in specs]
+    tasks = plan(part_paths(data), task_rows)
+    if not tasks:
+        raise SystemExit(f"No Parquet parts in {data}; run export_data.py first")
+
+    totals = [dict() for _ in models]  # per model: day -> (2, KINDS, SCORE_BINS) counts
+    rows = 0
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(specs,)) as pool:
+        drops = duplicates(pool, tasks) if dedupe else [None] * len(tasks)
+        first_day, last_day = _day_number(since), _day_number(until)
+        jobs = ((task, drop, first_day, last_day) for task, drop in zip(tasks, drops))
+        for done, (kept, per_model) in enumerate(pool.map(_score_task, jobs), 1):
+            rows += kept
+            for total, (days, counts) in zip(totals, per_model):
+                for d, c in zip(days.tolist(), counts):
+                    if d in total:
+                        total[d] += c
+                    else:
+                        total[d] = c.copy()
+            print(f"\rScored {done}/{len(tasks)} tasks, {rows} rows", end="", flush=True)
+    print()
+
+    results = {}
+    for loaded, total in zip(models, totals):
+        days = np.array(sorted(total), dtype=np.int64)
+        counts = np.stack([total[d] for d in days.tolist()]) if len(days) else np.zeros((0, 2, KINDS, SCORE_BINS), np.int64)
+        results[loaded.version] = (days, counts)
+    return rows, results, models
+
+def sweep(counts, thresholds):
+    """Counts of scores >= each threshold from (..., 2 labels, KINDS, SCORE_BINS) histograms.
+
+    Returns (tp, fp, held_transfers), each of shape (..., len(thresholds)): held
+    fraud and held legit over the scored kinds, and the held sender entries of
+    transfers. Received entries are not counted (see SCORED_KINDS).
+    """
+    # Counts at or above each bin: reverse cumulative sum over the score axis
+    at_or_above = np.cumsum(counts[..., ::-1], axis=-1)[..., ::-1]
+    index = np.clip(np.round(np.asarray(thresholds) * SCORE_BINS).astype(np.int64), 0, SCORE_BINS - 1)
+    flagged = at_or_above[..., SCORED_KINDS, :][..., index]
+    tp, fp = flagged[..., 1, :, :].sum(axis=-2), flagged[..., 0, :, :].sum(axis=-2)
+    return tp, fp, flagged[..., SCORED_KINDS.index(SENT), :].sum(axis=-2)
+
+def hold_writes(held_legit, held_transfers, verify_writes=VERIFY_WRITES, credit_writes=SKIPPED_CREDIT_WRITES):
+    """Net Firestore writes the OTP holds add (negative when skipped credits outweigh verifications)."""
+    return held_legit * verify_writes - held_transfers * credit_writes
+
+def summarize(tp, fp, writes, fraud, rows, n_days, write_price=WRITE_PRICE):
+    """Metrics for one threshold over `rows` transactions, of which `fraud` are fraud, spanning n_days.
+
+    `writes` are the net extra Firestore writes of the holds (see hold_writes).
+    """
+    flagged = tp + fp
+    return {
+        "rows": int(rows),
+        "flagged": int(flagged),
+        "tp": int(tp),
+        "fp": int(fp),
+        "fn": int(fraud - tp),
+        "precision": float(tp / flagged) if flagged else None,
+        "recall": float(tp / fraud) if fraud else None,
+        "flag_rate": float(flagged / rows) if rows else None,
+        "hold_writes": int(round(writes)),
+        "hold_writes_per_day": float(writes / n_days) if n_days else None,
+        "cost_per_day": float(writes / n_days * write_price / 100_000) if n_days else None,
+    }
+
+def report(results, models, thresholds, verify_writes=VERIFY_WRITES, credit_writes=SKIPPED_CREDIT_WRITES,
+           write_price=WRITE_PRICE):
+    out = {}
+    for loaded in models:
+        days, counts = results[loaded.version]
+        grid = sorted(set(thresholds) | {round(loaded.threshold, 3)})
+        tp, fp, held_transfers = sweep(counts, grid)
+        writes = hold_writes(fp, held_transfers, verify_writes, credit_writes)
+        scored = counts[:, :, SCORED_KINDS]
+        per_day_rows = scored.sum(axis=(1, 2, 3))
+        per_day_fraud = scored[:, 1].sum(axis=(1, 2))
+        rows, fraud = int(per_day_rows.sum()), int(per_day_fraud.sum())
+        out[loaded.version] = {
+            "threshold": loaded.threshold,
+            "rows": rows,
+            "fraud": fraud,
+            "days": len(days),
+            "sweep": {t: summarize(tp[:, i].sum(), fp[:, i].sum(), writes[:, i].sum(), fraud, rows, len(days),
+                                   write_price)
+                      for i, t in enumerate(grid)},
+            "daily": {
+                str(np.datetime64(int(d), "D")): {
+                    t: summarize(tp[k, i], fp[k, i], writes[k, i], per_day_fraud[k], per_day_rows[k], 1, write_price)
+                    for i, t in enumerate(grid)
+                }
+                for k, d in enumerate(days.tolist())
+            },
+        }
+    return out
+
+def _fmt(value, pattern):
+    return "-" if value is None else pattern.format(value)
+
+def print_report(out, daily=False):
+    for version, r in out.items():
+        print(f"\n== {version}: {r['rows']} rows over {r['days']} days, {r['fraud']} fraud, "
+              f"meta threshold {r['threshold']:.3f}")
+        print(f"{'threshold':>9} {'precision':>9} {'recall':>7} {'flag rate':>9} {'flagged':>9} "
+              f"{'writes/day':>10} {'USD/day':>8}")
+        for t, m in r["sweep"].items():
+            marker = " *" if abs(t - r["threshold"]) < 0.5 / SCORE_BINS else ""
+            print(f"{t:9.3f} {_fmt(m['precision'], '{:9.3f}')} {_fmt(m['recall'], '{:7.3f}')} "
+                  f"{_fmt(m['flag_rate'], '{:9.4%}')} {m['flagged']:9d} {_fmt(m['hold_writes_per_day'], '{:10.0f}')} "
+                  f"{_fmt(m['cost_per_day'], '{:8.2f}')}{marker}")
+        if daily:
+            t = min(r["sweep"], key=lambda k: abs(k - r["threshold"]))
+            print(f"\nPer day at threshold {t:.3f}:")
+            print(f"{'day':>10} {'rows':>9} {'precision':>9} {'recall':>7} {'flag rate':>9} {'flagged':>8}")
+            for day, by_threshold in r["daily"].items():
+                m = by_threshold[t]
+                print(f"{day:>10} {m['rows']:9d} {_fmt(m['precision'], '{:9.3f}')} {_fmt(m['recall'], '{:7.3f}')} "
+                      f"{_fmt(m['flag_rate'], '{:9.4%}')} {m['flagged']:8d}")
+
+def parse_thresholds(text):
+    """"0.1,0.5,0.9" or a start:stop:step range ("0.05:0.95:0.05", stop included)."""
+    if ":" in text:
+        start, stop, step = (float(v) for v in text.split(":"))
+        return [round(float(t), 3) for t in np.arange(start, stop + step / 2, step)]
+    return [round(float(t), 3) for t in text.split(",") if t]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest model versions and thresholds on the exported history.")
+    parser.add_argument("--model", action="append", dest="models",
+                        help="a model .pkl or a registry version directory; repeat to compare (default fraud_model.pkl)")
+    parser.add_argument("--data", default=EXPORT_DIR, help="directory of part-*.parquet files, or one Parquet file")
+    parser.add_argument("--thresholds", type=parse_thresholds, default=DEFAULT_THRESHOLDS,
+                        help="comma-separated list or start:stop:step (the model's meta threshold is always added)")
+    parser.add_argument("--since", help="first UTC day to include, YYYY-MM-DD")
+    parser.add_argument("--until", help="last UTC day to include, YYYY-MM-DD")
+    parser.add_argument("--workers", type=int, default=None, help="scoring processes (default: all cores)")
+    parser.add_argument("--task-rows", type=int, default=TASK_ROWS)
+    parser.add_argument("--no-dedupe", action="store_true", help="skip the uid/txn_id de-duplication pass")
+    parser.add_argument("--verify-writes", type=float, default=VERIFY_WRITES,
+                        help="Firestore writes to verify one held legit transaction")
+    parser.add_argument("--credit-writes", type=float, default=SKIPPED_CREDIT_WRITES,
+                        help="Firestore writes a held transfer skips on the recipient's side")
+    parser.add_argument("--write-price", type=float, default=WRITE_PRICE, help="USD per 100,000 Firestore writes")
+    parser.add_argument("--daily", action="store_true", help="also print per-day metrics at each model's threshold")
+    parser.add_argument("--json", help="write the full report (every threshold, every day) to this file")
+    args = parser.parse_args()
+
+    rows, results, models = run(args.models or ["fraud_model.pkl"], args.data, args.since, args.until,
+                                args.workers, not args.no_dedupe, args.task_rows)
+    out = report(results, models, args.thresholds, args.verify_writes, args.credit_writes, args.write_price)
+    print_report(out, args.daily)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(out, f, indent=2)
+        print(f"\nWrote {args.json}")
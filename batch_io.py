@@ -0,0 +1,126 @@
+# --- Bulk scoring input/output helpers for /predict/batch ---
+import csv
+import io
+import json
+
+import numpy as np
+
+try:  # Arrow IPC input is optional
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+NPY_TYPES = {"application/x-npy", "application/npy"}
+ARROW_STREAM_TYPES = {"application/vnd.apache.arrow.stream"}
+ARROW_FILE_TYPES = {"application/vnd.apache.arrow.file", "application/x-arrow"}
+
+class BatchInputError(ValueError):
+    pass
+
+def load_feature_columns(path):
+    """Feature order as written by train.py (single column, header '0')."""
+    with open(path, newline="") as f:
+        rows = [r[0] for r in csv.reader(f) if r]
+    return rows[1:]
+
+def _check_columns(present, columns):
+    missing = [c for c in columns if c not in present]
+    if missing:
+        raise BatchInputError(f"Missing feature columns: {missing}")
+
+def _as_matrix(values):
+    try:
+        X = np.asarray(values, dtype=float)
+    except (TypeError, ValueError) as e:
+        raise BatchInputError(f"Non-numeric feature value: {e}")
+    if X.ndim != 2 and X.size:
+        raise BatchInputError("Feature values must be numbers or null")
+    return X
+
+def _from_json(payload, columns):
+    # Row form: [{"wallet_ratio": ..., ...}, ...] or {"rows": [...]}
+    if isinstance(payload, dict) and "rows" in payload:
+        payload = payload["rows"]
+    if isinstance(payload, list):
+        for i, row in enumerate(payload):
+            if not isinstance(row, dict):
+                raise BatchInputError(f"Row {i} is not an object")
+            _check_columns(row, columns)
+        # None becomes NaN, which XGBoost treats as missing
+        return _as_matrix([[row[c] for c in columns] for row in payload])
+
+    # Columnar form: {"wallet_ratio": [...], ...} or {"columns": {...}}
+    if isinstance(payload, dict):
+        cols = payload.get("columns", payload)
+        if not isinstance(cols, dict):
+            raise BatchInputError("Expected an object of columns")
+        _check_columns(cols, columns)
+        not_lists = [c for c in columns if not isinstance(cols[c], list)]
+        if not_lists:
+            raise BatchInputError(f"Feature columns must be arrays: {not_lists}")
+        lengths = {len(cols[c]) for c in columns}
+        if len(lengths) > 1:
+            raise BatchInputError("Feature columns have different lengths")
+        return _as_matrix([cols[c] for c in columns]).T.reshape(-1, len(columns))
+
+    raise BatchInputError("Expected a list of rows or an object of columns")
+
+def _non_empty(X, kind):
+    if X.shape[0] == 0:
+        raise BatchInputError(f"Empty {kind} batch")
+    return X
+
+def _from_npy(body, columns):
+    try:
+        X = np.load(io.BytesIO(body), allow_pickle=False)
+    except (ValueError, TypeError, OSError, EOFError) as e:
+        raise BatchInputError(f"Invalid NPY payload: {e}")
+    if not isinstance(X, np.ndarray):
+        X.close()
+        raise BatchInputError("Expected a single NPY array, not an NPZ archive")
+    if X.ndim != 2 or X.shape[1] != len(columns):
+        raise BatchInputError(f"NPY array must have shape (n, {len(columns)}) in feature_columns.csv order")
+    try:
+        X = X.astype(float, copy=False)
+    except (ValueError, TypeError) as e:
+        raise BatchInputError(f"Non-numeric NPY array ({X.dtype}): {e}")
+    return _non_empty(X, "NPY")
+
+def _from_arrow(body, columns, stream):
+    if pa is None:
+        raise BatchInputError("Arrow input requires pyarrow")
+    try:
+        reader = pa.ipc.open_stream(body) if stream else pa.ipc.open_file(body)
+        table = reader.read_all()
+    except (pa.ArrowInvalid, ValueError, TypeError, OSError, EOFError) as e:
+        raise BatchInputError(f"Invalid Arrow IPC payload: {e}")
+    _check_columns(table.column_names, columns)
+    try:
+        X = np.column_stack([table.column(c).to_numpy(zero_copy_only=False) for c in columns]).astype(float, copy=False)
+    except (pa.ArrowInvalid, ValueError, TypeError) as e:
+        raise BatchInputError(f"Non-numeric Arrow column: {e}")
+    return _non_empty(X, "Arrow")
+
+def parse_batch(body, content_type, columns):
+    """Decode a request body into an (n, len(columns)) float matrix in model order."""
+    mimetype = (content_type or "application/json").split(";")[0].strip().lower()
+    if mimetype in NPY_TYPES:
+        X = _from_npy(body, columns)
+    elif mimetype in ARROW_STREAM_TYPES:
+        X = _from_arrow(body, columns, stream=True)
+    elif mimetype in ARROW_FILE_TYPES:
+        X = _from_arrow(body, columns, stream=False)
+    else:
+        try:
+            payload = json.loads(body)
+        except ValueError as e:
+            raise BatchInputError(f"Invalid JSON: {e}")
+        X = _from_json(payload, columns)
+
+    if X.shape[0] == 0:
+        raise BatchInputError("Empty batch")
+    return X
+
+def iter_chunks(X, chunk_rows):
+    for start in range(0, X.shape[0], chunk_rows):
+        yield start, X[start:start + chunk_rows]
@@ -0,0 +1,182 @@
+# --- Request-path load test (in-memory or emulated Firestore) ---
+# Boots app.py against fake_services (Firestore, Firebase Auth and Stripe
+# stand-ins, no credentials needed), seeds users with N past transactions each
+# and drives /predict, /api/transaction and /api/verify-transaction at a fixed
+# arrival rate. Latency is measured from each request's scheduled start, so a
+# backlog behind a slow request counts against p99 instead of hiding it.
+#
+#   python bench_app.py --history 0,1000,10000 --rps 50 --duration 10
+#   python bench_app.py --history 0,10000 --max-p99-ms 250     # exits 1 above the budget (CI)
+#
+# --rpc-ms / --per-doc-us give every fake Firestore call a latency, so reads
+# that grow with history size show up as latency that grows with history size.
+# --emulator runs against the Firestore emulator (FIRESTORE_EMULATOR_HOST)
+# instead of the in-memory fake; auth and Stripe are still faked.
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+import fake_services
+
+ENDPOINTS = ["/predict", "/api/transaction", "/api/verify-transaction"]
+RECENT_FRACTION = 0.1  # share of seeded history inside the last 24h (read by the velocity index)
+SEED_BATCH = 400
+
+def history(n, rng, now):
+    kinds = ["CASH_IN", "CASH_OUT", "TRANSFER Sent to +6580000000", "TRANSFER Received from +6580000001"]
+    ages = np.where(rng.random(n) < RECENT_FRACTION, rng.random(n) * 86400, rng.random(n) * 30 * 86400)
+    return [{
+        "type": kinds[int(k)],
+        "amount": float(a),
+        "timestamp": now - timedelta(seconds=float(s)),
+        "fraud": False,
+        "verified": True,
+        "label": "legit",
+    } for k, a, s in zip(rng.integers(0, len(kinds), n), rng.random(n) * 200, ages)]
+
+def seed(db, run, size, users, cold_stats, rng):
+    """Create `users` users with `size` past transactions each; returns their uids."""
+    import feature_store
+
+    now = datetime.now(timezone.utc)
+    uids = []
+    for i in range(users):
+        uid = f"bench-h{size}-{i}"
+        user_ref = db.collection("users").document(uid)
+        txns = history(size, rng, now)
+        user = {"phone": f"+65{run:03d}{i:05d}", "balance": 1e9, "name": uid}
+        if not cold_stats:
+            user[feature_store.STATS_FIELD] = feature_store.stats_from_transactions(txns)
+        user_ref.set(user)
+        for start in range(0, len(txns), SEED_BATCH):
+            batch = db.batch()
+            for t in txns[start:start + SEED_BATCH]:
+                batch.set(user_ref.collection("transactions").document(), t)
+            batch.commit()
+        uids.append(uid)
+    return uids
+
+def request_body(endpoint, uid, other, i):
+    token = f"fake:{uid}"
+    if endpoint == "/predict":
+        return {"wallet_ratio": 0.2, "hour_of_day": 13, "amount": 120.0, "receiver_freq": 3,
+                "sender_freq": 40, "is_merchant": 0, "type": "TRANSFER"}
+    if endpoint == "/api/transaction":
+        tx_type = ("CASH_IN", "CASH_OUT", "TRANSFER")[i % 3]
+        body = {"idToken": token, "txType": tx_type, "amount": 5.0}
+        if tx_type == "TRANSFER":
+            body["contact"] = other
+        return body
+    return {"idToken": token}
+
+def drive(app, endpoint, uids, phones, rps, duration, workers):
+    """Open-loop load: one request every 1/rps seconds; returns (latencies in s, errors, elapsed)."""
+    local = threading.local()
+
+    def one(i, scheduled):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+        uid = uids[i % len(uids)]
+        other = phones[(i + 1) % len(phones)]
+        response = client.post(endpoint, json=request_body(endpoint, uid, other, i))
+        return time.perf_counter() - scheduled, response.status_code >= 400
+
+    total = max(1, int(rps * duration))
+    futures = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i in range(total):
+            scheduled = started + i / rps
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(one, i, scheduled))
+        results = [f.result() for f in futures]
+    elapsed = time.perf_counter() - started
+    return np.array([r[0] for r in results]), sum(r[1] for r in results), elapsed
+
+def ops_per_request(metrics, endpoint_name, op):
+    snap = metrics.FIRESTORE_OPS_PER_REQUEST.labels(endpoint_name, op)._snapshot()
+    return snap["count"], snap["sum"]
+
+def run(args):
+    client = fake_services.install(args.rpc_ms, args.per_doc_us,
+                                   emulator_project=os.getenv("GCLOUD_PROJECT", "demo-trustypig") if args.emulator else None)
+    if args.emulator and not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        raise SystemExit("Set FIRESTORE_EMULATOR_HOST to point at the Firestore emulator")
+    os.environ.setdefault("MODEL_PATH", "fraud_model.pkl")
+
+    import app as app_module
+    import metrics
+
+    flask_app = app_module.app
+    endpoint_names = {rule.rule: rule.endpoint for rule in flask_app.url_map.iter_rules()}
+    rng = np.random.default_rng(100)
+    rows = []
+    for run_index, size in enumerate(args.history):
+        seeding = time.perf_counter()
+        uids = seed(client, run_index, size, args.users, args.cold_stats, rng)
+        phones = [client.collection("users").document(u).get().to_dict()["phone"] for u in uids]
+        seeding = time.perf_counter() - seeding
+        for endpoint in args.endpoints:
+            name = endpoint_names[endpoint]
+            before = {op: ops_per_request(metrics, name, op) for op in ("read", "write")}
+            latencies, errors, elapsed = drive(flask_app, endpoint, uids, phones, args.rps, args.duration, args.workers)
+            after = {op: ops_per_request(metrics, name, op) for op in ("read", "write")}
+            requests = len(latencies)
+            per_request = {op: (after[op][1] - before[op][1]) / max(1, after[op][0] - before[op][0])
+                           for op in ("read", "write")}
+            rows.append({
+                "history": size,
+                "endpoint": endpoint,
+                "requests": requests,
+                "errors": int(errors),
+                "throughput_rps": requests / elapsed,
+                "p50_ms": float(np.percentile(latencies, 50) * 1000),
+                "p99_ms": float(np.percentile(latencies, 99) * 1000),
+                "reads_per_request": per_request["read"],
+                "writes_per_request": per_request["write"],
+                "seed_seconds": seeding,
+            })
+        if not args.emulator:
+            client.clear()  # keep later sweeps from scanning earlier users' history
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print(f"rps={args.rps} duration={args.duration}s users={args.users} workers={args.workers} "
+              f"rpc_ms={args.rpc_ms} per_doc_us={args.per_doc_us}{' cold_stats' if args.cold_stats else ''}")
+        print(f"{'history':>8} {'endpoint':<24} {'req':>6} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} "
+              f"{'reads':>7} {'writes':>7}")
+        for r in rows:
+            print(f"{r['history']:>8} {r['endpoint']:<24} {r['requests']:>6} {r['errors']:>5} {r['throughput_rps']:>8.1f} "
+                  f"{r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['reads_per_request']:>7.1f} {r['writes_per_request']:>7.1f}")
+
+    failed = [r for r in rows if r["errors"] or (args.max_p99_ms and r["p99_ms"] > args.max_p99_ms)]
+    for r in failed:
+        print(f"REGRESSION: {r['endpoint']} at history={r['history']}: p99 {r['p99_ms']:.1f} ms, {r['errors']} errors")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive app.py's scoring and transaction routes against local stand-ins.")
+    parser.add_argument("--history", type=lambda s: [int(x) for x in s.split(",")], default=[0, 1000, 10000],
+                        help="comma-separated past transactions per seeded user, one run each")
+    parser.add_argument("--endpoints", type=lambda s: s.split(","), default=ENDPOINTS)
+    parser.add_argument("--rps", type=float, default=50.0)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load per endpoint and history size")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--rpc-ms", type=float, default=2.0, help="simulated latency of each fake Firestore call")
+    parser.add_argument("--per-doc-us", type=float, default=20.0, help="simulated latency per document a query returns")
+    parser.add_argument("--cold-stats", action="store_true", help="seed users without tx_stats (first request scans history)")
+    parser.add_argument("--max-p99-ms", type=float, default=0.0, help="fail if any p99 exceeds this (0: no budget)")
+    parser.add_argument("--emulator", action="store_true", help="use the Firestore emulator instead of the in-memory fake")
+    parser.add_argument("--json", action="store_true")
+    raise SystemExit(run(parser.parse_args()))
@@ -0,0 +1,86 @@
+# --- Concurrent transfer benchmark (Firestore emulator) ---
+# Fires parallel transfers out of one account and checks that the ledger stays
+# consistent: the sender never goes negative and no money is created.
+#
+#   firebase emulators:start --only firestore
+#   FIRESTORE_EMULATOR_HOST=localhost:8080 python bench_transfers.py --transfers 200 --workers 32
+#
+# --mode legacy replays the old read-check-then-write sequence for comparison.
+import argparse
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+from google.cloud import firestore
+
+import feature_store
+import ledger
+
+def seed(db, balance):
+    sender = db.collection("users").document(f"bench-sender-{uuid.uuid4().hex[:8]}")
+    recipient = db.collection("users").document(f"bench-recipient-{uuid.uuid4().hex[:8]}")
+    sender.set({"phone": "+6500000001", "balance": balance, feature_store.STATS_FIELD: feature_store.empty_stats()})
+    recipient.set({"phone": "+6500000002", "balance": 0.0, feature_store.STATS_FIELD: feature_store.empty_stats()})
+    return sender, recipient
+
+def txn(amount, kind):
+    return {"type": kind, "amount": amount, "timestamp": datetime.now(timezone.utc), "verified": True, "label": "legit"}
+
+def transactional_transfer(db, sender, recipient, amount):
+    ledger.transfer(db, sender, recipient, amount, txn(amount, "TRANSFER Sent"), txn(amount, "TRANSFER Received"), flagged=False)
+
+def legacy_transfer(db, sender, recipient, amount):
+    # The pre-ledger sequence: separate read, check, then four independent writes
+    if float(sender.get().to_dict().get("balance", 0)) < amount:
+        raise ledger.InsufficientBalance()
+    sender.update({"balance": firestore.Increment(-amount)})
+    sender.collection("transactions").add(txn(amount, "TRANSFER Sent"))
+    recipient.update({"balance": firestore.Increment(amount)})
+    recipient.collection("transactions").add(txn(amount, "TRANSFER Received"))
+
+def run(mode, transfers, workers, amount, balance):
+    if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        raise SystemExit("Set FIRESTORE_EMULATOR_HOST to point at the Firestore emulator")
+    db = firestore.Client(project=os.getenv("GCLOUD_PROJECT", "demo-trustypig"))
+    sender, recipient = seed(db, balance)
+    do_transfer = transactional_transfer if mode == "transactional" else legacy_transfer
+
+    def one(_):
+        start = time.perf_counter()
+        try:
+            do_transfer(db, sender, recipient, amount)
+            ok = True
+        except ledger.InsufficientBalance:
+            ok = False
+        return ok, time.perf_counter() - start
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(one, range(transfers)))
+    elapsed = time.perf_counter() - started
+
+    latencies = np.array([r[1] for r in results]) * 1000
+    succeeded = sum(r[0] for r in results)
+    final_sender = sender.get().to_dict()["balance"]
+    final_recipient = recipient.get().to_dict()["balance"]
+
+    print(f"mode={mode} transfers={transfers} workers={workers} amount={amount} start_balance={balance}")
+    print(f"throughput {transfers / elapsed:.1f} transfers/s, latency p50 {np.percentile(latencies, 50):.1f} ms, "
+          f"p99 {np.percentile(latencies, 99):.1f} ms")
+    print(f"succeeded {succeeded}, rejected {transfers - succeeded}")
+    print(f"sender {final_sender:.2f}, recipient {final_recipient:.2f}, total {final_sender + final_recipient:.2f}")
+    if final_sender < 0 or succeeded * amount > balance:
+        print("DOUBLE SPEND: more money left the account than it held")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel transfers from one account against the Firestore emulator.")
+    parser.add_argument("--mode", choices=["transactional", "legacy"], default="transactional")
+    parser.add_argument("--transfers", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--amount", type=float, default=10.0)
+    parser.add_argument("--balance", type=float, default=500.0)
+    args = parser.parse_args()
+    run(args.mode, args.transfers, args.workers, args.amount, args.balance)
@@ -0,0 +1,132 @@
+# --- Stripe Card Summary Cache ---
+# /api/get-linked-card only shows brand/last4/expiry, which change when a card
+# is added, so summaries are cached per Stripe customer for CARD_CACHE_TTL
+# seconds. Concurrent misses for the same customer are coalesced: one thread
+# calls Stripe and the rest wait for its result, so a burst of page loads costs
+# one PaymentMethod.list. A customer with no card is cached too (as None).
+#
+# Adding a card bumps VERSION_FIELD on the user document, which the card route
+# reads anyway. An entry cached for an older version is a miss, so every worker
+# sees the new card on its next read, not just the one that handled the POST.
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import services
+from metrics import Counter
+
+CARD_CACHE_TTL = float(os.getenv("CARD_CACHE_TTL", "600"))
+CARD_CACHE_SIZE = int(os.getenv("CARD_CACHE_SIZE", "10000"))
+VERSION_FIELD = "cardsVersion"
+
+HITS = Counter("card_cache_hits_total", help="Card summaries answered from the cache")
+FETCHES = Counter("card_cache_stripe_fetches_total", help="PaymentMethod.list calls made on a cache miss")
+COALESCED = Counter("card_cache_coalesced_total", help="Misses that waited on another request's Stripe call")
+
+MISS = object()  # returned by cached() when the customer has no fresh entry
+
+def card_summary(cards):
+    if not cards.data:
+        return None
+    card = cards.data[0].card
+    return {
+        "brand": card["brand"],
+        "last4": card["last4"],
+        "exp_month": card["exp_month"],
+        "exp_year": card["exp_year"]
+    }
+
+def fetch_summary(customer_id):
+    return card_summary(services.get_stripe().PaymentMethod.list(customer=customer_id, type="card"))
+
+def card_version(user_data):
+    return int(user_data.get(VERSION_FIELD) or 0)
+
+class _Flight:
+    def __init__(self, version):
+        self.version = version
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.stale = False  # set by invalidate() while the fetch is in progress
+
+class CardCache:
+    def __init__(self, fetch=fetch_summary, ttl=CARD_CACHE_TTL, max_entries=CARD_CACHE_SIZE):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # customer_id -> (expires_at, version, summary or None)
+        self._flights = {}             # customer_id -> _Flight for the in-progress fetch
+        self._lock = threading.Lock()
+
+    def cached(self, customer_id, version=0):
+        """The cached summary (None means no card), or MISS if none is fresh for the card `version`."""
+        with self._lock:
+            entry = self._entries.get(customer_id)
+            if entry is None:
+                return MISS
+            if entry[0] <= time.monotonic() or entry[1] < version:
+                del self._entries[customer_id]
+                return MISS
+            self._entries.move_to_end(customer_id)
+        HITS.inc()
+        return entry[2]
+
+    def get(self, customer_id, version=0):
+        """Summary of the customer's first card, or None; raises whatever Stripe raised."""
+        summary = self.cached(customer_id, version)
+        if summary is not MISS:
+            return summary
+
+        with self._lock:
+            flight = self._flights.get(customer_id)
+            leader = flight is None or flight.version < version
+            if leader:
+                if flight is not None:
+                    flight.stale = True  # began before the card this request knows about was added
+                flight = self._flights[customer_id] = _Flight(version)
+
+        if not leader:
+            COALESCED.inc()
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            FETCHES.inc()
+            flight.result = self.fetch(customer_id)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(customer_id) is flight:
+                    del self._flights[customer_id]
+                # A card added while Stripe was answering makes this result stale
+                if flight.error is None and not flight.stale:
+                    self._entries[customer_id] = (time.monotonic() + self.ttl, flight.version, flight.result)
+                    self._entries.move_to_end(customer_id)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            flight.done.set()
+        return flight.result
+
+    def invalidate(self, customer_id):
+        with self._lock:
+            self._entries.pop(customer_id, None)
+            # Requests after this point start a fresh fetch instead of joining one begun before it
+            flight = self._flights.pop(customer_id, None)
+            if flight is not None:
+                flight.stale = True
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": HITS.value,
+            "stripe_fetches": FETCHES.value,
+            "coalesced": COALESCED.value,
+        }
+
+card_cache = CardCache()
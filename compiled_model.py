@@ -0,0 +1,207 @@
+# --- Compiled Tree Predictor ---
+# Flattens a trained binary XGBClassifier into padded per-tree node arrays and
+# evaluates every tree for every row with vectorized NumPy. Scoring needs only
+# NumPy, so small batches skip DMatrix construction and the XGBoost wrapper,
+# whose fixed per-call cost dominates a single row. The walk does O(rows x trees)
+# gathers per level, though, so XGBoost's native predictor overtakes it on large
+# batches. SmallBatchModel serves each batch with the faster of the two.
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+ARRAYS = ["feature", "threshold", "left", "right", "missing", "value"]
+CHUNK_ROWS = 8192  # bounds the (rows x trees) working set
+# Largest batch scored by the CompiledModel; `python compiled_model.py` prints the crossover
+MAX_COMPILED_ROWS = int(os.getenv("COMPILED_MAX_ROWS", "64"))
+
+def _base_score(learner):
+    # Stored as "5E-1" or, in newer releases, "[5E-1]"
+    raw = learner["learner_model_param"]["base_score"]
+    return float(str(raw).strip("[]"))
+
+class CompiledModel:
+    def __init__(self, arrays, base_margin, depth, feature_names):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.base_margin = float(base_margin)
+        self.depth = int(depth)
+        self.feature_names = list(feature_names)
+        self.n_trees, self.n_nodes = self.feature.shape
+        self._offsets = (np.arange(self.n_trees, dtype=np.int64) * self.n_nodes)[None, :]
+        # Flat views so each step is a single fancy-index gather
+        self._flat = {name: getattr(self, name).reshape(-1) for name in ARRAYS}
+
+    def _margin(self, X):
+        flat = self._flat
+        rows = np.arange(X.shape[0])[:, None]
+        node = np.broadcast_to(self._offsets, (X.shape[0], self.n_trees))
+        for _ in range(self.depth):
+            x = X[rows, flat["feature"][node]]
+            # XGBoost sends x < split_condition to the left child and NaN to the default child
+            nxt = np.where(x < flat["threshold"][node], flat["left"][node], flat["right"][node])
+            node = np.where(np.isnan(x), flat["missing"][node], nxt) + self._offsets
+        return self.base_margin + flat["value"][node].sum(axis=1, dtype=np.float64)
+
+    def predict_proba(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        margin = np.concatenate([self._margin(X[i:i + CHUNK_ROWS]) for i in range(0, X.shape[0], CHUNK_ROWS)])
+        p = 1.0 / (1.0 + np.exp(-margin))
+        return np.column_stack([1.0 - p, p])
+
+    def predict(self, X):
+        return (self.predict_proba(X)[:, 1] > 0.5).astype(int)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({
+                "base_margin": self.base_margin,
+                "depth": self.depth,
+                "feature_names": self.feature_names,
+            }, f, indent=2)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in ARRAYS}
+        return cls(arrays, meta["base_margin"], meta["depth"], meta["feature_names"])
+
+class SmallBatchModel:
+    """Scores batches of up to max_rows rows with the CompiledModel, larger ones with the XGBoost model.
+
+    The XGBoost model comes from `load_model()` on the first large batch, so a
+    process that only scores small batches never unpickles it.
+    """
+
+    def __init__(self, load_model, compiled, max_rows=MAX_COMPILED_ROWS):
+        self.compiled = compiled
+        self.max_rows = max_rows
+        self._load_model = load_model
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._load_model()
+        return self._model
+
+    def predict_proba(self, X):
+        if len(X) <= self.max_rows:
+            return self.compiled.predict_proba(X)
+        return self.model.predict_proba(X)
+
+    def predict(self, X):
+        return (self.predict_proba(X)[:, 1] > 0.5).astype(int)
+
+def compile_model(model):
+    """Build a CompiledModel from a binary:logistic XGBClassifier (or Booster)."""
+    booster = model.get_booster() if hasattr(model, "get_booster") else model
+    dump = json.loads(booster.save_raw(raw_format="json"))
+    learner = dump["learner"]
+    objective = learner["objective"]["name"]
+    if objective != "binary:logistic":
+        raise ValueError(f"Only binary:logistic models can be compiled, got {objective}")
+
+    trees = learner["gradient_booster"]["model"]["trees"]
+    # Match predict_proba, which stops at the best iteration when early stopping was used
+    best_iteration = booster.attr("best_iteration")
+    if best_iteration is not None:
+        trees = trees[:int(best_iteration) + 1]
+
+    feature_names = booster.feature_names or [f"f{i}" for i in range(booster.num_features())]
+    n_nodes = max(len(t["left_children"]) for t in trees)
+    arrays = {
+        "feature": np.zeros((len(trees), n_nodes), dtype=np.int32),
+        "threshold": np.zeros((len(trees), n_nodes), dtype=np.float32),
+        "left": np.zeros((len(trees), n_nodes), dtype=np.int64),
+        "right": np.zeros((len(trees), n_nodes), dtype=np.int64),
+        "missing": np.zeros((len(trees), n_nodes), dtype=np.int64),
+        "value": np.zeros((len(trees), n_nodes), dtype=np.float32),
+    }
+
+    depth = 0
+    for t, tree in enumerate(trees):
+        left = np.asarray(tree["left_children"], dtype=np.int64)
+        right = np.asarray(tree["right_children"], dtype=np.int64)
+        cond = np.asarray(tree["split_conditions"], dtype=np.float32)
+        default_left = np.asarray(tree["default_left"], dtype=bool)
+        is_leaf = left == -1
+        nodes = np.arange(len(left))
+
+        # Leaves point at themselves, so extra iterations leave the walk in place
+        arrays["feature"][t, :len(left)] = np.where(is_leaf, 0, tree["split_indices"])
+        arrays["threshold"][t, :len(left)] = np.where(is_leaf, 0, cond)
+        arrays["left"][t, :len(left)] = np.where(is_leaf, nodes, left)
+        arrays["right"][t, :len(left)] = np.where(is_leaf, nodes, right)
+        arrays["missing"][t, :len(left)] = np.where(is_leaf, nodes, np.where(default_left, left, right))
+        arrays["value"][t, :len(left)] = np.where(is_leaf, cond, 0)
+        depth = max(depth, _tree_depth(left, right))
+
+    base_score = _base_score(learner)
+    return CompiledModel(arrays, math.log(base_score / (1.0 - base_score)), depth, feature_names)
+
+def _tree_depth(left, right):
+    depth, frontier = 0, [0]
+    while True:
+        frontier = [c for n in frontier if left[n] != -1 for c in (left[n], right[n])]
+        if not frontier:
+            return depth
+        depth += 1
+
+def _parity_inputs(compiled, n_rows, rng):
+    # Sample values right at and around the split thresholds, plus some NaNs,
+    # so every branch (and the default direction) is exercised
+    X = np.empty((n_rows, len(compiled.feature_names)), dtype=np.float32)
+    for j in range(X.shape[1]):
+        splits = compiled.threshold[compiled.feature == j]
+        splits = splits if splits.size else np.zeros(1, dtype=np.float32)
+        X[:, j] = rng.choice(splits, n_rows) + rng.choice([-1e-3, 0, 1e-3], n_rows).astype(np.float32)
+    X[rng.random(X.shape) < 0.02] = np.nan
+    return X
+
+def check_and_benchmark(model_path, compiled_path, tolerance=1e-5, repeat=50):
+    """Parity check against the original model, then latency at batch sizes from 1 to 4096."""
+    import joblib
+    import pandas as pd
+
+    model = joblib.load(model_path)
+    compiled = compile_model(model)
+    compiled.save(compiled_path)
+    compiled = CompiledModel.load(compiled_path)
+
+    rng = np.random.default_rng(100)
+    X = _parity_inputs(compiled, 20000, rng)
+    expected = model.predict_proba(pd.DataFrame(X, columns=compiled.feature_names))[:, 1]
+    got = compiled.predict_proba(X)[:, 1]
+    max_diff = float(np.max(np.abs(expected - got)))
+    print(f"Parity: max |p_xgb - p_compiled| = {max_diff:.3g} over {len(X)} rows")
+    if max_diff > tolerance:
+        raise SystemExit(f"Parity check failed (tolerance {tolerance})")
+
+    for batch in (1, 16, 64, 256, 1024, 4096):
+        Xb = X[:batch]
+        frame = pd.DataFrame(Xb, columns=compiled.feature_names)
+        for name, fn in (("xgboost", lambda: model.predict_proba(frame)), ("compiled", lambda: compiled.predict_proba(Xb))):
+            fn()
+            start = time.perf_counter()
+            for _ in range(repeat):
+                fn()
+            per_call = (time.perf_counter() - start) / repeat
+            print(f"batch={batch:<5} {name:<9} {per_call * 1e3:8.3f} ms/call  {per_call / batch * 1e6:8.2f} us/row")
+
+if __name__ == "__main__":
+    # python compiled_model.py [fraud_model.pkl] [fraud_model_compiled]
+    check_and_benchmark(*(sys.argv[1:3] or ["fraud_model.pkl", "fraud_model_compiled"]))
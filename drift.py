@@ -0,0 +1,250 @@
+# --- Feature and Score Drift Monitor ---
+# train.py stores a reference histogram of every model input, and of the
+# model's holdout fraud scores, in the model's meta.json ("drift_reference").
+# Feature bins are training-data quantiles, so each holds about the same share
+# of training rows; missing values get a bin of their own.
+#
+# Serving counts every scored transaction into the same bins: one vectorised
+# comparison into fixed-size count arrays per model version, so the cost per
+# request and the memory are constant. Counts only ever add, so workers merge by
+# summing: each worker folds its counts into
+# drift_stats/{model_version}__{YYYY-MM-DD} with Increments every
+# DRIFT_FLUSH_SECONDS (one write per worker per interval). GET /api/drift sums
+# the last few days and compares them with the reference as PSI and a binned
+# KS statistic per feature.
+import atexit
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+import metrics
+
+BINS = 20
+SCORE_EDGES = np.linspace(0, 1, BINS + 1)[1:-1]
+REFERENCE_ROWS = 1_000_000  # training rows sampled for the reference
+FLUSH_SECONDS = float(os.getenv("DRIFT_FLUSH_SECONDS", "60"))
+COLLECTION = "drift_stats"
+MAX_DAYS = 31
+PSI_ALERT = 0.2  # the usual reading: < 0.1 stable, 0.1-0.2 moderate shift, > 0.2 significant shift
+EPSILON = 1e-4   # keeps PSI finite when a bin is empty on one side
+
+# --- Reference (train.py) ---
+def _histogram(values, edges):
+    """Counts per value bin (len(edges) + 1 of them), then the count of missing values."""
+    values = np.asarray(values, dtype=np.float64)
+    missing = ~np.isfinite(values)
+    counts = np.bincount(np.searchsorted(edges, values[~missing], side="right"), minlength=len(edges) + 1)
+    return counts.tolist() + [int(missing.sum())]
+
+def reference(X, feature_columns, scores, bins=BINS, max_rows=REFERENCE_ROWS):
+    """The drift_reference for a model trained on X (columns in feature_columns order).
+
+    `scores` are the model's fraud scores on held-out rows.
+    """
+    if len(X) > max_rows:
+        X = X[np.sort(np.random.default_rng(100).choice(len(X), max_rows, replace=False))]
+    columns = {}
+    for j, name in enumerate(feature_columns):
+        values = np.asarray(X[:, j], dtype=np.float64)
+        finite = values[np.isfinite(values)]
+        edges = np.unique(np.quantile(finite, np.linspace(0, 1, bins + 1)[1:-1])) if len(finite) else np.empty(0)
+        columns[name] = {"edges": edges.tolist(), "counts": _histogram(values, edges)}
+    return {
+        "rows": int(len(X)),
+        "features": columns,
+        "scores": {"edges": SCORE_EDGES.tolist(), "counts": _histogram(scores, SCORE_EDGES)},
+    }
+
+# --- Live counts (serving) ---
+class _Counts:
+    """Live counts for one model version, in its reference's bins."""
+
+    def __init__(self, ref, feature_columns):
+        self.ref = ref
+        self.columns = [c for c in feature_columns if c in ref["features"]]
+        self.index = np.array([feature_columns.index(c) for c in self.columns], dtype=np.int64)
+        self.sizes = [len(ref["features"][c]["edges"]) for c in self.columns]
+        width = max(self.sizes, default=0)
+        # Edges padded with +inf, which no finite value reaches
+        self.edges = np.full((len(self.columns), width), np.inf)
+        for i, c in enumerate(self.columns):
+            self.edges[i, :self.sizes[i]] = ref["features"][c]["edges"]
+        self.missing = width + 1
+        self.score_edges = np.asarray(ref["scores"]["edges"])
+        self._rows = np.arange(len(self.columns))
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.counts = np.zeros((len(self.columns), self.missing + 1), dtype=np.int64)
+        self.score_counts = np.zeros(len(self.score_edges) + 2, dtype=np.int64)
+
+    def add(self, row, score):
+        x = row[self.index]
+        bins = (x[:, None] >= self.edges).sum(axis=1)
+        bins[~np.isfinite(x)] = self.missing
+        self.counts[self._rows, bins] += 1
+        self.score_counts[int(np.searchsorted(self.score_edges, score, side="right")) if np.isfinite(score) else -1] += 1
+        self.n += 1
+
+    def histograms(self):
+        """{feature: counts list in reference layout}, score counts list."""
+        features = {c: self.counts[i, :self.sizes[i] + 1].tolist() + [int(self.counts[i, self.missing])]
+                    for i, c in enumerate(self.columns)}
+        return features, self.score_counts.tolist()
+
+def _doc_fields(n, features, scores):
+    # Nested Increments, like rollups.add_to_rollup; zero bins are left out
+    from google.cloud.firestore_v1.transforms import Increment
+
+    def bins(counts):
+        return {("missing" if k == len(counts) - 1 else f"b{k}"): Increment(v)
+                for k, v in enumerate(counts) if v}
+    return {"rows": Increment(n), "features": {c: bins(v) for c, v in features.items() if any(v)},
+            "scores": bins(scores)}
+
+def _from_doc(bins, size):
+    """Counts list (size value bins + missing) from a stored {"b0": n, ..., "missing": n} map."""
+    return [int(bins.get(f"b{k}", 0)) for k in range(size)] + [int(bins.get("missing", 0))]
+
+class DriftMonitor:
+    def __init__(self, db=None, flush_seconds=FLUSH_SECONDS):
+        self.db = db  # None keeps counts in this process only
+        self.flush_seconds = flush_seconds
+        self._live = {}  # model version -> _Counts, or None when the model has no reference
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        # Started lazily (and restarted after fork), like the other background workers
+        if self.db is None or (self._thread is not None and self._pid == os.getpid()):
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                if self._thread is None:
+                    atexit.register(self.flush)
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="drift-flush", daemon=True)
+                self._thread.start()
+
+    def _counts(self, loaded):
+        live = self._live.get(loaded.version, False)
+        if live is False:
+            ref = loaded.meta.get("drift_reference")
+            with self._lock:
+                live = self._live.setdefault(loaded.version, _Counts(ref, loaded.feature_columns) if ref else None)
+        return live
+
+    def observe(self, loaded, row, score):
+        """Count one scored feature row (in loaded.feature_columns order) and its fraud score."""
+        live = self._counts(loaded)
+        if live is None:
+            return
+        self._ensure_started()
+        with self._lock:
+            live.add(row, score)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                print("Drift counts flush failed:", e)
+
+    def flush(self):
+        """Fold this worker's counts into today's drift_stats documents and start counting afresh."""
+        if self.db is None:
+            return
+        day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        pending = []
+        with self._lock:
+            for version, live in self._live.items():
+                if live is not None and live.n:
+                    pending.append((version, live.n, *live.histograms()))
+                    live.reset()
+        if not pending:
+            return
+        batch = self.db.batch()
+        for version, n, features, scores in pending:
+            batch.set(self.db.collection(COLLECTION).document(f"{version}__{day}"), _doc_fields(n, features, scores),
+                      merge=True)
+        batch.commit()
+        metrics.firestore_writes(len(pending))
+
+    def report(self, loaded, days=1):
+        """PSI / KS per feature and for the fraud score, over the last `days` UTC days, all workers."""
+        ref = loaded.meta.get("drift_reference")
+        if not ref:
+            return {"model_version": loaded.version, "error": "Model has no drift_reference (retrain with train.py)"}
+        sizes = {c: len(f["edges"]) + 1 for c, f in ref["features"].items()}
+        features = {c: np.zeros(s + 1, dtype=np.int64) for c, s in sizes.items()}
+        scores = np.zeros(len(ref["scores"]["edges"]) + 2, dtype=np.int64)
+        rows = 0
+
+        if self.db is not None:
+            today = datetime.now(timezone.utc).date()
+            for d in range(days):
+                day = (today - timedelta(days=d)).strftime("%Y-%m-%d")
+                doc = self.db.collection(COLLECTION).document(f"{loaded.version}__{day}").get()
+                metrics.firestore_reads()
+                if not doc.exists:
+                    continue
+                data = doc.to_dict()
+                rows += int(data.get("rows", 0))
+                for c, bins in (data.get("features") or {}).items():
+                    if c in features:
+                        features[c] += _from_doc(bins, sizes[c])
+                scores += _from_doc(data.get("scores") or {}, len(scores) - 1)
+
+        # Plus what this worker has not flushed yet
+        live = self._counts(loaded)
+        if live is not None:
+            with self._lock:
+                rows += live.n
+                local_features, local_scores = live.histograms()
+            for c, counts in local_features.items():
+                features[c] += counts
+            scores += local_scores
+
+        out = {}
+        for c, counts in features.items():
+            psi, ks = compare(ref["features"][c]["counts"], counts)
+            out[c] = {"psi": psi, "ks": ks, "missing_rate": _rate(counts[-1], counts.sum()),
+                      "reference_missing_rate": _rate(ref["features"][c]["counts"][-1], sum(ref["features"][c]["counts"]))}
+        score_psi, score_ks = compare(ref["scores"]["counts"], scores)
+        return {
+            "model_version": loaded.version,
+            "days": days,
+            "rows": rows,
+            "reference_rows": ref["rows"],
+            "features": out,
+            "score": {"psi": score_psi, "ks": score_ks},
+            "alerts": sorted(c for c, v in out.items() if v["psi"] is not None and v["psi"] > PSI_ALERT)
+                      + (["fraud_score"] if score_psi is not None and score_psi > PSI_ALERT else []),
+        }
+
+def _rate(part, total):
+    return float(part) / float(total) if total else None
+
+def compare(reference_counts, live_counts):
+    """(PSI, KS) between two histograms over the same bins, the last bin being "missing"; None if either is empty.
+
+    KS is computed on the value bins alone, so it is a lower bound on the exact
+    two-sample statistic (the maximum gap can only be seen at bin edges).
+    """
+    ref = np.asarray(reference_counts, dtype=np.float64)
+    live = np.asarray(live_counts, dtype=np.float64)
+    if not ref.sum() or not live.sum():
+        return None, None
+    p, q = ref / ref.sum(), live / live.sum()
+    psi = float(np.sum((q - p) * np.log((q + EPSILON) / (p + EPSILON))))
+    ref_values, live_values = ref[:-1], live[:-1]
+    if not ref_values.sum() or not live_values.sum():
+        return psi, None
+    ks = float(np.max(np.abs(np.cumsum(ref_values) / ref_values.sum() - np.cumsum(live_values) / live_values.sum())))
+    return psi, ks
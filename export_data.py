@@ -1,28 +1,298 @@
-import pandas as pd
+import json
+import itertools
+import queue
+import threading
+from datetime import datetime, timezone
+import argparse
+import pyarrow as pa
+import pyarrow.parquet as pq
 import firebase_admin
 from firebase_admin import credentials, firestore, auth
 import os
 from dotenv import load_dotenv
+from features import VELOCITY_COLUMNS
+from prediction_log import LOG_DIR, read_records
 load_dotenv()
 
-def export_data():
-    
+# --- Config ---
+EXPORT_DIR = "data/app_transactions"          # Parquet parts, read by train.py
+STATE_PATH = "data/export_state.json"         # watermark for incremental runs
+LABELS = ["fraud", "legit"]
+CHUNK_ROWS = 50_000                           # rows per Parquet row group
+FILE_ROWS = 1_000_000                         # rows per part file; the watermark advances per part
+
+SCHEMA = pa.schema([
+    ("uid", pa.string()),
+    ("txn_id", pa.string()),
+    ("type", pa.string()),
+    ("amount", pa.float64()),
+    ("timestamp", pa.timestamp("us", tz="UTC")),
+    ("label", pa.string()),
+    ("fraud", pa.bool_()),
+    ("fraud_score", pa.float64()),
+    ("prediction", pa.float64()),
+    ("model_version", pa.string()),
+    ("wallet_ratio", pa.float64()),
+    ("hour_of_day", pa.float64()),
+    ("sender_freq", pa.float64()),
+    ("receiver_freq", pa.float64()),
+    ("is_merchant", pa.float64()),
+    ("isFlagged", pa.bool_()),
+    ("verified", pa.bool_()),
+    ("direction", pa.string()),
+    ("resolved_at", pa.string()),
+    *[(c, pa.float64()) for c in VELOCITY_COLUMNS],  # absent (null) on rows written before velocity.py
+])
+
+def init_db():
     cred_path = os.getenv("FIREBASE_CREDENTIALS")
     cred = credentials.Certificate(cred_path)
     firebase_admin.initialize_app(cred)
-    db = firestore.client()
-    all_txns = []
+    return firestore.client()
+
+def iter_user_transactions(db):
+    """Yield (uid, txn_dict) for every transaction of every user."""
     users = db.collection("users").stream()
     for u in users:
         txns = db.collection("users").document(u.id).collection("transactions").stream()
         for t in txns:
-            d = t.to_dict()
-            if d.get("label") in ["fraud", "legit"]:
-                all_txns.append(d)
+            yield u.id, t.to_dict()
+
+def _coerce(value, pa_type):
+    if value is None:
+        return None
+    if pa.types.is_floating(pa_type):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    if pa.types.is_boolean(pa_type):
+        return bool(value)
+    if pa.types.is_string(pa_type):
+        return str(value)
+    return value
+
+def _to_row(snapshot):
+    d = snapshot.to_dict()
+    d["uid"] = snapshot.reference.parent.parent.id
+    d["txn_id"] = snapshot.id
+    return {f.name: _coerce(d.get(f.name), f.type) for f in SCHEMA}
+
+def load_state(path=STATE_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def save_state(state, path=STATE_PATH):
+    # Written to a temp file and renamed so a crash never leaves a torn watermark
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+def labeled_transactions(db, state=None):
+    """Stream labeled transactions across all users, oldest first, after the stored watermark.
+
+    Needs a composite index on the "transactions" collection group: label ASC, timestamp ASC.
+    """
+    query = (db.collection_group("transactions")
+             .where("label", "in", LABELS)
+             .order_by("timestamp"))
+    if state and state.get("last_path"):
+        last = db.document(state["last_path"]).get()
+        if last.exists:
+            query = query.start_after(last)
+        else:
+            query = query.where("timestamp", ">", datetime.fromisoformat(state["timestamp"]))
+    return query.stream()
+
+def resolved_transactions(db, since):
+    """Transactions verified after `since`; they keep their original timestamp, so the
+    timestamp watermark alone would never pick up their new label."""
+    return (db.collection_group("transactions")
+            .where("resolved_at", ">", since)
+            .order_by("resolved_at")
+            .stream())
+
+class _PartWriter:
+    """Background Parquet writer so encoding overlaps with the Firestore stream."""
+
+    def __init__(self, out_dir, run_id, save_watermark=True):
+        self.out_dir = out_dir
+        self.run_id = run_id
+        self.save_watermark = save_watermark
+        self.parts = 0
+        self.rows = 0
+        self._queue = queue.Queue(maxsize=4)  # bounds memory to a few chunks
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, rows, watermark, end_of_part):
+        if self._error:
+            raise self._error
+        self._queue.put((rows, watermark, end_of_part))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self._error:
+            raise self._error
+
+    def _run(self):
+        writer, tmp_path = None, None
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                rows, watermark, end_of_part = item
+                if writer is None:
+                    tmp_path = os.path.join(self.out_dir, f".part-{self.run_id}-{self.parts:05d}.parquet.tmp")
+                    writer = pq.ParquetWriter(tmp_path, SCHEMA)
+                writer.write_table(pa.Table.from_pylist(rows, schema=SCHEMA), row_group_size=CHUNK_ROWS)
+                self.rows += len(rows)
+                if end_of_part:
+                    # Publish the part, then advance the watermark past it
+                    writer.close()
+                    os.replace(tmp_path, os.path.join(self.out_dir, f"part-{self.run_id}-{self.parts:05d}.parquet"))
+                    if self.save_watermark:
+                        save_state(watermark)
+                    writer = None
+                    self.parts += 1
+        except Exception as e:
+            self._error = e
+            # Keep draining so the producer never blocks on a dead writer
+            while self._queue.get() is not None:
+                pass
+        finally:
+            if writer is not None:
+                writer.close()
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+def export_data(full=False):
+    db = init_db()
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    state = None if full else load_state()
+    if full:
+        for name in os.listdir(EXPORT_DIR):
+            if name.startswith("part-"):
+                os.remove(os.path.join(EXPORT_DIR, name))
+
+    run_started = datetime.now(timezone.utc)
+    run_id = run_started.strftime("%Y%m%dT%H%M%S")
+    progress = dict(state or {})
+    progress.setdefault("resolved_at", run_started.isoformat())
+
+    # (snapshot, advances_watermark): only the timestamp-ordered stream moves the watermark
+    snapshots = ((s, True) for s in labeled_transactions(db, state))
+    if state and state.get("resolved_at"):
+        resolved = ((s, False) for s in resolved_transactions(db, state["resolved_at"]))
+        snapshots = itertools.chain(snapshots, resolved)
+
+    writer = _PartWriter(EXPORT_DIR, run_id)
+    rows, in_part, seen_resolved = [], 0, set()
+    for snapshot, advances in snapshots:
+        row = _to_row(snapshot)
+        if row["resolved_at"]:
+            # Created and verified since the last run: present in both streams
+            if snapshot.reference.path in seen_resolved:
+                continue
+            seen_resolved.add(snapshot.reference.path)
+        rows.append(row)
+        if advances:
+            progress.update(_watermark(snapshot))
+        if len(rows) == CHUNK_ROWS:
+            in_part += len(rows)
+            writer.put(rows, dict(progress), end_of_part=in_part >= FILE_ROWS)
+            rows, in_part = [], (0 if in_part >= FILE_ROWS else in_part)
+
+    # Anything verified from here on is picked up by the next run's resolved_at query
+    progress["resolved_at"] = run_started.isoformat()
+    if rows or in_part:
+        writer.put(rows, progress, end_of_part=True)
+    writer.close()
+    if not (rows or in_part):
+        save_state(progress)
+
+    since = f" since {state['timestamp']}" if state else ""
+    print(f"Exported {writer.rows} rows{since} to {EXPORT_DIR} ({writer.parts} new parts)")
+
+def _watermark(snapshot):
+    ts = snapshot.get("timestamp")
+    return {"timestamp": ts.isoformat() if ts else None, "last_path": snapshot.reference.path}
+
+# --- Export from the prediction log ---
+def log_rows(log_dir):
+    """SCHEMA rows for every logged champion prediction whose label has resolved.
+
+    A label event overrides the label logged at scoring time. The whole log is
+    folded in memory, one record per logged transaction.
+    """
+    scored, labels = {}, {}
+    for r in read_records(log_dir):
+        key = (r.get("uid"), r.get("txn_id"))
+        if r.get("event") == "label":
+            labels[key] = r
+        elif r.get("role", "champion") == "champion":
+            scored[key] = r
+
+    for key, r in scored.items():
+        label = labels.get(key, {})
+        row = {
+            **r.get("raw", {}),
+            "uid": r["uid"],
+            "txn_id": r["txn_id"],
+            "type": r.get("type"),
+            "amount": r.get("amount"),
+            "timestamp": datetime.fromisoformat(r["timestamp"]) if r.get("timestamp") else None,
+            "label": label.get("label", r.get("label")),
+            "fraud": bool(r.get("prediction")),
+            "fraud_score": r.get("proba"),
+            "prediction": r.get("prediction"),
+            "model_version": r.get("model_version"),
+            "resolved_at": label.get("resolved_at"),
+        }
+        if row["label"] in LABELS:
+            yield {f.name: _coerce(row.get(f.name), f.type) for f in SCHEMA}
+
+def export_from_logs(log_dir=LOG_DIR):
+    """Rebuild the log-derived parts of EXPORT_DIR from sealed prediction log segments.
+
+    No Firestore reads. The parts are named part-logs-*, which sort after the
+    Firestore export's parts, so train.py keeps the logged row for a transaction
+    exported both ways.
+    """
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    previous = [n for n in os.listdir(EXPORT_DIR) if n.startswith("part-logs-")]
+    run_id = "logs-" + datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+
+    writer = _PartWriter(EXPORT_DIR, run_id, save_watermark=False)
+    rows, in_part = [], 0
+    for row in log_rows(log_dir):
+        rows.append(row)
+        if len(rows) == CHUNK_ROWS:
+            in_part += len(rows)
+            writer.put(rows, None, end_of_part=in_part >= FILE_ROWS)
+            rows, in_part = [], (0 if in_part >= FILE_ROWS else in_part)
+    if rows or in_part:
+        writer.put(rows, None, end_of_part=True)
+    writer.close()
 
-    df = pd.DataFrame(all_txns)
-    df.to_csv("data/app_transactions.csv", index=False)  
-    print(f"Exported {len(df)} rows to data/app_transactions.csv")
+    # The new parts supersede the previous log export
+    for name in previous:
+        os.remove(os.path.join(EXPORT_DIR, name))
+    print(f"Exported {writer.rows} rows from {log_dir} to {EXPORT_DIR} ({writer.parts} parts)")
 
 if __name__ == "__main__":
-    export_data()
+    parser = argparse.ArgumentParser(description="Export labeled app transactions for training.")
+    parser.add_argument("--full", action="store_true", help="ignore the stored watermark and export everything")
+    parser.add_argument("--from-logs", nargs="?", const=LOG_DIR, metavar="DIR",
+                        help="build the export from prediction log segments (PREDICTION_LOG=jsonl) instead of Firestore")
+    args = parser.parse_args()
+    if args.from_logs:
+        export_from_logs(args.from_logs)
+    else:
+        export_data(full=args.full)
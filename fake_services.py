@@ -0,0 +1,389 @@
+# --- In-memory stand-ins for Firestore, Firebase Auth and Stripe ---
+# Just enough of each SDK for app.py's and async_app.py's request paths, so the
+# apps can be driven locally (bench_app.py, test_async_app.py) without
+# credentials or network access. install() patches the SDK modules in place;
+# the apps only import them on first use, so it works before or after `import app`.
+#
+# Each Firestore RPC can be given a simulated latency (rpc_ms, plus per_doc_us
+# for every document a query returns), so read amplification shows up in
+# request latency the way it would against the real service. Queries scan
+# their collection in Python, which adds a little CPU time of its own.
+import asyncio
+import copy
+import itertools
+import threading
+import time
+import types
+import uuid
+
+_MISSING = object()
+
+def _is_increment(value):
+    return type(value).__name__ == "Increment" and hasattr(value, "value")
+
+def _apply(current, value):
+    if _is_increment(value):
+        return (current if isinstance(current, (int, float)) else 0) + value.value
+    return copy.deepcopy(value)
+
+def _merge(target, updates):
+    for key, value in updates.items():
+        if isinstance(value, dict) and not _is_increment(value):
+            node = target.get(key)
+            if not isinstance(node, dict):
+                node = target[key] = {}
+            _merge(node, value)
+        else:
+            target[key] = _apply(target.get(key), value)
+
+def _resolve(data):
+    # A plain set() still applies transforms (Increment on a missing field starts at 0)
+    out = {}
+    _merge(out, data)
+    return out
+
+def _get_path(data, path):
+    for part in path.split("."):
+        if not isinstance(data, dict) or part not in data:
+            return _MISSING
+        data = data[part]
+    return data
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        value = _get_path(self._data or {}, field)
+        return None if value is _MISSING else value
+
+class FakeQuery:
+    _OPS = {
+        "==": lambda a, b: a == b,
+        "!=": lambda a, b: a != b,
+        "<": lambda a, b: a < b,
+        "<=": lambda a, b: a <= b,
+        ">": lambda a, b: a > b,
+        ">=": lambda a, b: a >= b,
+        "in": lambda a, b: a in b,
+    }
+
+    def __init__(self, client, path, filters=(), orders=(), limit=None, after=None):
+        self._client = client
+        self._path = path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._after = after
+
+    def _copy(self, **changes):
+        state = {"filters": self._filters, "orders": self._orders, "limit": self._limit, "after": self._after}
+        state.update(changes)
+        return FakeQuery(self._client, self._path, **state)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._copy(orders=self._orders + ((field, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, values):
+        if isinstance(values, FakeSnapshot):
+            values = values.to_dict()
+        return self._copy(after=values)
+
+    def _matches(self, data):
+        for field, op, value in self._filters:
+            actual = _get_path(data, field)
+            try:
+                if actual is _MISSING or not self._OPS[op](actual, value):
+                    return False
+            except TypeError:
+                return False
+        return True
+
+    def _sort_key(self, field):
+        def key(item):
+            value = _get_path(item[1], field)
+            return (value is _MISSING, None if value is _MISSING else value)
+        return key
+
+    def stream(self, transaction=None):
+        if transaction is not None:
+            transaction.hold(self._path)
+        with self._client.lock:
+            docs = [(doc_id, data) for doc_id, data in self._client.collection_docs(self._path).items()
+                    if self._matches(data)]
+            for field, direction in reversed(self._orders):
+                docs.sort(key=self._sort_key(field), reverse=direction == "DESCENDING")
+            if self._after is not None and self._orders:
+                field, direction = self._orders[0]
+                bound = self._after[field]
+                cmp = self._OPS["<" if direction == "DESCENDING" else ">"]
+                docs = [d for d in docs if _get_path(d[1], field) is not _MISSING and cmp(_get_path(d[1], field), bound)]
+            if self._limit is not None:
+                docs = docs[:self._limit]
+            result = [FakeSnapshot(FakeDocument(self._client, f"{self._path}/{doc_id}"), copy.deepcopy(data))
+                      for doc_id, data in docs]
+        self._client.simulate_rpc(len(result))
+        return iter(result)
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction))
+
+class FakeCollection(FakeQuery):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+
+    @property
+    def id(self):
+        return self._path.rsplit("/", 1)[-1]
+
+    def document(self, doc_id=None):
+        return FakeDocument(self._client, f"{self._path}/{doc_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return None, ref
+
+class FakeDocument:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self):
+        return FakeCollection(self._client, self.path.rsplit("/", 1)[0])
+
+    def collection(self, name):
+        return FakeCollection(self._client, f"{self.path}/{name}")
+
+    def get(self, transaction=None):
+        if transaction is not None:
+            transaction.hold(self.path)
+        with self._client.lock:
+            data = self._client.docs.get(self.path)
+            snapshot = FakeSnapshot(self, copy.deepcopy(data))
+        self._client.simulate_rpc(1)
+        return snapshot
+
+    def create(self, data):
+        self._client.commit_writes([("create", self, data, False)])
+
+    def set(self, data, merge=False):
+        self._client.commit_writes([("set", self, data, merge)])
+
+    def update(self, data):
+        self._client.commit_writes([("update", self, data, False)])
+
+    def delete(self):
+        self._client.commit_writes([("delete", self, None, False)])
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, ref, data, merge=False):
+        self._writes.append(("set", ref, data, merge))
+
+    def update(self, ref, data):
+        self._writes.append(("update", ref, data, False))
+
+    def delete(self, ref):
+        self._writes.append(("delete", ref, None, False))
+
+    def commit(self):
+        writes, self._writes = self._writes, []
+        self._client.commit_writes(writes)
+
+class FakeTransaction(FakeWriteBatch):
+    """Writes are buffered and committed when the transactional function returns.
+
+    Every document (or, for a query, collection) read in the transaction stays
+    locked until then, like the server SDKs' pessimistic locking, so concurrent
+    transactions on one account queue up instead of retrying.
+    """
+
+    def __init__(self, client):
+        super().__init__(client)
+        self._held = []
+
+    def hold(self, path):
+        lock = self._client.path_lock(path)
+        lock.acquire()
+        self._held.append(lock)
+
+    def release(self):
+        while self._held:
+            self._held.pop().release()
+
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, FakeDocument):
+            return ref_or_query.get(transaction=self)
+        return ref_or_query.stream(transaction=self)
+
+def transactional(fn):
+    """Stand-in for firestore.transactional."""
+    def run(transaction, *args, **kwargs):
+        try:
+            result = fn(transaction, *args, **kwargs)
+            transaction.commit()
+        finally:
+            transaction.release()
+        return result
+    return run
+
+class FakeFirestore:
+    def __init__(self, rpc_ms=0.0, per_doc_us=0.0):
+        self.docs = {}  # "users/u1/transactions/t1" -> dict
+        self.lock = threading.RLock()
+        self.rpc_ms = rpc_ms
+        self.per_doc_us = per_doc_us
+        self.rpcs = itertools.count()
+        self._path_locks = {}
+
+    def path_lock(self, path):
+        with self.lock:
+            return self._path_locks.setdefault(path, threading.RLock())
+
+    def simulate_rpc(self, docs):
+        next(self.rpcs)
+        delay = self.rpc_ms / 1000.0 + docs * self.per_doc_us / 1e6
+        if delay:
+            time.sleep(delay)
+
+    def collection_docs(self, path):
+        prefix = path + "/"
+        return {p[len(prefix):]: d for p, d in self.docs.items() if p.startswith(prefix) and "/" not in p[len(prefix):]}
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return FakeTransaction(self)
+
+    def commit_writes(self, writes):
+        with self.lock:
+            for op, ref, data, merge in writes:
+                if op == "delete":
+                    self.docs.pop(ref.path, None)
+                elif op == "create":
+                    if ref.path in self.docs:
+                        from google.api_core.exceptions import AlreadyExists
+                        raise AlreadyExists(f"Document already exists: {ref.path}")
+                    self.docs[ref.path] = _resolve(data)
+                elif op == "set" and not merge:
+                    self.docs[ref.path] = _resolve(data)
+                elif op == "set":
+                    _merge(self.docs.setdefault(ref.path, {}), data)
+                else:
+                    if ref.path not in self.docs:
+                        raise KeyError(f"No document to update: {ref.path}")
+                    nested = {}
+                    for field, value in data.items():
+                        node = nested
+                        *parents, leaf = field.split(".")
+                        for part in parents:
+                            node = node.setdefault(part, {})
+                        node[leaf] = value
+                    _merge(self.docs[ref.path], nested)
+        if writes:
+            self.simulate_rpc(0)
+
+    def clear(self):
+        with self.lock:
+            self.docs.clear()
+
+class AsyncView:
+    """firebase_admin.firestore_async-style view of a fake client, collection, document or query.
+
+    The RPCs (get, set, update, delete) are awaitable and run on a worker thread,
+    so a simulated latency does not block the event loop; stream() is an async
+    iterator. Everything else returns the wrapped result.
+    """
+
+    _RPCS = {"get", "set", "update", "delete"}
+
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+        if name == "stream":
+            async def stream(*args, **kwargs):
+                for snapshot in await asyncio.to_thread(lambda: list(attr(*args, **kwargs))):
+                    yield snapshot
+            return stream
+        if name in self._RPCS:
+            async def rpc(*args, **kwargs):
+                return await asyncio.to_thread(attr, *args, **kwargs)
+            return rpc
+        return lambda *args, **kwargs: AsyncView(attr(*args, **kwargs))
+
+# --- Firebase Auth and Stripe ---
+def fake_verify_id_token(id_token, *args, **kwargs):
+    """Tokens are "fake:<uid>"; anything else is rejected like a bad signature."""
+    if not isinstance(id_token, str) or not id_token.startswith("fake:"):
+        raise ValueError("Invalid fake ID token")
+    now = int(time.time())
+    return {"uid": id_token[len("fake:"):], "iat": now, "exp": now + 3600}
+
+def install_stripe(stripe):
+    stripe.Customer.create = staticmethod(lambda **kw: types.SimpleNamespace(id="cus_" + uuid.uuid4().hex[:14]))
+    stripe.Customer.create_source = staticmethod(lambda customer_id, source=None: {"id": "card_" + uuid.uuid4().hex[:14]})
+    card = {"brand": "visa", "last4": "4242", "exp_month": 12, "exp_year": 2030}
+    stripe.PaymentMethod.list = staticmethod(
+        lambda customer=None, type=None: types.SimpleNamespace(data=[types.SimpleNamespace(card=card)]))
+
+def install(rpc_ms=0.0, per_doc_us=0.0, emulator_project=None):
+    """Patch the Firebase Admin SDK and Stripe in place; returns the Firestore client app.py will use.
+
+    With emulator_project, that client is a real google.cloud.firestore.Client
+    (pointed at the emulator by FIRESTORE_EMULATOR_HOST) instead of a FakeFirestore.
+    """
+    import firebase_admin
+    import stripe
+    from firebase_admin import auth, credentials, firestore
+
+    if emulator_project:
+        from google.cloud import firestore as cloud_firestore
+        client = cloud_firestore.Client(project=emulator_project)
+        async_client = lambda *a, **kw: cloud_firestore.AsyncClient(project=emulator_project)
+    else:
+        client = FakeFirestore(rpc_ms, per_doc_us)
+        firestore.transactional = transactional
+        async_client = lambda *a, **kw: AsyncView(client)
+    credentials.Certificate = lambda *a, **kw: None
+    firebase_admin.initialize_app = lambda *a, **kw: None
+    firestore.client = lambda *a, **kw: client
+    try:
+        from firebase_admin import firestore_async
+        firestore_async.client = async_client  # async_app.py reads through the same documents
+    except ImportError:
+        pass
+    auth.verify_id_token = fake_verify_id_token
+    install_stripe(stripe)
+
+    import auth_cache
+    auth_cache._prefetch_certs = lambda: None  # there are no real signing certificates to keep warm
+    return client
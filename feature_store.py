@@ -0,0 +1,126 @@
+# --- Per-user Feature Store ---
+# Running counters kept on each user document under "tx_stats", so that the
+# history features used by /api/transaction cost no reads beyond the user
+# document itself instead of a scan of the whole transactions subcollection.
+import metrics
+import rollups
+
+BASE_TYPES = ["CASH_IN", "CASH_OUT", "DEBIT", "PAYMENT", "TRANSFER"]
+STATS_FIELD = "tx_stats"
+
+def empty_stats():
+    return {
+        "seeded": True,
+        "total_count": 0,
+        "type_counts": {t: 0 for t in BASE_TYPES},
+        "amount_sum": 0.0,
+        "last_amount": None,
+        "last_timestamp": None,
+    }
+
+def _type_key(stored_type):
+    # receiver_freq has always matched the stored type exactly. Transfers are stored
+    # as "TRANSFER Sent to ..." / "TRANSFER Received from ...", so they never count.
+    return stored_type if stored_type in BASE_TYPES else None
+
+def fold(stats, txn):
+    """Fold one transaction dict into an in-memory stats dict."""
+    stats["total_count"] += 1
+    stats["amount_sum"] += float(txn.get("amount") or 0)
+    key = _type_key(txn.get("type"))
+    if key:
+        stats["type_counts"][key] += 1
+    ts = txn.get("timestamp")
+    if ts is not None and (stats["last_timestamp"] is None or ts >= stats["last_timestamp"]):
+        stats["last_timestamp"] = ts
+        stats["last_amount"] = txn.get("amount")
+    return stats
+
+def stats_from_transactions(txns):
+    stats = empty_stats()
+    for t in txns:
+        fold(stats, t)
+    return stats
+
+def load_stats(db, user_ref, user_data):
+    """Return the user's counters, seeding them from a one-off history scan if missing."""
+    stats = user_data.get(STATS_FIELD)
+    if stats and stats.get("seeded"):
+        return stats
+
+    # Users created before the feature store (or only ever credited by transfers)
+    # pay for a single full scan, after which reads are O(1).
+    from firebase_admin import firestore
+    return firestore.transactional(_seed)(db.transaction(), user_ref)
+
+def _seed(transaction, user_ref):
+    # The scan and the write share one transaction with a re-read of the user document,
+    # so a ledger commit cannot land between them (its entry would be missed) and a
+    # seed another request finished first is returned instead of being overwritten
+    snapshot = user_ref.get(transaction=transaction)
+    stats = (snapshot.to_dict() or {}).get(STATS_FIELD)
+    if stats and stats.get("seeded"):
+        metrics.firestore_reads()
+        return stats
+    history = user_ref.collection("transactions").order_by("__name__")  # a query, as transaction.get needs
+    txns = [t.to_dict() for t in transaction.get(history)]
+    stats = stats_from_transactions(txns)
+    transaction.update(user_ref, {STATS_FIELD: stats})
+    metrics.firestore_reads(1 + max(1, len(txns)))
+    metrics.firestore_writes()
+    return stats
+
+def history_features(stats, tx_type):
+    """(sender_freq, receiver_freq) as previously computed from the full history."""
+    return int(stats.get("total_count", 0)), int(stats.get("type_counts", {}).get(tx_type, 0))
+
+def stats_update(txn):
+    """Field updates that fold one newly written transaction into tx_stats."""
+    from google.cloud.firestore_v1.transforms import Increment
+    updates = {
+        f"{STATS_FIELD}.total_count": Increment(1),
+        f"{STATS_FIELD}.amount_sum": Increment(float(txn.get("amount") or 0)),
+        f"{STATS_FIELD}.last_amount": txn.get("amount"),
+        f"{STATS_FIELD}.last_timestamp": txn.get("timestamp"),
+    }
+    key = _type_key(txn.get("type"))
+    if key:
+        updates[f"{STATS_FIELD}.type_counts.{key}"] = Increment(1)
+    return updates
+
+def add_transaction(writer, user_ref, txn, user_updates=None):
+    """Stage a new transaction, its counter update and its daily rollup on a WriteBatch or Transaction.
+
+    All land in the same commit, so the counters can never drift from the ledger.
+    `user_updates` are merged into the single user-document update.
+    """
+    txn_ref = user_ref.collection("transactions").document()
+    writer.set(txn_ref, txn)
+    writer.update(user_ref, {**stats_update(txn), **(user_updates or {})})
+    metrics.firestore_writes(2)
+    rollups.add_to_rollup(writer, user_ref, txn)
+    return txn_ref
+
+def rebuild_stats():
+    """Recompute tx_stats for every user from their full transaction history."""
+    from export_data import init_db, iter_user_transactions
+
+    db = init_db()
+    users = 0
+    current_uid, stats = None, None
+    # iter_user_transactions walks one user's subcollection at a time
+    for uid, txn in iter_user_transactions(db):
+        if uid != current_uid:
+            if current_uid is not None:
+                db.collection("users").document(current_uid).update({STATS_FIELD: stats})
+                users += 1
+            current_uid, stats = uid, empty_stats()
+        fold(stats, txn)
+    if current_uid is not None:
+        db.collection("users").document(current_uid).update({STATS_FIELD: stats})
+        users += 1
+
+    print(f"Rebuilt {STATS_FIELD} for {users} users")
+
+if __name__ == "__main__":
+    rebuild_stats()
@@ -0,0 +1,98 @@
+# --- Import-time Budget ---
+# Imports app.py (or another module) in a fresh interpreter under
+# `python -X importtime`. Prints the import time and the slowest modules, and
+# exits 1 when the import takes longer than the budget, or when it loads one of
+# the SDKs that are only meant to load on first use (Firestore and its gRPC
+# transport, Firebase Auth), so CI catches a change that drags initialisation
+# back into import.
+#
+#   python import_budget.py --budget-ms 1500
+#   python import_budget.py --module async_app --top 30
+#   python import_budget.py --forbid google.cloud.firestore_v1 --forbid grpc
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+FORBIDDEN = ["google.cloud.firestore", "google.cloud.firestore_v1", "grpc",
+             "firebase_admin.firestore", "firebase_admin.firestore_async", "firebase_admin.auth"]
+
+def measure(module):
+    """(wall seconds, [(self us, cumulative us, module name)]) for one fresh `import module`."""
+    env = {k: v for k, v in os.environ.items() if k != "WARMUP"}  # measure the import, not a warm-up
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, env=env)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        # "import time:       self [us] |  cumulative | imported package"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(self_us), int(cumulative_us), name.rstrip()))
+    return wall, rows
+
+def interpreter_startup():
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return time.perf_counter() - start
+
+def importers(rows, at):
+    """Names of the modules whose import pulled in rows[at], outermost last."""
+    def indent(name):
+        return len(name) - len(name.lstrip())
+    chain, level = [], indent(rows[at][2])
+    for _, _, name in rows[at + 1:]:
+        if indent(name) < level:
+            chain.append(name.strip())
+            level = indent(name)
+    return chain
+
+def report(module, budget_ms, top, forbidden=()):
+    baseline = interpreter_startup()
+    wall, rows = measure(module)
+    total_ms = next((c for _, c, name in rows if name.strip() == module), sum(s for s, _, _ in rows)) / 1000
+
+    # -X importtime lists a module's imports (indented deeper) just before the module itself
+    def indent(name):
+        return len(name) - len(name.lstrip())
+    at = next((i for i, (_, _, name) in enumerate(rows) if name.strip() == module), len(rows))
+    start = at
+    while start > 0 and at < len(rows) and indent(rows[start - 1][2]) > indent(rows[at][2]):
+        start -= 1
+    subtree = rows[start:at + 1]
+    direct = [(c, name.strip()) for _, c, name in rows[start:at] if indent(name) == indent(rows[at][2]) + 2]
+
+    print(f"import {module}: {total_ms:.0f} ms (process {wall * 1000:.0f} ms, bare interpreter {baseline * 1000:.0f} ms)")
+    print("\nSlowest modules by self time:")
+    for self_us, cumulative_us, name in sorted(subtree, reverse=True)[:top]:
+        print(f"{self_us / 1000:9.1f} ms self {cumulative_us / 1000:9.1f} ms cumulative  {name.strip()}")
+    print("\nDirect imports by cumulative time:")
+    for cumulative_us, name in sorted(direct, reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:9.1f} ms  {name}")
+
+    status = 0
+    if budget_ms and total_ms > budget_ms:
+        print(f"\nOVER BUDGET: import {module} took {total_ms:.0f} ms, budget {budget_ms:.0f} ms")
+        status = 1
+    for i, (_, _, name) in enumerate(rows):
+        if name.strip() in forbidden:
+            print(f"\nLOADED AT IMPORT: {name.strip()}, via " + " <- ".join(importers(rows, i)))
+            status = 1
+    return status
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the import time of the app against a budget.")
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "0")),
+                        help="fail above this many ms (0: report only)")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--forbid", action="append", metavar="MODULE",
+                        help=f"fail if the import loads this module (repeatable; default: {', '.join(FORBIDDEN)})")
+    args = parser.parse_args()
+    raise SystemExit(report(args.module, args.budget_ms, args.top, args.forbid or FORBIDDEN))
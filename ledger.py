@@ -0,0 +1,108 @@
+# --- Ledger Writes ---
+# Every money movement in /api/transaction commits as one unit: the balance
+# check, the debit/credit, the ledger entries and the feature-store counters.
+# Debits run in a Firestore transaction that reads the payer's balance, so two
+# concurrent transfers from one account cannot both pass the balance check.
+from datetime import datetime, timezone
+
+import feature_store
+import metrics
+
+class InsufficientBalance(Exception):
+    pass
+
+def _balance(snapshot):
+    return float((snapshot.to_dict() or {}).get("balance", 0))
+
+def _run(db, fn, *args):
+    # Wrapped per call rather than decorated at import, so importing the ledger
+    # does not load the Firestore SDK
+    from firebase_admin import firestore
+    return firestore.transactional(fn)(db.transaction(), *args)
+
+def _debit(transaction, user_ref, amount, txn, flagged, credit_ref=None, credit_txn=None):
+    # All reads happen before any write, as Firestore transactions require
+    snapshot = user_ref.get(transaction=transaction)
+    metrics.firestore_reads()
+    if _balance(snapshot) < amount:
+        raise InsufficientBalance()
+
+    if flagged:
+        # Held for OTP verification: record it, move no money
+        return feature_store.add_transaction(transaction, user_ref, txn, user_updates={"has_fraud_alert": True})
+
+    from google.cloud.firestore_v1.transforms import Increment
+    txn_ref = feature_store.add_transaction(transaction, user_ref, txn, user_updates={"balance": Increment(-amount)})
+    if credit_ref is not None:
+        feature_store.add_transaction(transaction, credit_ref, credit_txn, user_updates={"balance": Increment(amount)})
+    return txn_ref
+
+def transfer(db, user_ref, recipient_ref, amount, sent_txn, received_txn, flagged):
+    """Debit the sender and credit the recipient atomically; returns the sender's ledger entry."""
+    return _run(db, _debit, user_ref, amount, sent_txn, flagged, recipient_ref, received_txn)
+
+def cash_out(db, user_ref, amount, txn, flagged):
+    return _run(db, _debit, user_ref, amount, txn, flagged)
+
+def cash_in(db, user_ref, amount, txn, flagged):
+    # A credit needs no balance read, so a single batched write is enough
+    from google.cloud.firestore_v1.transforms import Increment
+    batch = db.batch()
+    updates = {"has_fraud_alert": True} if flagged else {"balance": Increment(amount)}
+    txn_ref = feature_store.add_transaction(batch, user_ref, txn, user_updates=updates)
+    batch.commit()
+    return txn_ref
+
+# --- OTP Verification ---
+# Pending transactions are settled in chunks, one Firestore transaction each:
+# up to VERIFY_CHUNK ledger updates plus one user update stays under the
+# 500-write commit limit. The pending query is read inside the transaction, so
+# a concurrent verify conflicts, retries, and finds those entries settled.
+VERIFY_CHUNK = 499
+
+def _balance_delta(txn):
+    tx_type = txn.get("type") or ""
+    amount = float(txn.get("amount") or 0)
+    if tx_type.startswith("TRANSFER") and txn.get("direction", "out") == "in":
+        return amount
+    if tx_type == "CASH_IN":
+        return amount
+    if tx_type == "CASH_OUT":
+        return -amount
+    return 0.0
+
+def _verify_chunk(transaction, user_ref, resolved_at):
+    from google.cloud.firestore_v1.transforms import Increment
+    pending = list(transaction.get(
+        user_ref.collection("transactions").where("verified", "==", False).limit(VERIFY_CHUNK)
+    ))
+    metrics.firestore_reads(max(1, len(pending)))
+
+    delta = 0.0
+    for snap in pending:
+        transaction.update(snap.reference, {
+            "verified": True,
+            "fraud": False,
+            "label": "legit",
+            "resolved_at": resolved_at
+        })
+        delta += _balance_delta(snap.to_dict())
+
+    updates = {"balance": Increment(delta)} if delta else {}
+    if len(pending) < VERIFY_CHUNK:
+        # Last chunk: nothing is left pending
+        updates.update({"has_fraud_alert": False, "fraud": False})
+    if updates:
+        transaction.update(user_ref, updates)
+    metrics.firestore_writes(len(pending) + bool(updates))
+    return [snap.id for snap in pending]
+
+def verify_pending(db, user_ref):
+    """Mark every unverified transaction legit and apply their balance changes; returns their ids."""
+    resolved_at = datetime.now(timezone.utc).isoformat()
+    settled_ids = []
+    while True:
+        settled = _run(db, _verify_chunk, user_ref, resolved_at)
+        settled_ids.extend(settled)
+        if len(settled) < VERIFY_CHUNK:
+            return settled_ids
@@ -0,0 +1,188 @@
+# --- Lightweight in-process metrics ---
+# Histograms and counters, optionally labelled, exposed as JSON (snapshot_all)
+# and in the Prometheus text format (exposition) for GET /metrics.
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+REGISTRY = {}
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help="", labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}  # label values -> unlabelled child
+        self._children_lock = threading.Lock()
+        if name:  # label children are unnamed and reached through their parent
+            REGISTRY[name] = self
+
+    def labels(self, *values, **kwargs):
+        """The child metric for one combination of label values."""
+        if kwargs:
+            values = tuple(kwargs[n] for n in self.labelnames)
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._children_lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._child()
+        return child
+
+    def _series(self):
+        """[(label dict, unlabelled metric)] for exposition."""
+        if not self.labelnames:
+            return [({}, self)]
+        return [(dict(zip(self.labelnames, values)), child) for values, child in list(self._children.items())]
+
+    def snapshot(self):
+        if not self.labelnames:
+            return self._snapshot()
+        return {",".join(f"{k}={v}" for k, v in labels.items()): child._snapshot() for labels, child in self._series()}
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram, safe to observe from any thread."""
+    kind = "histogram"
+
+    def __init__(self, name, buckets, help="", labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def _child(self):
+        return Histogram(None, self.buckets)
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        """Observe the wall-clock seconds spent in the `with` block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def _snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative, running = {}, 0
+        for le, c in zip(self.buckets + ["+Inf"], counts):
+            running += c
+            cumulative[str(le)] = running
+        return {"buckets": cumulative, "count": running, "sum": total}
+
+class Counter(_Metric):
+    """Monotonic counter, safe to increment from any thread."""
+    kind = "counter"
+
+    def __init__(self, name, help="", labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def _child(self):
+        return Counter(None)
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def _snapshot(self):
+        return self._value
+
+def snapshot_all():
+    return {name: m.snapshot() for name, m in REGISTRY.items()}
+
+# --- Prometheus text exposition ---
+def _labels(labels, extra=None):
+    items = {**labels, **(extra or {})}
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for v in items.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(items, escaped)) + "}"
+
+def exposition():
+    """Every registered metric in the Prometheus text format (version 0.0.4)."""
+    lines = []
+    for name, metric in list(REGISTRY.items()):
+        if metric.help:
+            lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for labels, series in metric._series():
+            snap = series._snapshot()
+            if metric.kind == "counter":
+                lines.append(f"{name}{_labels(labels)} {snap}")
+                continue
+            for le, count in snap["buckets"].items():
+                lines.append(f"{name}_bucket{_labels(labels, {'le': le})} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {snap['sum']}")
+            lines.append(f"{name}_count{_labels(labels)} {snap['count']}")
+    return "\n".join(lines) + "\n"
+
+# --- Per-request stage timings and Firestore operation counts ---
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]
+
+STAGE_SECONDS = Histogram("request_stage_seconds", LATENCY_BUCKETS,
+                          help="Time spent in each stage of a request", labelnames=("route", "stage"))
+FIRESTORE_OPS = Counter("firestore_operations_total", help="Firestore document reads and writes",
+                        labelnames=("op",))
+FIRESTORE_OPS_PER_REQUEST = Histogram("firestore_operations_per_request", [0, 1, 2, 3, 4, 5, 8, 12, 20, 50, 100],
+                                      help="Firestore document reads/writes made by one request",
+                                      labelnames=("route", "op"))
+
+class _RequestTally:
+    __slots__ = ("route", "reads", "writes")
+
+    def __init__(self, route):
+        self.route = route
+        self.reads = 0
+        self.writes = 0
+
+_current = contextvars.ContextVar("metrics_request", default=None)
+
+def begin_request(route):
+    """Start attributing stages and Firestore operations to `route`; returns a token for end_request."""
+    return _current.set(_RequestTally(route))
+
+def end_request(token):
+    tally = _current.get()
+    _current.reset(token)
+    if tally is not None:
+        FIRESTORE_OPS_PER_REQUEST.labels(tally.route, "read").observe(tally.reads)
+        FIRESTORE_OPS_PER_REQUEST.labels(tally.route, "write").observe(tally.writes)
+
+def firestore_reads(n=1):
+    FIRESTORE_OPS.labels("read").inc(n)
+    tally = _current.get()
+    if tally is not None:
+        tally.reads += n
+
+def firestore_writes(n=1):
+    FIRESTORE_OPS.labels("write").inc(n)
+    tally = _current.get()
+    if tally is not None:
+        tally.writes += n
+
+@contextmanager
+def stage(name):
+    """Time a stage of the current request into request_stage_seconds."""
+    tally = _current.get()
+    with STAGE_SECONDS.labels(tally.route if tally else "-", name).time():
+        yield
@@ -0,0 +1,195 @@
+# --- Model Registry ---
+# Versioned model artifacts in a local directory:
+#
+#   models/
+#     ACTIVE                  <- name of the live version, replaced atomically
+#     v20261016T120000/
+#       model.pkl             <- XGBClassifier
+#       compiled/             <- CompiledModel .npy arrays for small batches (optional, memory-mapped)
+#       feature_columns.csv
+#       meta.json             <- threshold, params, training metrics
+#
+# Workers poll ACTIVE and hot-swap the loaded model. A request holds on to the
+# LoadedModel it started with, so a swap never changes the model mid-request.
+# The compiled arrays are memory-mapped read-only, so every worker process
+# (pre-fork or not) shares one copy through the page cache. The XGBoost model
+# scores the batches too large for the compiled walk, and a worker only
+# unpickles it on its first such batch (see compiled_model.SmallBatchModel).
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+from functools import partial
+
+from batch_io import load_feature_columns
+from compiled_model import CompiledModel, SmallBatchModel
+
+ACTIVE_FILE = "ACTIVE"
+
+class LoadedModel:
+    def __init__(self, version, model, feature_columns, meta):
+        self.version = version
+        self.model = model
+        self.feature_columns = feature_columns
+        self.meta = meta
+        self.threshold = float(meta.get("threshold", 0.5))
+
+def load_artifacts(version, model_path, compiled_path, features_path, meta_path):
+    meta = {}
+    if meta_path and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+    compiled = CompiledModel.load(compiled_path, mmap_mode="r") if compiled_path and os.path.isdir(compiled_path) else None
+    if compiled is None:
+        model = _load_pickle(model_path)
+    elif model_path and os.path.exists(model_path):
+        model = SmallBatchModel(partial(_load_pickle, model_path), compiled)
+    else:
+        model = compiled  # a compiled-only artifact scores every batch itself
+    return LoadedModel(version, model, load_feature_columns(features_path), meta)
+
+def _load_pickle(model_path):
+    import joblib  # loading the pickle pulls in xgboost and sklearn; only pay for it here
+    return joblib.load(model_path)
+
+def load_version(registry_dir, version):
+    path = os.path.join(registry_dir, version)
+    return load_artifacts(
+        version,
+        os.path.join(path, "model.pkl"),
+        os.path.join(path, "compiled"),
+        os.path.join(path, "feature_columns.csv"),
+        os.path.join(path, "meta.json"),
+    )
+
+def check_version(registry_dir, version):
+    """Raise ValueError unless `version` has the artifacts load_version needs."""
+    path = os.path.join(registry_dir, version)
+    if not (os.path.exists(os.path.join(path, "model.pkl")) or os.path.isdir(os.path.join(path, "compiled"))):
+        raise ValueError(f"Model version {version} has no model.pkl or compiled/ in {registry_dir}")
+    if not os.path.exists(os.path.join(path, "feature_columns.csv")):
+        raise ValueError(f"Model version {version} has no feature_columns.csv in {registry_dir}")
+
+def active_version(registry_dir):
+    with open(os.path.join(registry_dir, ACTIVE_FILE)) as f:
+        return f.read().strip()
+
+def list_versions(registry_dir):
+    return sorted(d for d in os.listdir(registry_dir) if os.path.isdir(os.path.join(registry_dir, d)))
+
+def activate(registry_dir, version):
+    if not os.path.isdir(os.path.join(registry_dir, version)):
+        raise ValueError(f"Unknown model version: {version}")
+    # Write then rename, so readers only ever see the old or the new pointer
+    tmp = os.path.join(registry_dir, f".{ACTIVE_FILE}.{os.getpid()}")
+    with open(tmp, "w") as f:
+        f.write(version + "\n")
+    os.replace(tmp, os.path.join(registry_dir, ACTIVE_FILE))
+
+def publish(registry_dir, model_path, compiled_path, features_path, meta_path, version=None):
+    """Copy one set of train.py outputs into the registry as a new immutable version."""
+    version = version or datetime.now(timezone.utc).strftime("v%Y%m%dT%H%M%S")
+    dest = os.path.join(registry_dir, version)
+    if os.path.exists(dest):
+        raise ValueError(f"Model version already exists: {version}")
+
+    tmp = os.path.join(registry_dir, f".{version}.tmp")
+    os.makedirs(tmp)
+    shutil.copy2(model_path, os.path.join(tmp, "model.pkl"))
+    if compiled_path and os.path.isdir(compiled_path):
+        shutil.copytree(compiled_path, os.path.join(tmp, "compiled"))
+    shutil.copy2(features_path, os.path.join(tmp, "feature_columns.csv"))
+    if meta_path and os.path.exists(meta_path):
+        shutil.copy2(meta_path, os.path.join(tmp, "meta.json"))
+    os.replace(tmp, dest)
+    return version
+
+class FixedModel:
+    """Registry stand-in for a single model loaded from MODEL_PATH."""
+
+    def __init__(self, loaded):
+        self._loaded = loaded
+
+    def get(self):
+        return self._loaded
+
+class ModelRegistry:
+    def __init__(self, registry_dir, poll_seconds=5.0):
+        self.registry_dir = registry_dir
+        self.poll_seconds = poll_seconds
+        self._current = load_version(registry_dir, active_version(registry_dir))
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._pid = None
+
+    def get(self):
+        """The active LoadedModel; callers should keep the returned object for the whole request."""
+        if self.poll_seconds > 0 and (self._watcher is None or self._pid != os.getpid()):
+            self._start_watcher()
+        return self._current
+
+    def load(self, version):
+        """Load a non-active version (e.g. a challenger) from the same registry."""
+        return load_version(self.registry_dir, version)
+
+    def reload(self):
+        version = active_version(self.registry_dir)
+        if version != self._current.version:
+            loaded = load_version(self.registry_dir, version)
+            self._current = loaded  # single reference swap; in-flight requests keep the old object
+            print(f"Model registry: switched to {version}")
+
+    def _start_watcher(self):
+        # Threads do not survive fork, so each worker process starts its own watcher
+        with self._lock:
+            if self._watcher is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._watcher = threading.Thread(target=self._watch, name="model-registry", daemon=True)
+            self._watcher.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            try:
+                self.reload()
+            except Exception as e:
+                # A half-published or broken version must never take down serving
+                print("Model registry reload failed:", e)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage versioned fraud model artifacts.")
+    parser.add_argument("--dir", default=os.getenv("MODEL_REGISTRY_DIR", "models"))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    pub = commands.add_parser("publish", help="register the outputs of train.py as a new version")
+    pub.add_argument("--version")
+    pub.add_argument("--model", default="fraud_model.pkl")
+    pub.add_argument("--compiled", default="fraud_model_compiled")
+    pub.add_argument("--features", default="feature_columns.csv")
+    pub.add_argument("--meta", default="fraud_model.meta.json")
+    pub.add_argument("--activate", action="store_true")
+
+    act = commands.add_parser("activate", help="point ACTIVE at an existing version")
+    act.add_argument("version")
+
+    commands.add_parser("list", help="show versions, marking the active one")
+
+    args = parser.parse_args()
+    os.makedirs(args.dir, exist_ok=True)
+    if args.command == "publish":
+        version = publish(args.dir, args.model, args.compiled, args.features, args.meta, args.version)
+        print(f"Published {version}")
+        if args.activate:
+            activate(args.dir, version)
+            print(f"Activated {version}")
+    elif args.command == "activate":
+        activate(args.dir, args.version)
+        print(f"Activated {args.version}")
+    else:
+        current = active_version(args.dir) if os.path.exists(os.path.join(args.dir, ACTIVE_FILE)) else None
+        for v in list_versions(args.dir):
+            print(("* " if v == current else "  ") + v)
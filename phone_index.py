@@ -0,0 +1,167 @@
+# --- Phone Number -> uid Index ---
+# Transfers name the recipient by phone number. Instead of querying users by
+# phone on every transfer, registration writes phone_index/{E.164 number} with
+# the owner's uid, and lookups go through an in-process LRU. A lookup is zero
+# reads when cached and one point read otherwise. Numbers with no account are
+# cached too, but only for PHONE_INDEX_NEGATIVE_TTL seconds, so a number
+# registered through another worker becomes reachable soon.
+#
+# Users registered before the index existed are found with the old users query
+# and written to the index on the way. Once `python phone_index.py` has
+# backfilled every user, PHONE_INDEX_FALLBACK=0 turns that query off.
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import metrics
+from metrics import Counter
+
+PHONE_INDEX = "phone_index"
+DEFAULT_PREFIX = "+65"
+CACHE_SIZE = int(os.getenv("PHONE_INDEX_CACHE_SIZE", "100000"))
+CACHE_TTL = float(os.getenv("PHONE_INDEX_TTL", "3600"))
+NEGATIVE_TTL = float(os.getenv("PHONE_INDEX_NEGATIVE_TTL", "60"))
+FALLBACK = os.getenv("PHONE_INDEX_FALLBACK", "1") != "0"
+
+HITS = Counter("phone_index_cache_hits_total", help="Recipient lookups answered from the in-process cache")
+READS = Counter("phone_index_reads_total", help="Recipient lookups that read phone_index")
+FALLBACKS = Counter("phone_index_fallback_queries_total", help="Lookups that fell back to querying users by phone")
+CONFLICTS = Counter("phone_index_register_conflicts_total", help="Registrations of a number another account owns")
+
+MISS = object()  # returned by cached() when the number has no fresh entry
+
+def normalize(contact):
+    """E.164 form of a number as typed ("9123 4567", "+65 9123-4567", "6591234567" -> "+6591234567")."""
+    contact = str(contact).strip()
+    digits = "".join(ch for ch in contact if ch.isdigit())
+    if contact.startswith("+"):
+        return "+" + digits
+    if len(digits) == 10 and digits.startswith(DEFAULT_PREFIX[1:]):
+        return "+" + digits
+    return DEFAULT_PREFIX + digits
+
+class PhoneIndex:
+    def __init__(self, db, ttl=CACHE_TTL, negative_ttl=NEGATIVE_TTL, max_entries=CACHE_SIZE, fallback=FALLBACK):
+        self.db = db
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.fallback = fallback
+        self._entries = OrderedDict()  # E.164 number -> (expires_at, uid or None)
+        self._lock = threading.Lock()
+
+    def cached(self, phone):
+        """The cached uid (None means no such user), or MISS."""
+        with self._lock:
+            entry = self._entries.get(phone)
+            if entry is None:
+                return MISS
+            if entry[0] <= time.time():
+                del self._entries[phone]
+                return MISS
+            self._entries.move_to_end(phone)
+        HITS.inc()
+        return entry[1]
+
+    def _store(self, phone, uid):
+        ttl = self.ttl if uid is not None else self.negative_ttl
+        with self._lock:
+            self._entries[phone] = (time.time() + ttl, uid)
+            self._entries.move_to_end(phone)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _read(self, phone):
+        doc = self.db.collection(PHONE_INDEX).document(phone).get()
+        READS.inc()
+        metrics.firestore_reads()
+        if doc.exists:
+            return doc.get("uid")
+        if not self.fallback:
+            return None
+
+        FALLBACKS.inc()
+        docs = list(self.db.collection("users").where("phone", "==", phone).limit(1).stream())
+        metrics.firestore_reads(max(1, len(docs)))  # an empty query is billed as one read
+        if not docs:
+            return None
+        # Repair, so the next worker to miss pays one read (unless a registration got there first)
+        return self._create(phone, docs[0].id)
+
+    def _create(self, phone, uid):
+        """Create phone's entry for uid; returns the uid that owns the number afterwards."""
+        from google.api_core.exceptions import AlreadyExists
+
+        ref = self.db.collection(PHONE_INDEX).document(phone)
+        try:
+            ref.create({"uid": uid, "updated_at": datetime.now(timezone.utc)})
+            metrics.firestore_writes()
+            return uid
+        except AlreadyExists:
+            metrics.firestore_reads()
+            return ref.get().get("uid")
+
+    def lookup(self, phone):
+        """uid registered for the normalized number `phone`, or None."""
+        uid = self.cached(phone)
+        if uid is MISS:
+            uid = self._read(phone)
+            self._store(phone, uid)
+        return uid
+
+    def register(self, phone, uid):
+        """Point `phone` at `uid` (at registration) unless another account owns it; returns the normalized number.
+
+        The entry is created, never overwritten, so a later registration cannot take
+        over a number's incoming transfers. Like backfill(), the first owner keeps it.
+        """
+        phone = normalize(phone)
+        owner = self._create(phone, uid)
+        if owner != uid:
+            CONFLICTS.inc()
+            print(f"{phone} is already registered to {owner}; not reassigning it to {uid}")
+        self._store(phone, owner)
+        return phone
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": HITS.value,
+            "reads": READS.value,
+            "fallback_queries": FALLBACKS.value,
+            "register_conflicts": CONFLICTS.value,
+        }
+
+def backfill():
+    """Write phone_index entries for every existing user with a phone number."""
+    from export_data import init_db
+
+    db = init_db()
+    owners = {}
+    duplicates = 0
+    for user in db.collection("users").select(["phone"]).stream():
+        phone = user.get("phone")
+        if not phone:
+            continue
+        phone = normalize(phone)
+        if phone in owners:
+            # The old query returned an arbitrary one of these; keep the first seen
+            duplicates += 1
+            print(f"{phone} is shared by {owners[phone]} and {user.id}; keeping {owners[phone]}")
+            continue
+        owners[phone] = user.id
+
+    entries = list(owners.items())
+    now = datetime.now(timezone.utc)
+    for start in range(0, len(entries), 500):  # Firestore's per-batch write limit
+        batch = db.batch()
+        for phone, uid in entries[start:start + 500]:
+            batch.set(db.collection(PHONE_INDEX).document(phone), {"uid": uid, "updated_at": now})
+        batch.commit()
+
+    print(f"Wrote {len(entries)} {PHONE_INDEX} entries ({duplicates} duplicate numbers skipped)")
+
+if __name__ == "__main__":
+    backfill()
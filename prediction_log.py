@@ -0,0 +1,250 @@
+# --- Prediction Log ---
+# Every scored transaction is queued here with its feature vector, probability
+# and model version, and a background worker writes the queue in batches, so
+# logging never adds a round trip to the payment path. The queue is bounded:
+# when the sink falls behind, new records are dropped and counted rather than
+# making requests wait. Whatever is still queued is flushed at interpreter exit.
+#
+# PREDICTION_LOG selects the sink:
+#   firestore  fraud_predictions documents, up to 500 per WriteBatch (the default)
+#   jsonl      append-only JSON Lines segments in PREDICTION_LOG_DIR; each process
+#              writes its own "*.jsonl.open" segment and seals it (renames it to
+#              "*.jsonl") after SEGMENT_ROWS records, SEGMENT_SECONDS or at exit
+#   off        nothing is logged
+#
+# Labels that change after scoring (an OTP-verified transaction becomes "legit")
+# are logged as label events, so export_data.py --from-logs can build training
+# rows from the log alone instead of crawling every user's transactions.
+import atexit
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+
+import metrics
+from metrics import Counter
+
+COLLECTION = "fraud_predictions"
+LOG_MODE = os.getenv("PREDICTION_LOG", "firestore")
+LOG_DIR = os.getenv("PREDICTION_LOG_DIR", "data/prediction_log")
+MAX_QUEUE = int(os.getenv("PREDICTION_LOG_QUEUE", "20000"))
+BATCH_SIZE = 500  # Firestore's per-batch write limit
+FLUSH_SECONDS = 1.0
+CLOSE_TIMEOUT = 10.0  # seconds the exit hook waits for the queue to drain
+SEGMENT_ROWS = 100_000
+SEGMENT_SECONDS = 600
+
+ENQUEUED = Counter("prediction_log_enqueued_total", help="Prediction log records accepted", labelnames=("event",))
+DROPPED = Counter("prediction_log_dropped_total", help="Prediction log records dropped because the queue was full")
+WRITTEN = Counter("prediction_log_written_total", help="Prediction log records written by the sink")
+FAILED = Counter("prediction_log_failed_total", help="Prediction log records lost to a sink error")
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+def prediction_record(txn_id, uid, tx_type, amount, timestamp, raw, proba, prediction, model_version,
+                      label, role="champion"):
+    """One scored transaction; `raw` maps feature names to the values the model saw."""
+    return {
+        "event": "prediction",
+        "txn_id": txn_id,
+        "uid": uid,
+        "ts": _now(),
+        "type": tx_type,
+        "amount": float(amount),
+        "timestamp": timestamp.isoformat() if hasattr(timestamp, "isoformat") else timestamp,
+        "raw": raw,
+        "proba": float(proba),
+        "prediction": int(prediction),
+        "model_version": model_version,
+        "role": role,
+        "label": label,  # "pending", "legit", or "fraud"
+    }
+
+def label_record(txn_id, uid, label, resolved_at=None):
+    """A later label for a transaction logged with prediction_record."""
+    resolved_at = resolved_at or _now()
+    return {"event": "label", "txn_id": txn_id, "uid": uid, "ts": _now(), "label": label, "resolved_at": resolved_at}
+
+class PredictionLog:
+    def __init__(self, sink, max_queue=MAX_QUEUE, batch_size=BATCH_SIZE, flush_seconds=FLUSH_SECONDS):
+        self.sink = sink  # callable(list of records); may have close()
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        # Started lazily (and restarted after fork), like ShadowScorer
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                first = self._thread is None
+                self._queue = queue.Queue(maxsize=self.max_queue)
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="prediction-log", daemon=True)
+                self._thread.start()
+                if first:
+                    atexit.register(self.close)
+
+    def submit(self, record):
+        """Queue one record; never blocks. Returns False if it was dropped."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc()
+            return False
+        ENQUEUED.labels(record.get("event", "prediction")).inc()
+        return True
+
+    def submit_many(self, records):
+        for record in records:
+            self.submit(record)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self.sink(batch)
+                WRITTEN.inc(len(batch))
+            except Exception as e:
+                FAILED.inc(len(batch))
+                print("Prediction logging failed:", e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is written; returns False on timeout."""
+        if self._thread is None or self._pid != os.getpid():
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self):
+        if not self.flush(CLOSE_TIMEOUT):
+            print(f"Prediction log: {self._queue.qsize()} records still queued at exit")
+        if hasattr(self.sink, "close"):
+            self.sink.close()
+
+    def stats(self):
+        running = self._thread is not None and self._pid == os.getpid()
+        return {
+            "queued": self._queue.qsize() if running else 0,
+            "max_queue": self.max_queue,
+            "enqueued": ENQUEUED.snapshot(),
+            "dropped": DROPPED.value,
+            "written": WRITTEN.value,
+            "failed": FAILED.value,
+        }
+
+# --- Sinks ---
+def _doc_id(record):
+    # Challenger rows get their own document next to the champion's
+    if record.get("role", "champion") == "champion":
+        return record["txn_id"]
+    return f"{record['txn_id']}__{record['model_version']}"
+
+def firestore_sink(db):
+    """Write records to fraud_predictions; label events update the champion document."""
+    def write(records):
+        for start in range(0, len(records), BATCH_SIZE):
+            batch = db.batch()
+            chunk = records[start:start + BATCH_SIZE]
+            for r in chunk:
+                if r.get("event") == "label":
+                    data = {"label": r["label"], "resolved_at": r["resolved_at"]}
+                else:
+                    data = {k: v for k, v in r.items() if k != "event"}
+                batch.set(db.collection(COLLECTION).document(_doc_id(r)), data, merge=True)
+            batch.commit()
+            metrics.firestore_writes(len(chunk))
+    return write
+
+class JsonlSegments:
+    """Append-only JSON Lines segments; only sealed segments are read back."""
+
+    def __init__(self, directory=LOG_DIR, segment_rows=SEGMENT_ROWS, segment_seconds=SEGMENT_SECONDS):
+        self.directory = directory
+        self.segment_rows = segment_rows
+        self.segment_seconds = segment_seconds
+        self._file = None
+        self._path = None
+        self._rows = 0
+        self._opened = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self):
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        self._path = os.path.join(self.directory, f"predictions-{stamp}-{socket.gethostname()}-{os.getpid()}.jsonl.open")
+        self._file = open(self._path, "a", encoding="utf-8")
+        self._rows = 0
+        self._opened = time.monotonic()
+
+    def _seal(self):
+        self._file.close()
+        os.replace(self._path, self._path[:-len(".open")])
+        self._file = None
+
+    def __call__(self, records):
+        with self._lock:
+            if self._file is None:
+                self._open()
+            self._file.write("".join(json.dumps(r, default=str) + "\n" for r in records))
+            self._file.flush()
+            self._rows += len(records)
+            if self._rows >= self.segment_rows or time.monotonic() - self._opened >= self.segment_seconds:
+                self._seal()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._seal()
+
+def read_records(directory=LOG_DIR):
+    """Every record in the sealed segments under `directory`, oldest segment first."""
+    names = sorted(n for n in os.listdir(directory) if n.startswith("predictions-") and n.endswith(".jsonl"))
+    for name in names:
+        with open(os.path.join(directory, name), encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue  # a torn line from a crashed writer
+
+def from_env(db, mode=LOG_MODE):
+    """The PredictionLog selected by PREDICTION_LOG, or None when logging is off."""
+    if mode == "off":
+        return None
+    if mode == "jsonl":
+        return PredictionLog(JsonlSegments())
+    if mode == "firestore":
+        return PredictionLog(firestore_sink(db))
+    raise ValueError(f"Unknown PREDICTION_LOG sink: {mode}")
@@ -0,0 +1,90 @@
+# --- Sampling Profiler for Slow Requests ---
+# Off by default and toggled at runtime (POST /debug/profiler). While running,
+# a daemon thread wakes every interval_ms, and for each thread that has been
+# serving one request for longer than min_request_ms it records the current
+# Python stack. Samples are kept as collapsed stacks ("frame;frame;frame N"),
+# the input format of flamegraph.pl, speedscope and similar tools.
+import sys
+import threading
+import time
+from collections import Counter
+
+MAX_STACKS = 20_000  # distinct stacks kept; later new stacks are dropped and counted
+
+class SamplingProfiler:
+    def __init__(self):
+        self._requests = {}  # thread id -> (route, started perf_counter)
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.interval = 0.01
+        self.min_request = 0.2
+        self.samples = 0
+        self.dropped = 0
+
+    # Request hooks (cheap when the profiler is idle: one dict write each)
+    def request_started(self, route):
+        self._requests[threading.get_ident()] = (route, time.perf_counter())
+
+    def request_finished(self):
+        self._requests.pop(threading.get_ident(), None)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval_ms=10, min_request_ms=200):
+        with self._lock:
+            if self.running:
+                return
+            self.interval = interval_ms / 1000.0
+            self.min_request = min_request_ms / 1000.0
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = self.dropped = 0
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            frames = sys._current_frames()
+            for ident, (route, started) in list(self._requests.items()):
+                frame = frames.get(ident)
+                if ident == own or frame is None or now - started < self.min_request:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                    frame = frame.f_back
+                key = ";".join([route] + stack[::-1])
+                with self._lock:
+                    self.samples += 1
+                    if key in self._stacks or len(self._stacks) < MAX_STACKS:
+                        self._stacks[key] += 1
+                    else:
+                        self.dropped += 1
+            del frames
+
+    def collapsed(self):
+        """Samples so far, one "route;outer;...;inner count" line per distinct stack."""
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    def status(self):
+        return {"running": self.running, "interval_ms": self.interval * 1000, "min_request_ms": self.min_request * 1000,
+                "samples": self.samples, "distinct_stacks": len(self._stacks), "dropped": self.dropped}
+
+profiler = SamplingProfiler()
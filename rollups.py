@@ -0,0 +1,148 @@
+# --- FraudSight Daily Rollups ---
+# One document per user per UTC day, users/{uid}/daily_stats/{YYYY-MM-DD},
+# holding the counters the FraudSight dashboard charts. Every ledger write folds
+# its transaction in with Increments in the same commit (see
+# feature_store.add_transaction), so the dashboard reads at most a page of days
+# regardless of how many transactions the user has.
+from datetime import date, datetime, timedelta, timezone
+
+import metrics
+
+ROLLUP_COLLECTION = "daily_stats"
+DEFAULT_DAYS = 30
+MAX_PAGE_DAYS = 366
+
+def rollup_type(txn):
+    # Stored transfer types carry the counterparty ("TRANSFER Sent to +65...")
+    stored = txn.get("type") or "UNKNOWN"
+    if stored.startswith("TRANSFER"):
+        return "TRANSFER_IN" if txn.get("direction") == "in" else "TRANSFER_OUT"
+    return stored
+
+def day_key(ts):
+    if not hasattr(ts, "strftime"):
+        ts = ts.to_datetime()
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc)
+    return ts.strftime("%Y-%m-%d")
+
+def _contribution(txn):
+    amount = float(txn.get("amount") or 0)
+    flagged = int(bool(txn.get("isFlagged")))
+    return {
+        "count": 1,
+        "amount_sum": amount,
+        "wallet_ratio_sum": float(txn.get("wallet_ratio") or 0),
+        "flagged": flagged,
+        "by_type": {rollup_type(txn): {"count": 1, "amount_sum": amount, "flagged": flagged}},
+    }
+
+def _increments(values):
+    from google.cloud.firestore_v1.transforms import Increment
+    return {k: _increments(v) if isinstance(v, dict) else Increment(v) for k, v in values.items()}
+
+def add_to_rollup(writer, user_ref, txn):
+    """Stage the Increments that fold `txn` into its day's rollup on a WriteBatch or Transaction."""
+    if txn.get("timestamp") is None:
+        return
+    day = day_key(txn["timestamp"])
+    # set(merge=True) creates the day's document on its first transaction
+    writer.set(user_ref.collection(ROLLUP_COLLECTION).document(day),
+               {"date": day, **_increments(_contribution(txn))}, merge=True)
+    metrics.firestore_writes()
+
+def fold(rollups, txn):
+    """Fold one transaction dict into an in-memory {day: rollup} dict."""
+    if txn.get("timestamp") is None:
+        return rollups
+    day = day_key(txn["timestamp"])
+    doc = rollups.setdefault(day, {"date": day, "count": 0, "amount_sum": 0.0, "wallet_ratio_sum": 0.0,
+                                   "flagged": 0, "by_type": {}})
+    c = _contribution(txn)
+    for k in ("count", "amount_sum", "wallet_ratio_sum", "flagged"):
+        doc[k] += c[k]
+    for t, tc in c["by_type"].items():
+        slot = doc["by_type"].setdefault(t, {"count": 0, "amount_sum": 0.0, "flagged": 0})
+        for k, v in tc.items():
+            slot[k] += v
+    return rollups
+
+# --- Dashboard queries ---
+def parse_range(data):
+    """(start, end, limit, cursor) from the request body; raises ValueError on bad input.
+
+    `start`/`end` are inclusive YYYY-MM-DD dates (default: the last DEFAULT_DAYS
+    days), `limit` is days per page and `cursor` the `next_cursor` of the
+    previous page.
+    """
+    data = data or {}
+    end = date.fromisoformat(data["end"]) if data.get("end") else datetime.now(timezone.utc).date()
+    start = date.fromisoformat(data["start"]) if data.get("start") else end - timedelta(days=DEFAULT_DAYS - 1)
+    if start > end:
+        raise ValueError("start must not be after end")
+    limit = int(data.get("limit") or DEFAULT_DAYS)
+    if not 1 <= limit <= MAX_PAGE_DAYS:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_DAYS}")
+    cursor = data.get("cursor")
+    if cursor:
+        date.fromisoformat(cursor)
+    return start.isoformat(), end.isoformat(), limit, cursor
+
+def daily_query(user_ref, start, end, limit, cursor=None):
+    """Newest-first page of rollup days; works with the sync and the async client."""
+    # "DESCENDING" is the value of Query.DESCENDING on both clients
+    query = (user_ref.collection(ROLLUP_COLLECTION)
+             .where("date", ">=", start)
+             .where("date", "<=", end)
+             .order_by("date", direction="DESCENDING"))
+    if cursor:
+        query = query.start_after({"date": cursor})
+    return query.limit(limit)
+
+def series(docs, limit):
+    """Response body for one page of rollup documents."""
+    days = []
+    for d in docs:
+        count = int(d.get("count", 0))
+        days.append({
+            "date": d["date"],
+            "count": count,
+            "amount_sum": float(d.get("amount_sum", 0)),
+            "mean_wallet_ratio": float(d.get("wallet_ratio_sum", 0)) / count if count else 0.0,
+            "flagged": int(d.get("flagged", 0)),
+            "by_type": d.get("by_type", {}),
+        })
+    return {"series": days, "next_cursor": days[-1]["date"] if len(days) == limit else None}
+
+def rebuild_rollups():
+    """Recompute every user's daily rollups from their full transaction history."""
+    from export_data import init_db, iter_user_transactions
+
+    db = init_db()
+
+    def write(uid, rollups):
+        days = list(rollups.values())
+        for start in range(0, len(days), 500):  # Firestore's per-batch write limit
+            batch = db.batch()
+            for doc in days[start:start + 500]:
+                batch.set(db.collection("users").document(uid).collection(ROLLUP_COLLECTION).document(doc["date"]), doc)
+            batch.commit()
+
+    users = 0
+    current_uid, rollups = None, None
+    # iter_user_transactions walks one user's subcollection at a time
+    for uid, txn in iter_user_transactions(db):
+        if uid != current_uid:
+            if current_uid is not None:
+                write(current_uid, rollups)
+                users += 1
+            current_uid, rollups = uid, {}
+        fold(rollups, txn)
+    if current_uid is not None:
+        write(current_uid, rollups)
+        users += 1
+
+    print(f"Rebuilt {ROLLUP_COLLECTION} for {users} users")
+
+if __name__ == "__main__":
+    rebuild_rollups()
@@ -0,0 +1,139 @@
+# --- Micro-batching Scorer ---
+# Concurrent requests are queued and scored together in a single predict_proba
+# call. A batch is dispatched once it reaches max_batch_size or once the oldest
+# queued request has waited max_wait_ms, whichever comes first.
+#
+# `source` returns the current LoadedModel (see model_registry.py); it is read
+# once per batch, so every row in a batch is scored by, and reports, one version.
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from metrics import Histogram
+
+BATCH_SIZE = Histogram("scorer_batch_size", [1, 2, 4, 8, 16, 32, 64, 128, 256],
+                       help="Rows scored per predict_proba call")
+QUEUE_WAIT = Histogram("scorer_queue_wait_seconds",
+                       [0.0001, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1],
+                       help="Time a request spent queued before its batch was scored")
+INFERENCE_SECONDS = Histogram("model_inference_seconds",
+                              [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1],
+                              help="predict_proba wall time, by batch size class", labelnames=("batch_size",))
+FRAUD_SCORE = Histogram("fraud_score", [0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0],
+                        help="Fraud probability of scored transactions", labelnames=("model_version",))
+
+# Upper bounds of the batch_size label values, so the label set stays small
+_BATCH_CLASSES = [1, 4, 16, 64, 256, 1024, 4096]
+
+def _batch_class(n):
+    for bound in _BATCH_CLASSES:
+        if n <= bound:
+            return f"le{bound}"
+    return f"gt{_BATCH_CLASSES[-1]}"
+
+def predict_proba(loaded, X):
+    """Positive-class probabilities for X, timed into model_inference_seconds."""
+    start = time.perf_counter()
+    probas = loaded.model.predict_proba(X)[:, 1]
+    INFERENCE_SECONDS.labels(_batch_class(len(X))).observe(time.perf_counter() - start)
+    return probas
+
+# Same rule XGBClassifier.predict applies to binary probabilities, used when no
+# threshold is given. A model's own threshold (LoadedModel.threshold, tuned by
+# `train.py search`) flags scores at or above it, as the cost curve assumes.
+DECISION_BOUNDARY = 0.5
+
+def prediction_from_proba(proba, threshold=None):
+    if threshold is None:
+        return int(proba > DECISION_BOUNDARY)
+    return int(proba >= threshold)
+
+def predictions_from_proba(probas, threshold=None):
+    if threshold is None:
+        return (np.asarray(probas) > DECISION_BOUNDARY).astype(int)
+    return (np.asarray(probas) >= threshold).astype(int)
+
+class _Pending:
+    __slots__ = ("row", "enqueued", "done", "result", "error")
+
+    def __init__(self, row):
+        self.row = row
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class BatchScorer:
+    def __init__(self, source, max_wait_ms=2.0, max_batch_size=64):
+        self.source = source
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        # Started lazily (and restarted after fork) so pre-fork servers get one worker thread per process
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="batch-scorer", daemon=True)
+                self._thread.start()
+
+    def score(self, row):
+        """Score one feature row; returns (prediction, probability, LoadedModel used)."""
+        if self.max_batch_size <= 1:
+            loaded = self.source()
+            proba = float(predict_proba(loaded, np.asarray([row], dtype=float))[0])
+            BATCH_SIZE.observe(1)
+            FRAUD_SCORE.labels(loaded.version).observe(proba)
+            return prediction_from_proba(proba), proba, loaded
+
+        self._ensure_started()
+        pending = _Pending(row)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _collect(self):
+        first = self._queue.get()
+        batch = [first]
+        deadline = first.enqueued + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            for p in batch:
+                QUEUE_WAIT.observe(started - p.enqueued)
+            BATCH_SIZE.observe(len(batch))
+
+            try:
+                loaded = self.source()
+                probas = predict_proba(loaded, np.asarray([p.row for p in batch], dtype=float))
+                scores = FRAUD_SCORE.labels(loaded.version)
+                for p, proba in zip(batch, probas):
+                    p.result = (prediction_from_proba(proba), float(proba), loaded)
+                    scores.observe(float(proba))
+            except Exception as e:
+                for p in batch:
+                    p.error = e
+            finally:
+                for p in batch:
+                    p.done.set()
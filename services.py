@@ -0,0 +1,127 @@
+# --- Lazily Initialised Services ---
+# Firebase (the Admin SDK app and the Firestore client), Stripe and the model are
+# set up on first use instead of when app.py is imported. A worker can then
+# serve template routes as soon as Flask is up, and only the first request that
+# needs a service pays to initialise it. Each Lazy builds its value at most once
+# per process: concurrent first callers wait for that one build. A failed build
+# is not cached, so the next caller retries it.
+#
+# /readyz reports every registered Lazy. start_warmup() initialises all of them
+# on a background thread. With a pre-fork server, warm up in the workers (not in
+# a --preload master): gRPC channels do not survive fork.
+import os
+import threading
+import time
+
+REGISTRY = {}  # name -> Lazy, in registration order
+
+class Lazy:
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.seconds = None  # how long the build took
+        self.error = None    # last build failure, until a build succeeds
+        self._value = None
+        self._ready = False
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    @property
+    def ready(self):
+        return self._ready
+
+    def get(self):
+        if self._ready:
+            return self._value
+        with self._lock:
+            if not self._ready:
+                start = time.perf_counter()
+                try:
+                    self._value = self.factory()
+                except Exception as e:
+                    self.error = f"{type(e).__name__}: {e}"
+                    raise
+                self.seconds = time.perf_counter() - start
+                self.error = None
+                self._ready = True
+        return self._value
+
+    def status(self):
+        return {"ready": self._ready, "init_seconds": self.seconds, "error": self.error}
+
+class LazyProxy:
+    """Forwards attribute access to lazy.get(), so module globals like app.db keep working unchanged."""
+    __slots__ = ("_lazy",)
+
+    def __init__(self, lazy):
+        object.__setattr__(self, "_lazy", lazy)
+
+    def __getattr__(self, name):
+        return getattr(self._lazy.get(), name)
+
+# --- Firebase and Stripe ---
+def _firebase_app():
+    import firebase_admin
+    from firebase_admin import credentials
+
+    # The service account key file downloaded from the Firebase project
+    return firebase_admin.initialize_app(credentials.Certificate(os.getenv("FIREBASE_CREDENTIALS")))
+
+def _firestore_client():
+    from firebase_admin import firestore
+
+    firebase.get()
+    return firestore.client()
+
+def _stripe():
+    import stripe
+
+    stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+    return stripe
+
+firebase = Lazy("firebase", _firebase_app)
+firestore_client = Lazy("firestore", _firestore_client)
+stripe_client = Lazy("stripe", _stripe)
+
+def get_db():
+    return firestore_client.get()
+
+def get_stripe():
+    return stripe_client.get()
+
+# --- Readiness and warm-up ---
+def status():
+    return {name: lazy.status() for name, lazy in REGISTRY.items()}
+
+def ready():
+    return all(lazy.ready for lazy in REGISTRY.values())
+
+_warmup = None
+_warmup_lock = threading.Lock()
+
+def _warm(extra):
+    for name, lazy in list(REGISTRY.items()):
+        start = time.perf_counter()
+        try:
+            lazy.get()
+        except Exception as e:
+            print(f"Warm-up of {name} failed:", e)
+            continue
+        print(f"Warmed {name} in {time.perf_counter() - start:.2f}s")
+    for step in extra:
+        try:
+            step()
+        except Exception as e:
+            print("Warm-up step failed:", e)
+
+def start_warmup(*extra):
+    """Initialise every registered service on a daemon thread, then run the `extra` callables.
+
+    Does nothing while a warm-up is already running in this process.
+    """
+    global _warmup
+    with _warmup_lock:
+        if _warmup is not None and _warmup.is_alive():
+            return
+        _warmup = threading.Thread(target=_warm, args=(extra,), name="warmup", daemon=True)
+        _warmup.start()
@@ -0,0 +1,80 @@
+# --- Shadow Scoring ---
+# Challenger models score the same features as the champion on a background
+# worker, never on the request thread. Challenger predictions go to the
+# prediction log next to the champion's (see prediction_log.py), so live
+# traffic can be compared per model version once labels resolve (see
+# shadow_report.py).
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from scoring import predictions_from_proba
+
+class ShadowScorer:
+    def __init__(self, challengers, write_records, max_queue=10000, batch_size=200, flush_seconds=1.0):
+        self.challengers = challengers      # [LoadedModel]
+        self.write_records = write_records  # callable(list of prediction_log records)
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        # Started lazily (and restarted after fork), like BatchScorer
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.max_queue)
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="shadow-scorer", daemon=True)
+                self._thread.start()
+
+    def submit(self, record):
+        """Queue the champion's prediction_log record for one transaction; never blocks the caller."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            # Shadow traffic is best-effort; the payment path must not wait on it
+            self.dropped += 1
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            records = []
+            for challenger in self.challengers:
+                try:
+                    # Each challenger reads the features it was trained on, in its own order
+                    X = np.asarray([[b["raw"][c] for c in challenger.feature_columns] for b in batch], dtype=float)
+                    probas = challenger.model.predict_proba(X)[:, 1]
+                except Exception as e:
+                    print(f"Shadow scoring with {challenger.version} failed:", e)
+                    continue
+                for b, proba, prediction in zip(batch, probas, predictions_from_proba(probas, challenger.threshold)):
+                    records.append({**b, "proba": float(proba), "prediction": int(prediction),
+                                    "model_version": challenger.version, "role": "challenger"})
+
+            try:
+                self.write_records(records)
+            except Exception as e:
+                print("Shadow prediction logging failed:", e)
@@ -0,0 +1,90 @@
+# --- Shadow Scoring Report ---
+# Compares champion and challenger models on live traffic: reads the logged
+# predictions from "fraud_predictions" (or, with --logs, from prediction log
+# segments), looks up each transaction's resolved label, and prints AUC /
+# precision / recall per model version.
+import argparse
+from collections import defaultdict
+
+import numpy as np
+from sklearn.metrics import roc_auc_score
+
+from export_data import init_db
+from prediction_log import LOG_DIR, read_records
+
+LABELS = {"fraud": 1, "legit": 0}
+GET_ALL_CHUNK = 300
+PREDICTION_FIELDS = ("txn_id", "uid", "proba", "prediction")
+
+def resolved_labels(db, txns):
+    """{txn_id: 0/1} for transactions whose label has resolved; pending ones are left out."""
+    labels = {}
+    refs = [db.collection("users").document(uid).collection("transactions").document(txn_id) for txn_id, uid in txns]
+    for start in range(0, len(refs), GET_ALL_CHUNK):
+        for snap in db.get_all(refs[start:start + GET_ALL_CHUNK]):
+            if snap.exists and snap.get("label") in LABELS:
+                labels[snap.id] = LABELS[snap.get("label")]
+    return labels
+
+def logged_labels(records):
+    """{txn_id: 0/1} from prediction log records.
+
+    As in export_data.log_rows, a label event overrides the label logged at
+    scoring time, whichever segment either record was read from.
+    """
+    scored, resolved = {}, {}
+    for r in records:
+        if r.get("event") == "label":
+            resolved[r["txn_id"]] = r.get("label")
+        elif r.get("role", "champion") == "champion":
+            scored[r["txn_id"]] = r.get("label")
+    latest = {**scored, **resolved}
+    return {txn_id: LABELS[label] for txn_id, label in latest.items() if label in LABELS}
+
+def report(since=None, log_dir=None):
+    if log_dir:
+        records = [r for r in read_records(log_dir) if not since or r.get("ts", "") >= since]
+        predictions = [r for r in records if r.get("event", "prediction") == "prediction"]
+    else:
+        db = init_db()
+        query = db.collection("fraud_predictions")
+        if since:
+            query = query.where("ts", ">=", since)
+        predictions = [doc.to_dict() for doc in query.stream()]
+
+    # A label can land on a transaction that has no prediction record (scored before the
+    # log existed, or its record was dropped), leaving a document with only the label
+    scored = [d for d in predictions if all(d.get(k) is not None for k in PREDICTION_FIELDS)]
+    if len(scored) < len(predictions):
+        print(f"Skipped {len(predictions) - len(scored)} records without a logged prediction")
+    predictions = scored
+
+    by_version = defaultdict(list)  # version -> [(txn_id, proba, prediction)]
+    txns = {}
+    for d in predictions:
+        by_version[d.get("model_version", "unknown")].append((d["txn_id"], d["proba"], d["prediction"]))
+        txns[d["txn_id"]] = d["uid"]
+
+    labels = logged_labels(records) if log_dir else resolved_labels(db, list(txns.items()))
+    print(f"{len(labels)} of {len(txns)} logged transactions have resolved labels")
+    print(f"{'model_version':<24}{'n':>8}{'fraud':>8}{'AUC':>8}{'precision':>11}{'recall':>8}")
+    for version, rows in sorted(by_version.items()):
+        rows = [r for r in rows if r[0] in labels]
+        if not rows:
+            continue
+        y = np.array([labels[r[0]] for r in rows])
+        proba = np.array([r[1] for r in rows], dtype=float)
+        pred = np.array([r[2] for r in rows], dtype=int)
+        tp = int(((pred == 1) & (y == 1)).sum())
+        auc = roc_auc_score(y, proba) if len(np.unique(y)) == 2 else float("nan")
+        precision = tp / pred.sum() if pred.sum() else float("nan")
+        recall = tp / y.sum() if y.sum() else float("nan")
+        print(f"{version:<24}{len(y):>8}{int(y.sum()):>8}{auc:>8.4f}{precision:>11.4f}{recall:>8.4f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-model-version metrics from shadow-scored live traffic.")
+    parser.add_argument("--since", help="only predictions logged at or after this ISO timestamp")
+    parser.add_argument("--logs", nargs="?", const=LOG_DIR, metavar="DIR",
+                        help="read prediction log segments (PREDICTION_LOG=jsonl) instead of Firestore")
+    args = parser.parse_args()
+    report(args.since, args.logs)
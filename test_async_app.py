@@ -0,0 +1,218 @@
+# --- Smoke test for async_app.application ---
+# Drives the ASGI entry point (lifespan startup included) against fake_services,
+# through each async route and one route delegated to the Flask app. Needs the
+# app's own dependencies (Quart, asgiref, Flask, firebase_admin, Stripe, the
+# model's libraries) but no credentials or network access.
+#
+#   python -m pytest -q test_async_app.py
+import asyncio
+import json
+import os
+import types
+
+import pytest
+
+for module in ("quart", "asgiref", "flask", "firebase_admin", "stripe", "joblib", "xgboost"):
+    pytest.importorskip(module)
+
+import fake_services
+
+ALICE, BOB = "+6590000001", "+6590000002"
+
+@pytest.fixture(scope="module")
+def served():
+    client = fake_services.install()
+    os.environ.setdefault("MODEL_PATH", "fraud_model.pkl")
+    import async_app
+
+    client.collection("users").document("alice").set(
+        {"phone": ALICE, "balance": 1000.0, "name": "alice", "stripeCustomerId": "cus_alice"})
+    client.collection("users").document("bob").set({"phone": BOB, "balance": 0.0, "name": "bob"})
+    client.collection("phone_index").document(BOB).set({"uid": "bob"})
+
+    loop = asyncio.new_event_loop()
+    lifespan = loop.run_until_complete(start(async_app.application))
+    yield loop, async_app, client
+    loop.run_until_complete(stop(*lifespan))
+    loop.close()
+
+async def start(application):
+    inbox, outbox = asyncio.Queue(), asyncio.Queue()
+    task = asyncio.ensure_future(application({"type": "lifespan", "asgi": {"version": "3.0"}}, inbox.get, outbox.put))
+    await inbox.put({"type": "lifespan.startup"})
+    message = await outbox.get()
+    assert message["type"] == "lifespan.startup.complete", message
+    return inbox, outbox, task
+
+async def stop(inbox, outbox, task):
+    await inbox.put({"type": "lifespan.shutdown"})
+    await outbox.get()
+    await task
+
+async def call(application, path, body):
+    """POST `body` as JSON; returns (status, decoded JSON response)."""
+    raw = json.dumps(body).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "scheme": "http",
+        "method": "POST", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(b"host", b"test"), (b"content-type", b"application/json"),
+                    (b"content-length", str(len(raw)).encode())],
+        "client": ("127.0.0.1", 1234), "server": ("test", 80),
+    }
+    delivered, finished = False, asyncio.Event()
+    messages = []
+
+    async def receive():
+        nonlocal delivered
+        if not delivered:
+            delivered = True
+            return {"type": "http.request", "body": raw, "more_body": False}
+        await finished.wait()  # the client stays connected until the response is complete
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+        if message["type"] == "http.response.body" and not message.get("more_body"):
+            finished.set()
+
+    await application(scope, receive, send)
+    status = next(m["status"] for m in messages if m["type"] == "http.response.start")
+    payload = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.response.body")
+    return status, json.loads(payload)
+
+def post(served, path, body):
+    loop, async_app, _ = served
+    return loop.run_until_complete(call(async_app.application, path, body))
+
+def test_user(served):
+    status, body = post(served, "/api/user", {"idToken": "fake:alice"})
+    assert status == 200
+    assert body["balance"] == 1000.0
+
+def test_card_added_through_another_worker(served, monkeypatch):
+    import stripe
+
+    card_cache = served[1].card_cache
+    served[2].collection("users").document("erin").set(
+        {"phone": "+6590000005", "balance": 0.0, "name": "erin", "stripeCustomerId": "cus_erin"})
+    assert post(served, "/api/get-linked-card", {"idToken": "fake:erin"})[1]["last4"] == "4242"
+    # The add-card POST was handled elsewhere: this worker's cache was not invalidated
+    new_card = types.SimpleNamespace(data=[types.SimpleNamespace(
+        card={"brand": "visa", "last4": "1881", "exp_month": 1, "exp_year": 2031})])
+    monkeypatch.setattr(stripe.PaymentMethod, "list", staticmethod(lambda **kw: new_card))
+    monkeypatch.setattr(card_cache, "invalidate", lambda customer_id: None)
+    assert post(served, "/add-card", {"uid": "erin", "token": "tok_visa"}) == (200, {"success": True})
+    assert post(served, "/api/get-linked-card", {"idToken": "fake:erin"})[1]["last4"] == "1881"
+
+def test_save_iban(served):
+    status, body = post(served, "/api/save-iban", {"idToken": "fake:alice", "iban": "SG00TEST"})
+    assert (status, body) == (200, {"success": True})
+    assert served[2].collection("users").document("alice").get().get("iban") == "SG00TEST"
+
+def test_get_linked_card(served):
+    status, body = post(served, "/api/get-linked-card", {"idToken": "fake:alice"})
+    assert status == 200
+    assert body["last4"] == "4242"
+
+def test_missing_or_invalid_token(served):
+    assert post(served, "/api/user", {})[0] == 401
+    assert post(served, "/api/user", {"idToken": "forged"})[0] == 401
+
+def test_verification_failure_is_a_json_500(served, monkeypatch):
+    from firebase_admin import auth
+
+    def unavailable(*args, **kwargs):
+        raise RuntimeError("certificate download failed")
+    monkeypatch.setattr(auth, "verify_id_token", unavailable)
+    for path in ("/api/user", "/api/verify-transaction"):  # async route, then Flask's require_auth
+        status, body = post(served, path, {"idToken": "fake:carol"})
+        assert (status, body["success"]) == (500, False)
+
+def test_cash_in(served):
+    status, body = post(served, "/api/transaction", {"idToken": "fake:alice", "txType": "CASH_IN", "amount": 25})
+    assert status == 200
+    assert body["success"] is True
+
+def test_transfer(served):
+    status, body = post(served, "/api/transaction",
+                        {"idToken": "fake:alice", "txType": "TRANSFER", "amount": 10, "contact": BOB})
+    assert status == 200
+    assert body["success"] is True
+
+def test_bookkeeping_failures_do_not_fail_a_committed_transaction(served, monkeypatch):
+    flask_app, users = served[1].flask_app, served[2].collection("users")
+
+    class BrokenLog:
+        def submit(self, record):
+            raise OSError("prediction log unavailable")
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("velocity index unavailable")
+    monkeypatch.setattr(flask_app, "predictions", BrokenLog())
+    monkeypatch.setattr(flask_app.velocity_index, "record", broken)
+    before = users.document("bob").get().get("balance")
+    status, body = post(served, "/api/transaction", {"idToken": "fake:bob", "txType": "CASH_IN", "amount": 25})
+    assert (status, body["success"]) == (200, True)
+    assert users.document("bob").get().get("balance") == before + 25
+
+@pytest.mark.parametrize("env, error", [
+    ({"CHALLENGER_VERSIONS": "v2"}, "needs MODEL_REGISTRY_DIR"),
+    ({"CHALLENGER_VERSIONS": "v2", "MODEL_REGISTRY_DIR": "."}, "Bad CHALLENGER_VERSIONS entry"),
+])
+def test_challenger_config_errors_fail_at_import(env, error):
+    import subprocess
+    import sys
+
+    env = {**os.environ, "PREDICTION_LOG": "jsonl", **env}
+    result = subprocess.run([sys.executable, "-c", "import app"], env=env, capture_output=True, text=True)
+    assert result.returncode != 0
+    assert error in result.stderr
+
+def test_transfer_to_own_number_is_rejected(served):
+    client = served[2]
+    # The stored phone is as typed; only the index holds the normalized number
+    client.collection("users").document("dave").set({"phone": "9000 0004", "balance": 100.0, "name": "dave"})
+    client.collection("phone_index").document("+6590000004").set({"uid": "dave"})
+    status, body = post(served, "/api/transaction",
+                        {"idToken": "fake:dave", "txType": "TRANSFER", "amount": 10, "contact": "+65 9000 0004"})
+    assert (status, body["message"]) == (400, "Cannot send to self")
+
+def test_registration_cannot_take_over_a_number(served):
+    client = served[2]
+    client.collection("users").document("mallory").set({"phone": BOB, "balance": 0.0, "name": "mallory"})
+    status, _ = post(served, "/create-stripe-customer", {"name": "mallory", "phone": BOB, "uid": "mallory"})
+    assert status == 200
+    assert client.collection("phone_index").document(BOB).get().get("uid") == "bob"
+    assert served[1].flask_app.recipients.lookup(BOB) == "bob"
+
+def test_transfer_with_invalid_token_skips_recipient_lookup(served):
+    recipients = served[1].flask_app.recipients
+    before = recipients.stats()
+    status, _ = post(served, "/api/transaction",
+                     {"idToken": "forged", "txType": "TRANSFER", "amount": 10, "contact": "+6590000099"})
+    assert status == 401
+    assert recipients.stats()["reads"] == before["reads"]
+
+def test_fraudsight_data(served):
+    post(served, "/api/transaction", {"idToken": "fake:alice", "txType": "CASH_IN", "amount": 5})
+    status, body = post(served, "/api/fraudsight-data", {"idToken": "fake:alice"})
+    assert status == 200
+    assert body["series"] and body["series"][0]["count"] >= 1
+
+PREDICT_BODY = {"wallet_ratio": 0.2, "hour_of_day": 13, "amount": 120.0, "receiver_freq": 3,
+                "sender_freq": 40, "is_merchant": 0, "type": "TRANSFER"}
+
+def test_delegated_flask_route(served):
+    status, body = post(served, "/predict", PREDICT_BODY)
+    assert status == 200
+    assert 0.0 <= body["probability"] <= 1.0
+
+def test_predict_rejects_non_object_bodies(served):
+    for bad in ([PREDICT_BODY], "TRANSFER", None):
+        assert post(served, "/predict", bad)[0] == 400
+    assert post(served, "/predict", {**PREDICT_BODY, "feature_columns": ["amount"]})[0] == 200
+
+def test_import_leaves_the_firestore_and_auth_sdks_unloaded():
+    import import_budget
+
+    assert import_budget.report("async_app", budget_ms=0, top=0, forbidden=import_budget.FORBIDDEN) == 0
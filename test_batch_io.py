@@ -0,0 +1,70 @@
+# --- Tests for batch_io.parse_batch ---
+# Malformed /predict/batch bodies must surface as BatchInputError (a 400), never
+# as an unhandled exception (a 500).
+#
+#   python -m pytest -q test_batch_io.py
+import io
+import json
+
+import numpy as np
+import pytest
+
+from batch_io import BatchInputError, parse_batch
+
+COLUMNS = ["a", "b"]
+NPY = "application/x-npy"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+ARROW_FILE = "application/vnd.apache.arrow.file"
+
+def npy(array):
+    out = io.BytesIO()
+    np.save(out, array)
+    return out.getvalue()
+
+def npz():
+    out = io.BytesIO()
+    np.savez(out, X=np.ones((2, 2)))
+    return out.getvalue()
+
+def arrow(columns, stream=True):
+    pa = pytest.importorskip("pyarrow")
+    table = pa.table(columns)
+    sink = pa.BufferOutputStream()
+    with (pa.ipc.new_stream if stream else pa.ipc.new_file)(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def test_valid_bodies():
+    assert parse_batch(npy(np.ones((3, 2))), NPY, COLUMNS).shape == (3, 2)
+    assert parse_batch(json.dumps({"a": [1, 2], "b": [None, 4]}).encode(), None, COLUMNS).shape == (2, 2)
+
+def test_valid_arrow():
+    assert parse_batch(arrow({"a": [1.0], "b": [2]}), ARROW_STREAM, COLUMNS).shape == (1, 2)
+    assert parse_batch(arrow({"b": [2], "a": [1.0]}, stream=False), ARROW_FILE, COLUMNS).tolist() == [[1.0, 2.0]]
+
+@pytest.mark.parametrize("body, content_type", [
+    (npy(np.array([["x", "y"]])), NPY),
+    (npy(np.zeros((0, 2))), NPY),
+    (npy(np.ones((4, 2)))[:-8], NPY),
+    (b"\x93NUMPY garbage", NPY),
+    (npz(), NPY),
+    (b'{"a": 1, "b": [2]}', None),
+    (b"[1, 2]", None),
+])
+def test_rejected_bodies(body, content_type):
+    with pytest.raises(BatchInputError):
+        parse_batch(body, content_type, COLUMNS)
+
+@pytest.mark.parametrize("make, content_type", [
+    (lambda: arrow({"a": ["x"], "b": [2]}), ARROW_STREAM),
+    (lambda: arrow({"a": [[1]], "b": [2]}), ARROW_STREAM),
+    (lambda: arrow({"a": [1.0]}), ARROW_STREAM),
+    (lambda: arrow({"a": np.zeros(0), "b": np.zeros(0)}, stream=False), ARROW_FILE),
+    (lambda: b"garbage!", ARROW_STREAM),
+    (lambda: b"garbage!", ARROW_FILE),
+    (lambda: b"", ARROW_STREAM),
+])
+def test_rejected_arrow_bodies(make, content_type):
+    pytest.importorskip("pyarrow")
+    with pytest.raises(BatchInputError):
+        parse_batch(make(), content_type, COLUMNS)
@@ -0,0 +1,58 @@
+# --- Tests for feature_store.load_stats against fake_services ---
+#
+#   python -m pytest -q test_feature_store.py
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("firebase_admin")
+
+import fake_services
+import feature_store
+
+@pytest.fixture
+def db(monkeypatch):
+    from firebase_admin import firestore
+
+    monkeypatch.setattr(firestore, "transactional", fake_services.transactional)
+    return fake_services.FakeFirestore(rpc_ms=2)
+
+def unseeded_user(db, uid, history):
+    user_ref = db.collection("users").document(uid)
+    user_ref.set({"balance": 1000.0})
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    for i in range(history):
+        user_ref.collection("transactions").document().set(
+            {"type": "CASH_IN", "amount": 10.0, "timestamp": start + timedelta(minutes=i)})
+    return user_ref
+
+def test_seeds_from_history(db):
+    user_ref = unseeded_user(db, "u1", 5)
+    stats = feature_store.load_stats(db, user_ref, user_ref.get().to_dict())
+    assert (stats["total_count"], stats["type_counts"]["CASH_IN"], stats["amount_sum"]) == (5, 5, 50.0)
+    assert user_ref.get().get(feature_store.STATS_FIELD) == stats
+
+def test_stale_snapshot_keeps_an_existing_seed(db):
+    user_ref = unseeded_user(db, "u2", 3)
+    stale = user_ref.get().to_dict()
+    feature_store.load_stats(db, user_ref, stale)
+    user_ref.collection("transactions").document().set({"type": "CASH_IN", "amount": 1.0})
+    user_ref.update(feature_store.stats_update({"type": "CASH_IN", "amount": 1.0}))
+    # A request that read the user before the seed must not rescan and overwrite the counters
+    assert feature_store.load_stats(db, user_ref, stale)["total_count"] == 4
+
+def test_concurrent_commits_are_counted_once(db):
+    import ledger
+
+    user_ref = unseeded_user(db, "u3", 20)
+    snapshot = user_ref.get().to_dict()
+    txn = {"type": "CASH_OUT", "amount": 1.0}
+    commits = [threading.Thread(target=ledger.cash_out, args=(db, user_ref, 1.0, txn, False)) for _ in range(5)]
+    seeds = [threading.Thread(target=feature_store.load_stats, args=(db, user_ref, snapshot)) for _ in range(3)]
+    for t in seeds + commits:
+        t.start()
+    for t in seeds + commits:
+        t.join()
+    stats = user_ref.get().get(feature_store.STATS_FIELD)
+    assert stats["total_count"] == len(list(user_ref.collection("transactions").stream())) == 25
@@ -0,0 +1,45 @@
+# --- Tests for model_registry.load_artifacts ---
+# A compiled artifact scores small batches without the XGBoost pickle, which is
+# only unpickled by the first batch too large for the compiled walk.
+#
+#   python -m pytest -q test_model_registry.py
+import numpy as np
+import pytest
+
+for module in ("joblib", "xgboost", "sklearn"):
+    pytest.importorskip(module)
+
+import joblib
+
+from compiled_model import MAX_COMPILED_ROWS, compile_model
+from model_registry import load_artifacts
+
+@pytest.fixture
+def artifacts(tmp_path):
+    from xgboost import XGBClassifier
+
+    rng = np.random.default_rng(100)
+    X = rng.random((500, 3)).astype(np.float32)
+    model = XGBClassifier(n_estimators=5, max_depth=3).fit(X, X[:, 0] > 0.5)
+    joblib.dump(model, tmp_path / "model.pkl")
+    compile_model(model).save(tmp_path / "compiled")
+    (tmp_path / "feature_columns.csv").write_text("f0\nf1\nf2\n")
+    return tmp_path, X
+
+def test_pickle_is_loaded_on_the_first_large_batch(artifacts, monkeypatch):
+    path, X = artifacts
+    loads, load = [], joblib.load
+
+    def counting_load(*args, **kwargs):
+        loads.append(args)
+        return load(*args, **kwargs)
+    monkeypatch.setattr(joblib, "load", counting_load)
+
+    loaded = load_artifacts("v1", str(path / "model.pkl"), str(path / "compiled"),
+                            str(path / "feature_columns.csv"), None)
+    small = loaded.model.predict_proba(X[:MAX_COMPILED_ROWS])
+    assert loads == []
+    large = loaded.model.predict_proba(X)
+    loaded.model.predict_proba(X)
+    assert len(loads) == 1
+    np.testing.assert_allclose(small, large[:MAX_COMPILED_ROWS], atol=1e-5)
@@ -0,0 +1,61 @@
+# --- Smoke test for train.py ---
+# Runs `train.py search` end to end on a few thousand synthetic rows in a
+# scratch directory: trials in the process pool, the refit, the threshold and
+# the saved artifacts.
+#
+#   python -m pytest -q test_train.py
+import json
+import os
+
+import numpy as np
+import pytest
+
+for module in ("pandas", "pyarrow", "sklearn", "xgboost", "joblib"):
+    pytest.importorskip(module)
+
+import pandas as pd
+
+TYPES = np.array(["CASH_IN", "CASH_OUT", "TRANSFER", "PAYMENT", "DEBIT"])
+
+def transactions(n, rng):
+    amount = rng.random(n) * 1000
+    fraud = (rng.random(n) < 0.05) | (amount > 950)
+    return {
+        "type": TYPES[rng.integers(0, len(TYPES), n)],
+        "wallet_ratio": rng.random(n),
+        "hour_of_day": rng.integers(0, 24, n),
+        "amount": amount,
+        "receiver_freq": rng.integers(0, 50, n),
+        "sender_freq": rng.integers(0, 50, n),
+        "is_merchant": rng.integers(0, 2, n),
+    }, fraud
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    rng = np.random.default_rng(100)
+    os.makedirs(tmp_path / "data" / "app_transactions")
+    base, fraud = transactions(3000, rng)
+    pd.DataFrame({**base, "isFraud": fraud.astype(int)}).to_csv(tmp_path / "data" / "cleaned_dataset.csv", index=False)
+    app, fraud = transactions(600, rng)
+    pd.DataFrame({
+        **app,
+        "uid": rng.integers(0, 50, len(fraud)).astype(str),
+        "txn_id": np.arange(len(fraud)).astype(str),
+        "label": np.where(fraud, "fraud", "legit"),
+    }).to_parquet(tmp_path / "data" / "app_transactions" / "part-00000.parquet")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def test_search_saves_model_and_meta(workdir):
+    import train
+
+    train.main(["search", "--trials", "2", "--workers", "2"])
+
+    with open(workdir / "fraud_model.meta.json") as f:
+        meta = json.load(f)
+    assert 0.0 < meta["threshold"] < 1.0
+    assert meta["feature_columns"] == train.FEATURE_COLUMNS
+    with open(workdir / "fraud_model.state.json") as f:
+        assert len(json.load(f)["app_parts"]) == 1
+    assert (workdir / "fraud_model.pkl").exists()
+    assert (workdir / "fraud_model_compiled").is_dir()
@@ -1,88 +1,622 @@
-import pandas as pd, numpy as np, re
+import pandas as pd, numpy as np, re, os
+import argparse, hashlib, itertools, json, random, resource
+from concurrent.futures import ProcessPoolExecutor
 import joblib
 import xgboost as xgb
+from compiled_model import compile_model
+import drift
+import features
+from features import VELOCITY_COLUMNS, build_features
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import roc_auc_score, f1_score
 
 
 # --- Config ---
 RAW = "data/cleaned_dataset.csv"          
-NEW = "data/app_transactions.csv"        
+NEW = "data/app_transactions"             # Parquet parts written by export_data.py
+NEW_CSV = "data/app_transactions.csv"     # older single-file exports
+CACHE_DIR = "data/cache"                  # prepared feature arrays, keyed by source file hash
+MODEL_OUT = "fraud_model.pkl"
+META_OUT = "fraud_model.meta.json"        # threshold + training metrics, read by app.py
+STATE_OUT = "fraud_model.state.json"      # which inputs the saved model has already seen
 TARGET = "isFraud"
-FEATURE_COLUMNS = [
-    'wallet_ratio', 'hour_of_day', 'amount',
-    'receiver_freq', 'sender_freq', 'is_merchant',
-    'type_CASH_IN', 'type_CASH_OUT', 'type_DEBIT', 'type_PAYMENT', 'type_TRANSFER'
-]
-
-# 1. Load + combine
-df_orig = pd.read_csv(RAW)
-df_new = pd.read_csv(NEW)
-
-# 1) Target: label -> isFraud (fallback to 'fraud' bool if present)
-if "label" in df_new.columns:
-    df_new[TARGET] = df_new["label"].map({"fraud":1, "legit":0})
-elif "fraud" in df_new.columns:
-    df_new[TARGET] = df_new["fraud"].astype(int)
-else:
-    raise ValueError("Need either 'label' or 'fraud' in app CSV.")
-
-# 2) Normalize type strings to base types then one-hot
-base = df_new["type"].astype(str).str.extract(r'(CASH_IN|CASH_OUT|PAYMENT|DEBIT|TRANSFER)', expand=False)
-dummies = pd.get_dummies(base, prefix="type")
-for col in ["type_CASH_IN","type_CASH_OUT","type_DEBIT","type_PAYMENT","type_TRANSFER"]:
-    if col not in dummies.columns:
-        dummies[col] = 0
-df_new = pd.concat([df_new, dummies], axis=1)
-
-# 3) Make sure numeric features are numeric; handle infinities
-num_cols = ['wallet_ratio','hour_of_day','amount','receiver_freq','sender_freq','is_merchant']
-for c in num_cols:
-    if c in df_new.columns:
-        df_new[c] = pd.to_numeric(df_new[c], errors="coerce")
-
-df_new.replace([np.inf, -np.inf], np.nan, inplace=True)
-
-# 4) Keep only the exact features + target, drop unusable rows
-need = FEATURE_COLUMNS + [TARGET]
-missing = [c for c in need if c not in df_new.columns]
-if missing:
-    raise ValueError(f"Missing in app CSV after prep: {missing}")
-df_new = df_new[need].dropna()
-
-df_all = pd.concat([df_orig, df_new], ignore_index=True)
-
-X = df_all[FEATURE_COLUMNS]
-y = df_all[TARGET].astype(int)
-
-# 2. Split
-X_train, X_test, y_train, y_test = train_test_split(
-    X, y, test_size=0.3, stratify=y, random_state=100
-)
-
-# 3. Imbalance handling
-non_fraud = (y_train == 0).sum()
-fraud = (y_train == 1).sum()
-scale_pos_weight = non_fraud / fraud
-
-# 4. Train model
-model = xgb.XGBClassifier(
-    n_estimators=200,
-    max_depth=4,
-    learning_rate=0.01,
-    scale_pos_weight=scale_pos_weight,
-    use_label_encoder=False,
-    eval_metric='logloss',
-    random_state=100
-)
-model.fit(X_train, y_train)
-
-# 5. Evaluate
-proba = model.predict_proba(X_test)[:, 1]
-y_pred = (proba >= 0.5).astype(int)
-print("AUC:", roc_auc_score(y_test, proba))
-print("F1 :", f1_score(y_test, y_pred))
-
-# 6. Save model + features
-joblib.dump(model, "fraud_model.pkl")
-pd.Series(FEATURE_COLUMNS).to_csv("feature_columns.csv", index=False)
+FEATURE_COLUMNS = features.FEATURE_COLUMNS  # plus VELOCITY_COLUMNS with --velocity (see use_velocity)
+DELTA_ROUNDS = 50                         # trees added per incremental run
+MIN_HOLDOUT_ROWS = 100                    # smaller deltas are all trained on, with no holdout
+SEARCH_SPACE = {
+    "max_depth": [3, 4, 5, 6],
+    "learning_rate": [0.01, 0.03, 0.05, 0.1],
+    "min_child_weight": [1, 5, 10],
+    "subsample": [0.7, 0.85, 1.0],
+    "colsample_bytree": [0.7, 0.85, 1.0],
+}
+SEARCH_MAX_ROUNDS = 2000
+EARLY_STOPPING_ROUNDS = 50
+FN_COST = 100.0                           # cost of a missed fraud relative to...
+FP_COST = 1.0                             # ...a legit transaction sent to OTP verification
+OOC_CHUNK_ROWS = 200_000                  # rows per chunk fed to XGBoost in --out-of-core mode
+TEST_PERCENT = 30                         # holdout share, assigned by key hash in --out-of-core mode
+
+
+def use_velocity(enabled):
+    """Select the feature set. Base-dataset rows have no velocity history, so theirs are NaN."""
+    global FEATURE_COLUMNS
+    FEATURE_COLUMNS = features.FEATURE_COLUMNS + (VELOCITY_COLUMNS if enabled else [])
+
+
+def cache_key(kind, path):
+    # Prepared arrays (and the incremental-training state) depend on the feature set too
+    suffix = "-vel" if FEATURE_COLUMNS != features.FEATURE_COLUMNS else ""
+    return f"{kind}-{file_hash(path)}{suffix}"
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()[:16]
+
+
+def cached(key, build):
+    """Load prepared arrays from CACHE_DIR/<key>/, building and saving them on a miss."""
+    path = os.path.join(CACHE_DIR, key)
+    if os.path.isdir(path):
+        return {f[:-4]: np.load(os.path.join(path, f), mmap_mode="r") for f in os.listdir(path) if f.endswith(".npy")}
+    arrays = build()
+    tmp = path + ".tmp"
+    os.makedirs(tmp, exist_ok=True)
+    for name, a in arrays.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), a)
+    os.replace(tmp, path)
+    return arrays
+
+
+def prepare_app(df_new):
+    """Turn exported app transactions into (X, y, rows kept)."""
+    # 1) Target: label -> isFraud (fallback to 'fraud' bool if present)
+    if "label" in df_new.columns:
+        df_new[TARGET] = df_new["label"].map({"fraud":1, "legit":0})
+    elif "fraud" in df_new.columns:
+        df_new[TARGET] = df_new["fraud"].astype(int)
+    else:
+        raise ValueError("Need either 'label' or 'fraud' in app CSV.")
+
+    # 2) Type extraction, one-hot and numeric coercion: the same code serving uses
+    try:
+        X = build_features(df_new, FEATURE_COLUMNS)
+    except KeyError as e:
+        raise ValueError(f"Missing in app CSV after prep: {e}")
+
+    # 3) Drop unusable rows (a missing required feature or unknown label)
+    required = [j for j, c in enumerate(FEATURE_COLUMNS) if c not in features.OPTIONAL_COLUMNS]
+    y = df_new[TARGET].to_numpy(np.float64)
+    keep = ~(np.isnan(X[:, required]).any(axis=1) | np.isnan(y))
+    return X[keep], y[keep].astype(np.int8), df_new[keep]
+
+
+def load_base():
+    key = cache_key("base", RAW)
+
+    def build():
+        df_orig = pd.read_csv(RAW)
+        return {"X": build_features(df_orig, FEATURE_COLUMNS), "y": df_orig[TARGET].to_numpy(np.int8)}
+
+    return key, cached(key, build)
+
+
+def load_app_parts():
+    """[(key, arrays)] for every export part; only parts not seen before are preprocessed."""
+    if os.path.isdir(NEW):
+        paths = sorted(os.path.join(NEW, f) for f in os.listdir(NEW) if f.startswith("part-") and f.endswith(".parquet"))
+        read = pd.read_parquet
+    else:
+        paths = [NEW_CSV]
+        read = pd.read_csv
+
+    parts = []
+    for path in paths:
+        key = cache_key("app", path)
+
+        def build(path=path):
+            X, y, df = prepare_app(read(path))
+            ids = (df["uid"].astype(str) + "/" + df["txn_id"].astype(str)) if "txn_id" in df.columns else df.index.astype(str)
+            return {"X": X, "y": y, "ids": np.asarray(ids, dtype=str)}
+
+        parts.append((key, cached(key, build)))
+    return parts
+
+
+def latest_rows(parts):
+    """Per part, the sorted indices of its rows that are the latest export of their transaction."""
+    if not parts:
+        return []
+    ids = np.concatenate([p["ids"] for _, p in parts])
+    # np.unique keeps the first occurrence, so search the reversed order for the latest
+    _, first_from_end = np.unique(ids[::-1], return_index=True)
+    keep = np.zeros(len(ids), dtype=bool)
+    keep[len(ids) - 1 - first_from_end] = True
+    rows, offset = [], 0
+    for _, p in parts:
+        rows.append(np.flatnonzero(keep[offset:offset + len(p["ids"])]))
+        offset += len(p["ids"])
+    return rows
+
+
+def combine_parts(parts):
+    """Stack parts, keeping only the latest row for a transaction exported more than once."""
+    if not parts:
+        return np.empty((0, len(FEATURE_COLUMNS)), np.float32), np.empty(0, np.int8)
+    rows = latest_rows(parts)
+    X = np.concatenate([p["X"][r] for (_, p), r in zip(parts, rows)])
+    y = np.concatenate([p["y"][r] for (_, p), r in zip(parts, rows)])
+    return X, y
+
+
+def frame(X):
+    # Training on a DataFrame keeps the feature names on the booster
+    return pd.DataFrame(X, columns=FEATURE_COLUMNS, copy=False)
+
+
+def evaluate(model, X_test, y_test):
+    """Print holdout AUC/F1; returns the holdout fraud scores."""
+    proba = model.predict_proba(frame(X_test))[:, 1]
+    y_pred = (proba >= 0.5).astype(int)
+    if len(np.unique(y_test)) < 2:
+        print("Holdout has a single class; skipping AUC/F1")
+        return proba
+    print("AUC:", roc_auc_score(y_test, proba))
+    print("F1 :", f1_score(y_test, y_pred))
+    return proba
+
+
+def split(X, y):
+    # Stratify whenever every class has enough rows to appear on both sides
+    stratify = y if len(np.unique(y)) == 2 and np.bincount(y).min() >= 2 else None
+    return train_test_split(X, y, test_size=0.3, stratify=stratify, random_state=100)
+
+
+def train_full(X, y):
+    # 2. Split
+    X_train, X_test, y_train, y_test = split(X, y)
+
+    # 3. Imbalance handling
+    non_fraud = (y_train == 0).sum()
+    fraud = (y_train == 1).sum()
+    scale_pos_weight = non_fraud / fraud
+
+    # 4. Train model
+    model = xgb.XGBClassifier(
+        n_estimators=200,
+        max_depth=4,
+        learning_rate=0.01,
+        scale_pos_weight=scale_pos_weight,
+        use_label_encoder=False,
+        eval_metric='logloss',
+        random_state=100
+    )
+    model.fit(frame(X_train), y_train)
+
+    # 5. Evaluate
+    return model, evaluate(model, X_test, y_test)
+
+
+def train_incremental(previous, X_delta, y_delta, rounds):
+    """Continue boosting the previous model on rows it has not seen yet."""
+    if len(y_delta) < MIN_HOLDOUT_ROWS:
+        # A nightly run may bring a handful of labels: too few to split, or all of one class
+        print(f"Only {len(y_delta)} new rows; training on all of them, no holdout")
+        X_train, X_test, y_train, y_test = X_delta, None, y_delta, None
+    else:
+        X_train, X_test, y_train, y_test = split(X_delta, y_delta)
+    # xgb.train rather than XGBClassifier.fit, which rejects a delta holding only fraud rows
+    booster = xgb.train(previous.get_xgb_params(), xgb.DMatrix(frame(X_train), label=y_train),
+                        num_boost_round=rounds, xgb_model=previous.get_booster())
+    model = xgb.XGBClassifier(**previous.get_params())
+    model.load_model(bytearray(booster.save_raw(raw_format="ubj")))
+    if X_test is not None:
+        evaluate(model, X_test, y_test)
+    return model
+
+
+# --- Hyperparameter search ---
+# The search never concatenates the dataset. Its rows are the base arrays plus
+# the latest rows of each export part, all memory-mapped from CACHE_DIR, and
+# each split is streamed from them a chunk at a time. A worker therefore holds
+# its quantised matrices (1 byte per value) and one chunk, not a float copy.
+_worker = {}
+TRAIN, VALID, TEST = 0, 1, 2
+
+
+def search_plan(base_key, base, parts):
+    """Rows kept per part and the split of every row, cached so that workers memory-map them too."""
+    digest = hashlib.sha256(" ".join([base_key] + [k for k, _ in parts]).encode()).hexdigest()[:16]
+
+    def build():
+        rows = latest_rows(parts)
+        y = np.concatenate([base["y"]] + [p["y"][r] for (_, p), r in zip(parts, rows)])
+        # train / valid (early stopping + threshold) / test: split() and then halve the holdout
+        _, hold, _, y_hold = split(np.arange(len(y)), y)
+        valid, test = train_test_split(hold, test_size=0.5, stratify=y_hold, random_state=100)
+        side = np.full(len(y), TRAIN, dtype=np.int8)
+        side[valid] = VALID
+        side[test] = TEST
+        return {"side": side, "y": y, **{f"rows{i}": r for i, r in enumerate(rows)}}
+
+    return cached(f"search-{digest}", build)
+
+
+def search_sources(base, parts, plan):
+    """[(X, y, rows)] in row order; rows=None takes every row."""
+    return [(base["X"], base["y"], None)] + [(p["X"], p["y"], plan[f"rows{i}"]) for i, (_, p) in enumerate(parts)]
+
+
+def split_chunks(sources, side, which):
+    """(X, y) chunks of at most OOC_CHUNK_ROWS rows for one side of the split."""
+    offset = 0
+    for X, y, rows in sources:
+        n = len(y) if rows is None else len(rows)
+        for start in range(0, n, OOC_CHUNK_ROWS):
+            stop = min(start + OOC_CHUNK_ROWS, n)
+            mask = side[offset + start:offset + stop] == which
+            if mask.any():
+                index = (np.arange(start, stop) if rows is None else rows[start:stop])[mask]
+                yield X[index], y[index].astype(np.int8)
+        offset += n
+
+
+def split_arrays(sources, side, which):
+    chunks = list(split_chunks(sources, side, which))
+    if not chunks:
+        return np.empty((0, len(FEATURE_COLUMNS))), np.empty(0, np.int8)
+    return np.concatenate([X for X, _ in chunks]), np.concatenate([y for _, y in chunks])
+
+
+class ChunkIter(xgb.DataIter):
+    """Feeds one side of the search split into a QuantileDMatrix, one chunk at a time."""
+
+    def __init__(self, sources, side, which):
+        self._args = (sources, side, which)
+        self._chunks = None
+        super().__init__()
+
+    def next(self, input_data):
+        if self._chunks is None:
+            self._chunks = split_chunks(*self._args)
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return 0
+        input_data(data=frame(chunk[0]), label=chunk[1])
+        return 1
+
+    def reset(self):
+        self._chunks = None
+
+
+def _init_search_worker(nthread, velocity, scale_pos_weight):
+    # Each worker quantises the training data once and reuses it for all its trials
+    use_velocity(velocity)
+    base_key, base = load_base()
+    parts = load_app_parts()
+    plan = search_plan(base_key, base, parts)
+    sources = search_sources(base, parts, plan)
+    dtrain = xgb.QuantileDMatrix(ChunkIter(sources, plan["side"], TRAIN), nthread=nthread)
+    _worker["dtrain"] = dtrain
+    _worker["dvalid"] = xgb.QuantileDMatrix(ChunkIter(sources, plan["side"], VALID), ref=dtrain, nthread=nthread)
+    _worker["scale_pos_weight"] = scale_pos_weight
+    _worker["nthread"] = nthread
+
+
+def base_params(scale_pos_weight, nthread):
+    return {
+        "objective": "binary:logistic",
+        "eval_metric": "auc",
+        "tree_method": "hist",
+        "scale_pos_weight": scale_pos_weight,
+        "seed": 100,
+        "nthread": nthread,
+    }
+
+
+def _run_trial(trial):
+    params = {**base_params(_worker["scale_pos_weight"], _worker["nthread"]), **trial}
+    booster = xgb.train(
+        params, _worker["dtrain"], num_boost_round=SEARCH_MAX_ROUNDS,
+        evals=[(_worker["dvalid"], "valid")], early_stopping_rounds=EARLY_STOPPING_ROUNDS, verbose_eval=False,
+    )
+    return trial, booster.best_iteration, booster.best_score
+
+
+def cost_optimal_threshold(y_true, proba, fn_cost, fp_cost):
+    """Threshold minimising fn_cost * missed frauds + fp_cost * false alarms."""
+    thresholds = np.linspace(0.01, 0.99, 99)
+    order = np.argsort(proba)
+    p, t = proba[order], y_true[order]
+    # Rows strictly below each threshold are predicted legit
+    below = np.searchsorted(p, thresholds, side="left")
+    fraud_below = np.concatenate([[0], np.cumsum(t)])[below]
+    fn = fraud_below
+    fp = (len(t) - below) - (t.sum() - fraud_below)
+    cost = fn_cost * fn + fp_cost * fp
+    best = int(np.argmin(cost))
+    return float(thresholds[best]), float(cost[best])
+
+
+def search(trials, workers, fn_cost, fp_cost):
+    base_key, base = load_base()
+    parts = load_app_parts()
+    part_keys = [k for k, _ in parts]
+    plan = search_plan(base_key, base, parts)  # built here once; the workers read it back from the cache
+    sources = search_sources(base, parts, plan)
+    side = np.asarray(plan["side"])
+    y_train = np.asarray(plan["y"])[side == TRAIN]
+    scale_pos_weight = (y_train == 0).sum() / (y_train == 1).sum()
+
+    grid = list(itertools.product(*SEARCH_SPACE.values()))
+    random.Random(100).shuffle(grid)
+    candidates = [dict(zip(SEARCH_SPACE, values)) for values in grid[:trials]]
+
+    nthread = max(1, (os.cpu_count() or 1) // workers)
+    velocity = FEATURE_COLUMNS != features.FEATURE_COLUMNS
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_search_worker,
+                             initargs=(nthread, velocity, scale_pos_weight)) as pool:
+        results = []
+        for trial, best_iteration, score in pool.map(_run_trial, candidates):
+            results.append((score, best_iteration, trial))
+            print(f"valid AUC {score:.5f} @ {best_iteration + 1:4d} rounds  {trial}")
+
+    score, best_iteration, trial = max(results, key=lambda r: r[0])
+    print(f"Best: valid AUC {score:.5f}, {best_iteration + 1} rounds, {trial}")
+
+    # Refit the winner for exactly its best number of rounds, streaming the training rows like the workers
+    dtrain = xgb.QuantileDMatrix(ChunkIter(sources, side, TRAIN))
+    booster = xgb.train({**base_params(scale_pos_weight, os.cpu_count() or 1), **trial}, dtrain,
+                        num_boost_round=best_iteration + 1)
+    # Wrapped in the sklearn estimator app.py expects; its params are kept for train_incremental
+    model = xgb.XGBClassifier(
+        n_estimators=best_iteration + 1, **trial,
+        scale_pos_weight=scale_pos_weight, tree_method="hist", eval_metric="auc", random_state=100,
+    )
+    model.load_model(bytearray(booster.save_raw(raw_format="ubj")))
+
+    X_valid, y_valid = split_arrays(sources, side, VALID)
+    X_test, y_test = split_arrays(sources, side, TEST)
+    threshold, valid_cost = cost_optimal_threshold(y_valid, model.predict_proba(frame(X_valid))[:, 1], fn_cost, fp_cost)
+    proba = model.predict_proba(frame(X_test))[:, 1]
+    metrics = {
+        "valid_auc": score,
+        "test_auc": float(roc_auc_score(y_test, proba)),
+        "test_f1": float(f1_score(y_test, (proba >= threshold).astype(int))),
+        "valid_cost": valid_cost,
+    }
+    print(f"Threshold {threshold:.2f} (FN cost {fn_cost}, FP cost {fp_cost}); test {metrics}")
+
+    save(model, base_key, part_keys, meta={
+        "threshold": threshold,
+        "params": {**trial, "n_estimators": best_iteration + 1},
+        "costs": {"fn": fn_cost, "fp": fp_cost},
+        "metrics": metrics,
+        "feature_columns": FEATURE_COLUMNS,
+        # The holdout is a stratified random sample of the same rows, so its quantiles stand in for the full data's
+        "drift_reference": drift.reference(np.concatenate([X_valid, X_test]), FEATURE_COLUMNS, proba),
+    })
+
+
+# --- Out-of-core training ---
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # ru_maxrss is KiB on Linux
+
+
+def in_test_split(keys):
+    # Hash-based split: deterministic per key, ~TEST_PERCENT of each class, no copies of the data
+    return pd.util.hash_array(np.asarray(keys)) % 100 < TEST_PERCENT
+
+
+def app_part_paths():
+    if os.path.isdir(NEW):
+        return sorted(os.path.join(NEW, f) for f in os.listdir(NEW) if f.startswith("part-") and f.endswith(".parquet"))
+    return []
+
+
+def latest_part_per_id(paths):
+    """(sorted 64-bit id hashes, index of the last part containing each id); only the id columns are read.
+
+    12 bytes per exported row, built once per training run and shared by every
+    pass. A hash collision between two ids would drop the older one's row.
+    """
+    hashes, part = [], []
+    for i, path in enumerate(paths):
+        ids = pd.read_parquet(path, columns=["uid", "txn_id"])
+        hashes.append(pd.util.hash_array((ids["uid"].astype(str) + "/" + ids["txn_id"].astype(str)).to_numpy()))
+        part.append(np.full(len(ids), i, dtype=np.int32))
+    if not hashes:
+        return np.empty(0, np.uint64), np.empty(0, np.int32)
+    hashes, part = np.concatenate(hashes), np.concatenate(part)
+    # np.unique keeps the first occurrence, so search the reversed order for the latest
+    keys, first_from_end = np.unique(hashes[::-1], return_index=True)
+    return keys, part[::-1][first_from_end]
+
+
+def iter_chunks(latest=None):
+    """Yield (features DataFrame, target, keys) chunks from the base CSV and the app export.
+
+    `latest` is latest_part_per_id(app_part_paths()), computed by the caller so
+    that repeated passes share it.
+    """
+    offset = 0
+    for df in pd.read_csv(RAW, usecols=features.FEATURE_COLUMNS + [TARGET], chunksize=OOC_CHUNK_ROWS):
+        keys = np.arange(offset, offset + len(df))
+        offset += len(df)
+        yield frame(build_features(df, FEATURE_COLUMNS)), df[TARGET].to_numpy(np.int8), keys
+
+    paths = app_part_paths()
+    if not paths:
+        for df in pd.read_csv(NEW_CSV, chunksize=OOC_CHUNK_ROWS):
+            X, y, df = prepare_app(df)
+            yield frame(X), y, "csv/" + df.index.astype(str)
+        return
+
+    import pyarrow.parquet as pq
+    keys, latest_part = latest if latest is not None else latest_part_per_id(paths)
+    for i, path in enumerate(paths):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=OOC_CHUNK_ROWS):
+            X, y, df = prepare_app(batch.to_pandas())
+            ids = (df["uid"].astype(str) + "/" + df["txn_id"].astype(str)).to_numpy()
+            keep = latest_part[np.searchsorted(keys, pd.util.hash_array(ids))] == i
+            yield frame(X[keep]), y[keep], ids[keep]
+
+
+class SplitIter(xgb.DataIter):
+    """Streams one side of the hash split into XGBoost, one chunk at a time."""
+
+    def __init__(self, test, latest=None, cache_prefix=None):
+        self._test = test
+        self._latest = latest
+        self._chunks = None
+        self.class_counts = None  # filled in on the first complete pass
+        self._counts = np.zeros(2, dtype=np.int64)
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self._chunks is None:
+            self._chunks = iter_chunks(self._latest)
+        for X, y, keys in self._chunks:
+            mask = in_test_split(keys) == self._test
+            if not mask.any():
+                continue
+            if self.class_counts is None:
+                self._counts += np.bincount(y[mask], minlength=2)
+            input_data(data=X[mask], label=y[mask])
+            return 1
+        return 0
+
+    def reset(self):
+        if self._chunks is not None and self.class_counts is None:
+            self.class_counts = self._counts.copy()
+        self._chunks = None
+
+
+def train_out_of_core(cache_prefix=None):
+    """Train without ever holding the full dataset in memory.
+
+    QuantileDMatrix keeps only the quantised (1 byte per value) matrix; with
+    cache_prefix the pages live on disk instead (XGBoost external memory).
+    """
+    # 2. Split (by key hash, while streaming); re-exports are resolved once for every pass
+    latest = latest_part_per_id(app_part_paths())
+    train_iter = SplitIter(test=False, latest=latest, cache_prefix=cache_prefix)
+    if cache_prefix:
+        dtrain = xgb.DMatrix(train_iter)
+        dtest = xgb.DMatrix(SplitIter(test=True, latest=latest, cache_prefix=cache_prefix + "-test"))
+    else:
+        dtrain = xgb.QuantileDMatrix(train_iter)
+        dtest = xgb.QuantileDMatrix(SplitIter(test=True, latest=latest), ref=dtrain)
+    print(f"Built matrices ({dtrain.num_row()} train / {dtest.num_row()} test rows), peak RSS {peak_rss_mb():.0f} MB")
+
+    # 3. Imbalance handling (class counts gathered on the first pass)
+    non_fraud, fraud = train_iter.class_counts
+
+    # 4. Train model (same hyperparameters as train_full)
+    params = {
+        "objective": "binary:logistic",
+        "max_depth": 4,
+        "learning_rate": 0.01,
+        "scale_pos_weight": non_fraud / fraud,
+        "eval_metric": "logloss",
+        "seed": 100,
+        "tree_method": "hist",
+    }
+    booster = xgb.train(params, dtrain, num_boost_round=200)
+    print(f"Trained, peak RSS {peak_rss_mb():.0f} MB")
+
+    # 5. Evaluate
+    proba = booster.predict(dtest)
+    y_test = dtest.get_label().astype(int)
+    print("AUC:", roc_auc_score(y_test, proba))
+    print("F1 :", f1_score(y_test, (proba >= 0.5).astype(int)))
+
+    # Wrap in the sklearn estimator app.py expects (predict_proba)
+    model = xgb.XGBClassifier()
+    model.load_model(bytearray(booster.save_raw(raw_format="ubj")))
+    return model
+
+
+def load_state():
+    if not (os.path.exists(STATE_OUT) and os.path.exists(MODEL_OUT)):
+        return None
+    with open(STATE_OUT) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the fraud model.")
+    parser.add_argument("--full", action="store_true", help="retrain from scratch even if an incremental update is possible")
+    parser.add_argument("--delta-rounds", type=int, default=DELTA_ROUNDS, help="trees to add when training incrementally")
+    parser.add_argument("--out-of-core", action="store_true", help="stream the data through XGBoost in chunks (always a full retrain)")
+    parser.add_argument("--cache-prefix", help="with --out-of-core, keep XGBoost's pages on disk under this prefix")
+    parser.add_argument("--velocity", action="store_true", help="add the sliding-window velocity features (velocity.py)")
+    commands = parser.add_subparsers(dest="command")
+    search_cmd = commands.add_parser("search", help="parallel hyperparameter search + cost-based threshold")
+    search_cmd.add_argument("--trials", type=int, default=32)
+    search_cmd.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    search_cmd.add_argument("--fn-cost", type=float, default=FN_COST, help="cost of a missed fraud")
+    search_cmd.add_argument("--fp-cost", type=float, default=FP_COST, help="cost of a false alarm")
+    args = parser.parse_args(argv)
+    use_velocity(args.velocity)
+
+    if args.command == "search":
+        search(args.trials, args.workers, args.fn_cost, args.fp_cost)
+        return
+
+    if args.out_of_core:
+        model = train_out_of_core(args.cache_prefix)
+        base_key = cache_key("base", RAW)
+        part_keys = [cache_key("app", p) for p in (app_part_paths() or [NEW_CSV])]
+        save(model, base_key, part_keys, meta={"threshold": 0.5})
+        print(f"Peak RSS: {peak_rss_mb():.0f} MB")
+        return
+
+    # 1. Load (cached per source file) + combine
+    base_key, base = load_base()
+    parts = load_app_parts()
+    part_keys = [k for k, _ in parts]
+
+    state = None if args.full else load_state()
+    incremental = bool(state) and state["base"] == base_key and set(state["app_parts"]) <= set(part_keys)
+
+    if incremental:
+        delta = [(k, p) for k, p in parts if k not in state["app_parts"]]
+        X_delta, y_delta = combine_parts(delta)
+        if len(y_delta) == 0:
+            print("No new labeled rows since the last run; model unchanged")
+            return
+        print(f"Incremental: continuing {MODEL_OUT} on {len(y_delta)} new rows (+{args.delta_rounds} trees)")
+        model = train_incremental(joblib.load(MODEL_OUT), X_delta, y_delta, args.delta_rounds)
+        meta = None  # keep the threshold chosen for the model being continued
+    else:
+        X_app, y_app = combine_parts(parts)
+        X = np.concatenate([base["X"], X_app])
+        y = np.concatenate([base["y"], y_app]).astype(int)
+        print(f"Full retrain on {len(y)} rows")
+        model, test_scores = train_full(X, y)
+        # Live traffic is compared with these histograms (drift.py, GET /api/drift)
+        meta = {"threshold": 0.5, "drift_reference": drift.reference(X, FEATURE_COLUMNS, test_scores)}
+
+    save(model, base_key, part_keys, meta)
+    print(f"Peak RSS: {peak_rss_mb():.0f} MB")
+
+
+def save(model, base_key, part_keys, meta=None):
+    # 6. Save model + features
+    joblib.dump(model, MODEL_OUT)
+    compile_model(model).save("fraud_model_compiled")  # NumPy-only predictor for app.py (COMPILED_MODEL_PATH)
+    pd.Series(FEATURE_COLUMNS).to_csv("feature_columns.csv", index=False)
+    if meta is not None:
+        with open(META_OUT, "w") as f:
+            json.dump(meta, f, indent=2)
+    with open(STATE_OUT, "w") as f:
+        json.dump({"base": base_key, "app_parts": part_keys}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
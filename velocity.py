@@ -0,0 +1,172 @@
+# --- Sliding-window Velocity Index ---
+# Per-user transaction counts and amount sums over the last 1m / 1h / 24h, by
+# base type, held in fixed-size ring buffers: each window is BUCKETS time
+# buckets (1 s, 1 min and 24 min wide), so a lookup or an update touches the
+# same few small arrays no matter how many transactions the user has. Windows
+# are approximate to one bucket at their far edge.
+#
+# Users are kept in an LRU bounded by VELOCITY_MEMORY_MB per worker. A user not
+# in memory is seeded with one Firestore query over their last 24 hours; after
+# that, every ledger write made by this worker is recorded. Writes made by
+# other workers reach this worker's copy only when the user is re-seeded, which
+# happens after eviction or, with VELOCITY_RESEED_SECONDS set, periodically.
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+from features import TYPES, VELOCITY_WINDOWS, type_index
+
+BUCKETS = 60
+MEMORY_MB = float(os.getenv("VELOCITY_MEMORY_MB", "64"))
+RESEED_SECONDS = float(os.getenv("VELOCITY_RESEED_SECONDS", "0"))  # 0: seed once per residency
+
+_WIDTHS = np.array([seconds / BUCKETS for seconds in VELOCITY_WINDOWS.values()])
+_ROWS = np.arange(len(_WIDTHS))
+
+class UserWindows:
+    __slots__ = ("counts", "amounts", "stamps", "seeded_at")
+
+    def __init__(self, seeded_at):
+        shape = (len(_WIDTHS), BUCKETS, len(TYPES))
+        self.counts = np.zeros(shape, dtype=np.float32)
+        self.amounts = np.zeros(shape, dtype=np.float32)
+        self.stamps = np.full((len(_WIDTHS), BUCKETS), -1, dtype=np.int64)  # absolute bucket number per slot
+        self.seeded_at = seeded_at
+
+    @staticmethod
+    def nbytes():
+        shape = (len(_WIDTHS), BUCKETS, len(TYPES))
+        # Two float32 cubes, the int64 stamps, plus a rough allowance for object/LRU overhead
+        return 2 * 4 * int(np.prod(shape)) + 8 * len(_WIDTHS) * BUCKETS + 512
+
+    def add(self, type_idx, amount, ts):
+        if type_idx < 0:
+            return
+        current = (ts // _WIDTHS).astype(np.int64)
+        slots = current % BUCKETS
+        held = self.stamps[_ROWS, slots]
+        # A slot holding a newer bucket means ts is already outside that window
+        rows = _ROWS[held <= current]
+        slots, current, held = slots[rows], current[rows], held[rows]
+        stale = held != current
+        if stale.any():
+            # Bucket last used a full window ago (or never): reuse it for this one
+            self.counts[rows[stale], slots[stale]] = 0
+            self.amounts[rows[stale], slots[stale]] = 0
+            self.stamps[rows[stale], slots[stale]] = current[stale]
+        self.counts[rows, slots, type_idx] += 1
+        self.amounts[rows, slots, type_idx] += amount
+
+    def totals(self, now):
+        """(counts, amounts), each shaped (windows, types), over the buckets inside each window."""
+        current = (now // _WIDTHS).astype(np.int64)[:, None]
+        live = ((self.stamps > current - BUCKETS) & (self.stamps <= current))[:, :, None]
+        return (self.counts * live).sum(axis=1), (self.amounts * live).sum(axis=1)
+
+def _to_seconds(ts):
+    if hasattr(ts, "timestamp"):
+        return ts.timestamp()
+    return float(ts)
+
+class VelocityIndex:
+    def __init__(self, load_history, memory_mb=MEMORY_MB, reseed_seconds=RESEED_SECONDS):
+        # load_history(uid, since) -> iterable of transaction dicts with type, amount, timestamp
+        self.load_history = load_history
+        self.max_users = max(1, int(memory_mb * 1024 * 1024 // UserWindows.nbytes()))
+        self.reseed_seconds = reseed_seconds
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _seed(self, uid, now):
+        windows = UserWindows(seeded_at=now)
+        txns = list(self.load_history(uid, now - max(VELOCITY_WINDOWS.values())))
+        if txns:
+            types = type_index([t.get("type") or "" for t in txns])
+            for t, type_idx in zip(txns, types):
+                windows.add(int(type_idx), float(t.get("amount") or 0), _to_seconds(t["timestamp"]))
+        return windows
+
+    def _get(self, uid, now):
+        with self._lock:
+            windows = self._users.get(uid)
+            if windows is not None and not (self.reseed_seconds and now - windows.seeded_at > self.reseed_seconds):
+                self._users.move_to_end(uid)
+                return windows
+
+        # Seed outside the lock: it waits on Firestore
+        windows = self._seed(uid, now)
+        with self._lock:
+            self._users[uid] = windows
+            self._users.move_to_end(uid)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return windows
+
+    def features(self, uid, tx_type, now=None):
+        """Velocity feature values (features.VELOCITY_COLUMNS) for a new `tx_type` transaction."""
+        now = time.time() if now is None else _to_seconds(now)
+        windows = self._get(uid, now)
+        type_idx = int(type_index([tx_type])[0])
+        with self._lock:
+            counts, amounts = windows.totals(now)
+        values = {}
+        for w, name in enumerate(VELOCITY_WINDOWS):
+            values[f"vel_{name}_count"] = float(counts[w].sum())
+            values[f"vel_{name}_amount"] = float(amounts[w].sum())
+            values[f"vel_{name}_type_count"] = float(counts[w, type_idx]) if type_idx >= 0 else 0.0
+            values[f"vel_{name}_type_amount"] = float(amounts[w, type_idx]) if type_idx >= 0 else 0.0
+        return values
+
+    def record(self, uid, stored_type, amount, ts=None, seed=True):
+        """Fold a committed ledger entry into the user's windows.
+
+        With seed=False, users not already in memory are left alone; their next
+        seed reads the entry from Firestore anyway.
+        """
+        now = time.time() if ts is None else _to_seconds(ts)
+        if seed:
+            windows = self._get(uid, now)
+        else:
+            with self._lock:
+                windows = self._users.get(uid)
+            if windows is None:
+                return
+        type_idx = int(type_index([stored_type])[0])
+        with self._lock:
+            windows.add(type_idx, float(amount), now)
+
+    def stats(self):
+        return {"users": len(self._users), "max_users": self.max_users,
+                "bytes_per_user": UserWindows.nbytes()}
+
+def firestore_history(db):
+    """load_history for VelocityIndex backed by users/{uid}/transactions."""
+    from datetime import datetime, timezone
+
+    def load(uid, since):
+        start = datetime.fromtimestamp(since, tz=timezone.utc)
+        query = db.collection("users").document(uid).collection("transactions").where("timestamp", ">=", start)
+        txns = [doc.to_dict() for doc in query.stream()]
+        metrics.firestore_reads(max(1, len(txns)))
+        return txns
+    return load
+
+if __name__ == "__main__":
+    # Lookup/update cost and the per-user footprint, without Firestore
+    index = VelocityIndex(lambda uid, since: [])
+    rng = np.random.default_rng(100)
+    now = time.time()
+    for i in range(10_000):
+        index.record("bench", ["CASH_IN", "CASH_OUT", "TRANSFER Sent to +65"][i % 3], float(rng.random() * 100),
+                     now - rng.random() * 86400)
+    for name, fn in (("features", lambda: index.features("bench", "TRANSFER", now)),
+                     ("record", lambda: index.record("bench", "CASH_OUT", 10.0, now))):
+        start = time.perf_counter()
+        for _ in range(10_000):
+            fn()
+        print(f"{name:<9} {(time.perf_counter() - start) / 10_000 * 1e6:7.2f} us/call")
+    print(index.stats(), index.features("bench", "TRANSFER", now))